@@ -1,7 +1,7 @@
 from django.contrib import admin
 from unfold.admin import ModelAdmin
 
-from builds.models import Build
+from builds.models import Build, BuildArtifact
 
 
 # Register your models here.
@@ -9,3 +9,9 @@ from builds.models import Build
 @admin.register(Build)
 class BuildAdmin(ModelAdmin):
     pass
+
+
+@admin.register(BuildArtifact)
+class BuildArtifactAdmin(ModelAdmin):
+    list_display = ['key', 'size', 'hits', 'created_at', 'last_used_at']
+    ordering = ['-last_used_at']
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:49
+
+import django.db.models.deletion
+import django.utils.timezone
+import prefix_id.field
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builds', '0003_alter_build_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildArtifact',
+            fields=[
+                ('id', prefix_id.field.PrefixIDField(editable=False, max_length=31, prefix='artifact', primary_key=True, serialize=False, unique=True)),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('archive_file', models.FileField(max_length=255, upload_to='downloads/builds/cache')),
+                ('size', models.BigIntegerField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='build',
+            name='artifact',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='builds', to='builds.buildartifact'),
+        ),
+    ]
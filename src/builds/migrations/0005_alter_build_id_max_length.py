@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:28
+
+import prefix_id.field
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builds', '0004_build_artifact_cache'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='build',
+            name='id',
+            field=prefix_id.field.PrefixIDField(editable=False, max_length=255, prefix='build', primary_key=True, serialize=False, unique=True),
+        ),
+    ]
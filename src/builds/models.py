@@ -1,10 +1,28 @@
+from pathlib import Path
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from prefix_id import PrefixIDField
 
-from builds.services import BuildService
+
+class BuildArtifact(models.Model):
+    # Finished build archive shared by every Build with the same key, see BuildArtifactCache
+    id = PrefixIDField(prefix='artifact', primary_key=True)
+    key = models.CharField(max_length=64, unique=True)
+    archive_file = models.FileField(upload_to='downloads/builds/cache', max_length=255)
+    size = models.BigIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.key
+
+    def get_archive_path(self):
+        return Path(settings.MEDIA_ROOT) / self.archive_file.name
 
 
 class Build(models.Model):
@@ -14,6 +32,8 @@ class Build(models.Model):
     description = models.TextField()
     version = models.CharField(max_length=50)
     plugins_tags = models.ManyToManyField('plugins.Tag', related_name='builds')
+    artifact = models.ForeignKey(BuildArtifact, on_delete=models.SET_NULL, related_name='builds', blank=True,
+                                 null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -23,6 +43,6 @@ class Build(models.Model):
 
 @receiver(post_save, sender=Build)
 def build_post_save(sender, instance, created, **kwargs):
-    build_service = BuildService()
-    print(build_service.move_files(instance))
-    # print(build_service.archive_files(instance))
+    # After commit, when the admin has also saved plugins_tags
+    from builds.tasks import assemble_build
+    transaction.on_commit(lambda: assemble_build.delay(build_id=instance.id))
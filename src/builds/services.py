@@ -1,29 +1,123 @@
-from core.services import BaseFileManager, FileManager
-from plugins.models import PluginFile
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from builds.models import BuildArtifact
+from core.services import FileManager
+from plugins.models import PluginFile, Tag
 
 
 class BuildService:
     def __init__(self):
         self.file_manager = FileManager()
+        self.file_type_dirs = {
+            PluginFile.FileType.SMX: self.file_manager.plugins_dir,
+            PluginFile.FileType.SP: self.file_manager.scripting_dir,
+            PluginFile.FileType.CFG: self.file_manager.translations_dir,
+        }
 
     def move_files(self, build):
-        tags = build.plugins_tags.all()
+        # All files of the build's tags in one query, linked (not copied) from the blob store into a fresh
+        # tree that then replaces the previous one
+        files = PluginFile.objects.filter(tag__builds=build, file_type__in=self.file_type_dirs.keys()).only(
+            'file', 'file_type')
+        version_path = self.file_manager.base_builds_download_path / build.id / build.version
+        files_path = version_path / "files"
+        version_path.mkdir(parents=True, exist_ok=True)
+        # Unique per call, so concurrent assemblies of a build never write into the same staging tree
+        tmp_path = Path(tempfile.mkdtemp(dir=version_path, prefix=".files."))
         file_paths = []
-        for tag in tags:
-            files = tag.files.filter(
-                file_type__in=[PluginFile.FileType.SMX, PluginFile.FileType.SP, PluginFile.FileType.CFG]).all()
+        try:
             for file in files:
-                file_path = file.get_file_path()
-                if file.file_type == PluginFile.FileType.SMX:
-                    file_paths.append(self.file_manager.copy(file_path, self.file_manager.base_builds_download_path / build.id / build.version / "files" / "addons" / "sourcemod" / "plugins" / file.get_file_name()))
-                if file.file_type == PluginFile.FileType.SP:
-                    file_paths.append(self.file_manager.copy(file_path, self.file_manager.base_builds_download_path / build.id / build.version / "files" / "addons" / "sourcemod" / "scripting" / file.get_file_name()))
-                if file.file_type == PluginFile.FileType.CFG:
-                    file_paths.append(self.file_manager.copy(file_path, self.file_manager.base_builds_download_path / build.id / build.version / "files" / "addons" / "sourcemod" / "translations" / file.get_file_name()))
+                if not file.file:
+                    continue
+                relative_path = f"{self.file_type_dirs[file.file_type]}/{file.get_file_name()}"
+                self.file_manager.blob_store.link(file.get_file_path(), tmp_path / relative_path)
+                file_paths.append(files_path / relative_path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        old_path = tmp_path.with_name(f"{tmp_path.name}.old")
+        if files_path.exists():
+            files_path.rename(old_path)
+        tmp_path.rename(files_path)
+        shutil.rmtree(old_path, ignore_errors=True)
         return file_paths
 
-    def archive_files(self, build):
+    def archive_files(self, build, base_archive=None):
         dest_path = self.file_manager.base_builds_download_path / build.id
         base_path = self.file_manager.base_builds_download_path / build.id / build.version / "files"
-        archive_path = self.file_manager.zip(f"{build.name}-{build.version}.zip", base_path, dest_path)
+        if base_archive is None:
+            # Versions of a build differ by a few plugins, the newest archive's members are reused
+            archives = sorted(dest_path.glob("*.zip"), key=lambda archive: archive.stat().st_mtime_ns)
+            base_archive = archives[-1] if archives else None
+        archive_path = self.file_manager.zip(f"{build.name}-{build.version}.zip", base_path, dest_path, base_archive)
         return archive_path
+
+
+class BuildArtifactCache:
+    # Finished archives keyed by everything that goes into a build, shared by identical builds and
+    # LRU-evicted to stay within BUILDS_ARTIFACT_CACHE_SIZE bytes
+    def __init__(self):
+        self.file_manager = FileManager()
+        self.base_path = self.file_manager.base_builds_download_path / "cache"
+        self.max_size = settings.BUILDS_ARTIFACT_CACHE_SIZE
+
+    @staticmethod
+    def get_key(build):
+        digest = hashlib.sha256()
+        files = Tag.objects.filter(builds=build).order_by('id', 'files__file_type', 'files__sha256').values_list(
+            'id', 'files__file_type', 'files__sha256')
+        for tag_id, file_type, sha256 in files:
+            digest.update(f"{tag_id}\x00{file_type}\x00{sha256}\n".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        artifact = BuildArtifact.objects.filter(key=key).first()
+        if artifact is None:
+            return None
+        if not artifact.get_archive_path().exists():
+            artifact.delete()
+            return None
+        artifact.last_used_at = timezone.now()
+        BuildArtifact.objects.filter(pk=artifact.pk).update(last_used_at=artifact.last_used_at, hits=F('hits') + 1)
+        return artifact
+
+    def store(self, key, archive_path):
+        # Moves a finished archive (and its manifest) into the cache
+        cache_path = self.base_path / key[:2] / f"{key}.zip"
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.file_manager.get_manifest_path(archive_path)
+        os.replace(archive_path, cache_path)
+        if manifest_path.exists():
+            os.replace(manifest_path, self.file_manager.get_manifest_path(cache_path))
+        artifact, _ = BuildArtifact.objects.update_or_create(key=key, defaults={
+            "archive_file": cache_path.relative_to(settings.MEDIA_ROOT).as_posix(),
+            "size": cache_path.stat().st_size,
+            "last_used_at": timezone.now(),
+        })
+        self.evict(keep=artifact)
+        return artifact
+
+    def evict(self, keep=None):
+        total = BuildArtifact.objects.aggregate(total=Sum('size'))['total'] or 0
+        evicted = 0
+        artifacts = BuildArtifact.objects.order_by('last_used_at')
+        if keep is not None:
+            artifacts = artifacts.exclude(pk=keep.pk)
+        for artifact in artifacts.iterator():
+            if total <= self.max_size:
+                break
+            archive_path = artifact.get_archive_path()
+            archive_path.unlink(missing_ok=True)
+            self.file_manager.get_manifest_path(archive_path).unlink(missing_ok=True)
+            total -= artifact.size
+            artifact.delete()
+            evicted += 1
+        return evicted
@@ -0,0 +1,37 @@
+from celery import shared_task
+from celery.exceptions import Ignore
+
+from builds.models import Build
+from builds.services import BuildArtifactCache, BuildService
+
+
+@shared_task(bind=True, name='builds.tasks.assemble_build')
+def assemble_build(self, *args, **kwargs):
+    try:
+        build_id = kwargs.get("build_id")
+        build = Build.objects.select_related('artifact').get(id=build_id)
+        artifact_cache = BuildArtifactCache()
+        key = artifact_cache.get_key(build)
+        artifact = artifact_cache.get(key)
+        if artifact is not None:
+            Build.objects.filter(pk=build.pk).update(artifact=artifact)
+            return {
+                "status": "success",
+                "message": f"Reused the cached archive of {build.name} {build.version}",
+                "build_id": build.id,
+            }
+        build_service = BuildService()
+        file_paths = build_service.move_files(build)
+        # The build's previous archive, if still cached, is the base of the incremental zip
+        base_archive = build.artifact.get_archive_path() if build.artifact else None
+        archive_path = build_service.archive_files(build, base_archive)
+        artifact = artifact_cache.store(key, archive_path)
+        Build.objects.filter(pk=build.pk).update(artifact=artifact)
+        return {
+            "status": "success",
+            "message": f"Assembled {len(file_paths)} files for {build.name} {build.version}",
+            "build_id": build.id,
+        }
+    except Exception as e:
+        self.update_state(state='FAILURE', meta={'error': str(e)})
+        raise Ignore()
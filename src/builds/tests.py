@@ -1,3 +1,99 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save
+from django.test import TestCase, override_settings
+
+from builds.models import Build, build_post_save
+from builds.services import BuildArtifactCache, BuildService
+from core.services import BlobStore
+from plugins.models import Plugin, PluginFile, Tag
+
+
+class BuildTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Assembly is scheduled on commit, the tests call the services directly
+        post_save.disconnect(build_post_save, sender=Build)
+        self.addCleanup(post_save.connect, build_post_save, sender=Build)
+
+        self.user = get_user_model().objects.create(username="builder")
+        self.tags = [self.create_tag(index) for index in range(3)]
+
+    def create_tag(self, index):
+        plugin = Plugin.objects.create(name=f"Plugin {index}", original_name=f"plugin{index}", author="author",
+                                       url=f"https://forums.alliedmods.net/showthread.php?t={index}")
+        tag = Tag.objects.create(plugin=plugin, version="1.0")
+        for file_type in [PluginFile.FileType.SMX, PluginFile.FileType.SP]:
+            file_name = f"downloads/plugins/{plugin.id}/1.0/{file_type}/plugin{index}.{file_type}"
+            file_path = Path(self.media_root) / file_name
+            file_path.parent.mkdir(parents=True)
+            file_path.write_bytes(os.urandom(1024))
+            blob = BlobStore().add(file_path)
+            PluginFile.objects.create(tag=tag, file_type=file_type, file=file_name, sha256=blob.sha256)
+        return tag
+
+    def create_build(self, tags, **kwargs):
+        build = Build.objects.create(name="Build", author=self.user, description="", version="1", **kwargs)
+        build.plugins_tags.set(tags)
+        return build
+
+
+class BuildServiceTests(BuildTestCase):
+    def test_move_files_links_blobs_in_one_query(self):
+        build = self.create_build(self.tags)
+        with self.assertNumQueries(1):
+            file_paths = BuildService().move_files(build)
+        self.assertEqual(len(file_paths), 6)
+        for file_path in file_paths:
+            self.assertGreater(file_path.stat().st_nlink, 1)
+        self.assertEqual(sorted(path.parent.name for path in file_paths), ["plugins"] * 3 + ["scripting"] * 3)
+
+
+    def test_move_files_leaves_no_staging_trees(self):
+        build = self.create_build(self.tags)
+        service = BuildService()
+        service.move_files(build)
+        service.move_files(build)
+        version_path = Path(self.media_root) / "downloads/builds" / build.id / build.version
+        self.assertEqual([path.name for path in version_path.iterdir()], ["files"])
+
+        with mock.patch.object(service.file_manager.blob_store, "link", side_effect=OSError), \
+                self.assertRaises(OSError):
+            service.move_files(build)
+        self.assertEqual([path.name for path in version_path.iterdir()], ["files"])
+        self.assertEqual(len(list((version_path / "files").rglob("*.*"))), 6)
+
+class BuildArtifactCacheTests(BuildTestCase):
+    def test_identical_builds_share_a_key(self):
+        cache = BuildArtifactCache()
+        key = cache.get_key(self.create_build(self.tags))
+        self.assertEqual(cache.get_key(self.create_build(list(reversed(self.tags)))), key)
+        self.assertNotEqual(cache.get_key(self.create_build(self.tags[:2])), key)
+
+    def test_store_reuse_and_evict(self):
+        cache = BuildArtifactCache()
+        service = BuildService()
+        artifacts = []
+        for tags in [self.tags, self.tags[:1]]:
+            build = self.create_build(tags)
+            service.move_files(build)
+            artifacts.append(cache.store(cache.get_key(build), service.archive_files(build)))
+
+        reused = cache.get(artifacts[0].key)
+        self.assertEqual(reused.pk, artifacts[0].pk)
+
+        # The least recently used artifact goes first
+        cache.max_size = artifacts[0].size
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get(artifacts[1].key))
+        self.assertFalse(artifacts[1].get_archive_path().exists())
+        self.assertIsNotNone(cache.get(artifacts[0].key))
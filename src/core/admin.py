@@ -13,6 +13,8 @@ from django_celery_beat.admin import PeriodicTaskForm, TaskSelectWidget
 from unfold.admin import ModelAdmin
 from unfold.widgets import UnfoldAdminSelectWidget, UnfoldAdminTextInputWidget
 
+from core.models import TaskResultAggregate
+
 admin.site.unregister(PeriodicTask)
 admin.site.unregister(IntervalSchedule)
 admin.site.unregister(CrontabSchedule)
@@ -52,4 +54,11 @@ class SolarScheduleAdmin(ModelAdmin):
 
 @admin.register(ClockedSchedule)
 class ClockedScheduleAdmin(BaseClockedScheduleAdmin, ModelAdmin):
-    pass
\ No newline at end of file
+    pass
+
+
+@admin.register(TaskResultAggregate)
+class TaskResultAggregateAdmin(ModelAdmin):
+    list_display = ['task_name', 'period', 'count', 'failures', 'duration_p50', 'duration_p95', 'duration_max']
+    list_filter = ['task_name', 'period']
+    ordering = ['-period', 'task_name']
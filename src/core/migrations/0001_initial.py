@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:21
+
+import django.utils.timezone
+import prefix_id.field
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedPage',
+            fields=[
+                ('id', prefix_id.field.PrefixIDField(editable=False, max_length=27, prefix='page', primary_key=True, serialize=False, unique=True)),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('etag', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=255, null=True)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('checked_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
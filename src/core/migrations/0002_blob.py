@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:26
+
+import django.utils.timezone
+import prefix_id.field
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', prefix_id.field.PrefixIDField(editable=False, max_length=27, prefix='blob', primary_key=True, serialize=False, unique=True)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
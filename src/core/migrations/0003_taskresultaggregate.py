@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:42
+
+import prefix_id.field
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskResultAggregate',
+            fields=[
+                ('id', prefix_id.field.PrefixIDField(editable=False, max_length=32, prefix='taskstats', primary_key=True, serialize=False, unique=True)),
+                ('task_name', models.CharField(max_length=255)),
+                ('period', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('duration_count', models.PositiveIntegerField(default=0)),
+                ('duration_avg', models.FloatField(blank=True, null=True)),
+                ('duration_p50', models.FloatField(blank=True, null=True)),
+                ('duration_p95', models.FloatField(blank=True, null=True)),
+                ('duration_p99', models.FloatField(blank=True, null=True)),
+                ('duration_max', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('task_name', 'period'), name='unique_task_result_aggregate')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:57
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_taskresultaggregate'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='blob',
+            name='ref_count',
+        ),
+    ]
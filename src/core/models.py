@@ -1,3 +1,52 @@
 from django.db import models
+from django.utils import timezone
+from prefix_id import PrefixIDField
 
-# Create your models here.
+
+class CachedPage(models.Model):
+    id = PrefixIDField(prefix="page", primary_key=True)
+    url = models.URLField(max_length=500, unique=True)
+    etag = models.CharField(max_length=255, blank=True, null=True)
+    last_modified = models.CharField(max_length=255, blank=True, null=True)
+    content_hash = models.CharField(max_length=64)
+    checked_at = models.DateTimeField(default=timezone.now)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.url
+
+
+class Blob(models.Model):
+    # Content-addressed file stored once under downloads/blobs/<sha256>; plugin trees hardlink to it.
+    # The file's link count is the reference count, see BlobStore.get_ref_count.
+    id = PrefixIDField(prefix="blob", primary_key=True)
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.sha256
+
+
+class TaskResultAggregate(models.Model):
+    # Per task name and day roll-up of compacted django_celery_results TaskResult rows.
+    # Durations are in seconds, taken from date_started (or date_created) to date_done.
+    id = PrefixIDField(prefix="taskstats", primary_key=True)
+    task_name = models.CharField(max_length=255)
+    period = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    duration_count = models.PositiveIntegerField(default=0)
+    duration_avg = models.FloatField(blank=True, null=True)
+    duration_p50 = models.FloatField(blank=True, null=True)
+    duration_p95 = models.FloatField(blank=True, null=True)
+    duration_p99 = models.FloatField(blank=True, null=True)
+    duration_max = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task_name', 'period'], name='unique_task_result_aggregate'),
+        ]
+
+    def __str__(self):
+        return f"{self.task_name} {self.period}"
@@ -0,0 +1,130 @@
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from celery import states
+from celery.signals import task_prerun
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_celery_results.backends import DatabaseBackend
+from django_celery_results.models import TaskResult
+
+from core.models import TaskResultAggregate
+
+
+class ResultPolicy:
+    # Per task name in settings.TASK_RESULT_POLICIES, anything unlisted is FULL
+    FULL = "full"  # TaskResult with args/kwargs (CELERY_RESULT_EXTENDED)
+    LITE = "lite"  # TaskResult with status, result and timings only
+    NONE = "none"  # ignore_result, nothing is stored (applied as a task annotation in celery.py)
+
+    @staticmethod
+    def get(task_name):
+        return settings.TASK_RESULT_POLICIES.get(task_name, ResultPolicy.FULL)
+
+
+@task_prerun.connect
+def mark_task_started(task=None, **kwargs):
+    # Lets the backend store date_started without the extra write of task_track_started
+    if task is not None:
+        task.request.started_at = timezone.now()
+
+
+class PolicyDatabaseBackend(DatabaseBackend):
+    # django-db backend that honours ResultPolicy.LITE and records when the task started
+    def _get_extended_properties(self, request, traceback):
+        properties = super()._get_extended_properties(request, traceback)
+        started_at = getattr(request, 'started_at', None)
+        if started_at is not None:
+            properties['date_started'] = started_at
+        if request is not None and ResultPolicy.get(getattr(request, 'task', None)) == ResultPolicy.LITE:
+            properties.update(task_args=None, task_kwargs=None, worker=None)
+        return properties
+
+
+class TaskResultCompactor:
+    # Rolls TaskResult rows older than the retention period up into TaskResultAggregate, one
+    # transaction per day, and deletes them.
+    def __init__(self):
+        self.retention = timedelta(days=settings.TASK_RESULT_RETENTION_DAYS)
+
+    @staticmethod
+    def percentile(values, q):
+        # Nearest-rank percentile of an already sorted list
+        if not values:
+            return None
+        return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+    def compact(self, now=None):
+        now = now or timezone.now()
+        cutoff = timezone.localtime(now - self.retention).replace(hour=0, minute=0, second=0, microsecond=0)
+        compacted = 0
+        for day in TaskResult.objects.filter(date_done__lt=cutoff).dates('date_done', 'day'):
+            compacted += self.compact_day(day)
+        return compacted
+
+    def get_stats(self, results):
+        stats = defaultdict(lambda: {"count": 0, "failures": 0, "durations": []})
+        rows = results.values_list('task_name', 'status', 'date_created', 'date_started', 'date_done')
+        for task_name, status, date_created, date_started, date_done in rows.iterator():
+            group = stats[task_name or "unknown"]
+            group["count"] += 1
+            if status == states.FAILURE:
+                group["failures"] += 1
+            started = date_started or date_created
+            if started and date_done:
+                group["durations"].append(max(0.0, (date_done - started).total_seconds()))
+        return stats
+
+    @transaction.atomic
+    def compact_day(self, day):
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        results = TaskResult.objects.filter(date_done__gte=start, date_done__lt=start + timedelta(days=1))
+        stats = self.get_stats(results)
+        existing = {
+            aggregate.task_name: aggregate
+            for aggregate in TaskResultAggregate.objects.filter(period=day, task_name__in=stats.keys())
+        }
+        new_aggregates = []
+        for task_name, group in stats.items():
+            durations = sorted(group["durations"])
+            aggregate = TaskResultAggregate(
+                task_name=task_name,
+                period=day,
+                count=group["count"],
+                failures=group["failures"],
+                duration_count=len(durations),
+                duration_avg=sum(durations) / len(durations) if durations else None,
+                duration_p50=self.percentile(durations, 50),
+                duration_p95=self.percentile(durations, 95),
+                duration_p99=self.percentile(durations, 99),
+                duration_max=durations[-1] if durations else None,
+            )
+            if task_name in existing:
+                self.merge(existing[task_name], aggregate)
+            else:
+                new_aggregates.append(aggregate)
+        TaskResultAggregate.objects.bulk_create(new_aggregates)
+        TaskResultAggregate.objects.bulk_update(list(existing.values()), [
+            'count', 'failures', 'duration_count', 'duration_avg', 'duration_p50', 'duration_p95', 'duration_p99',
+            'duration_max',
+        ])
+        deleted, _ = results.delete()
+        return deleted
+
+    @staticmethod
+    def merge(aggregate, other):
+        # Late results for an already compacted day; percentiles are combined as a weighted mean,
+        # which is an approximation
+        total = aggregate.duration_count + other.duration_count
+        for field in ['duration_avg', 'duration_p50', 'duration_p95', 'duration_p99']:
+            values = [(getattr(item, field), item.duration_count) for item in (aggregate, other)
+                      if getattr(item, field) is not None]
+            if values:
+                setattr(aggregate, field, sum(value * weight for value, weight in values) / total)
+        maximums = [value for value in (aggregate.duration_max, other.duration_max) if value is not None]
+        aggregate.duration_max = max(maximums) if maximums else None
+        aggregate.count += other.count
+        aggregate.failures += other.failures
+        aggregate.duration_count = total
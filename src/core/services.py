@@ -1,18 +1,32 @@
 import enum
+import fcntl
+import hashlib
+import json
+import logging
+import os
 import shutil
+import struct
+import tempfile
 import zipfile
-from io import BytesIO
 from pathlib import Path
 
 from django.conf import settings
-from django.core.files import File
-from django.core.files.storage import default_storage
-from requests import Response
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import get_valid_filename
 
+from core.models import CachedPage, Blob
 from plugins.models import PluginFile
 from sourcemod.models import SourceMod
+from tf2modportal.http import get_http_client, hash_file
 from tf2modportal.services import BaseSourceModeDownloader
 
+logger = logging.getLogger(__name__)
+
+# ioctl request number of FICLONE from linux/fs.h
+FICLONE = 0x40049409
+
 
 class SourceModDownloader(BaseSourceModeDownloader):
     def __init__(self):
@@ -20,6 +34,378 @@ class SourceModDownloader(BaseSourceModeDownloader):
         self.model = SourceMod
 
 
+class FetchedPage:
+    def __init__(self, url, response, client, stream=False):
+        self.url = url
+        self.response = response
+        self.client = client
+        self.content_hash = None
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        if not stream:
+            self.content_hash = hashlib.sha256(response.content).hexdigest()
+
+    @property
+    def content(self):
+        return self.response.content
+
+    def iter_content(self, chunk_size=64 * 1024):
+        # Streams the body of a page fetched with stream=True, hashing it on the fly
+        hasher = hashlib.sha256()
+        for chunk in self.client.iter_content(self.response, chunk_size):
+            hasher.update(chunk)
+            yield chunk
+        self.content_hash = hasher.hexdigest()
+
+
+class PageCache:
+    # Conditional-GET cache for scraped pages. fetch() returns None when the page is unchanged
+    # (304 or same body hash). Validators of a changed page are only stored by save() once the
+    # caller has processed it, so a failed parse is retried on the next crawl.
+    def __init__(self):
+        self.client = get_http_client()
+
+    def fetch(self, url, force=False, stream=False):
+        # With stream=True the body is not read here, so only a 304 can short-circuit
+        entry = CachedPage.objects.filter(url=url).first()
+        headers = {}
+        if entry and not force:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        response = self.client.get(url, headers=headers, stream=stream)
+        if response.status_code == 304 and entry:
+            CachedPage.objects.filter(pk=entry.pk).update(checked_at=timezone.now())
+            return None
+        response.raise_for_status()
+        page = FetchedPage(url, response, self.client, stream=stream)
+        if stream:
+            return page
+        if entry and not force and entry.content_hash == page.content_hash:
+            CachedPage.objects.filter(pk=entry.pk).update(
+                etag=page.etag,
+                last_modified=page.last_modified,
+                checked_at=timezone.now(),
+            )
+            return None
+        return page
+
+    def save(self, page):
+        now = timezone.now()
+        CachedPage.objects.update_or_create(url=page.url, defaults={
+            "etag": page.etag,
+            "last_modified": page.last_modified,
+            "content_hash": page.content_hash,
+            "checked_at": now,
+            "changed_at": now,
+        })
+
+
+class BlobStore:
+    def __init__(self):
+        self.base_path = Path(settings.MEDIA_ROOT) / "downloads" / "blobs"
+
+    def get_blob_path(self, sha256):
+        return self.base_path / sha256[:2] / sha256[2:4] / sha256
+
+    def exists(self, sha256):
+        return self.get_blob_path(sha256).exists()
+
+    @staticmethod
+    def link(src, dest):
+        # Hardlink src to dest, replacing dest atomically. Where hardlinks are not possible (link limit,
+        # filesystem without them) try a reflink, and copy as the last resort.
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = dest.with_name(f".{dest.name}.link")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            if not BlobStore.reflink(src, tmp_path):
+                shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dest)
+
+    @staticmethod
+    def reflink(src, dest):
+        # Copy-on-write clone (FICLONE, btrfs/xfs), shares the data blocks until either file is written
+        try:
+            with open(src, "rb") as source, open(dest, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            Path(dest).unlink(missing_ok=True)
+            return False
+        shutil.copystat(src, dest)
+        return True
+
+    def add(self, file_path, sha256=None, size=None):
+        # Moves file_path into the store (or drops it when the content is already stored) and puts a
+        # link to the blob in its place. Calling it again for an already linked path is a no-op.
+        file_path = Path(file_path)
+        sha256 = sha256 or hash_file(file_path)
+        size = size if size is not None else file_path.stat().st_size
+        with transaction.atomic():
+            blob, _ = Blob.objects.get_or_create(sha256=sha256, defaults={"size": size})
+            self.link_to_blob(file_path, sha256)
+        return blob
+
+    def add_many(self, file_paths):
+        # add() for many files with one lookup and at most one insert for their Blob rows. Returns the
+        # blobs in file_paths order.
+        files = [(Path(file_path), hash_file(file_path)) for file_path in file_paths]
+        if not files:
+            return []
+        with transaction.atomic():
+            blobs = Blob.objects.in_bulk({sha256 for _, sha256 in files}, field_name="sha256")
+            missing = {sha256: Blob(sha256=sha256, size=file_path.stat().st_size)
+                       for file_path, sha256 in files if sha256 not in blobs}
+            if missing:
+                Blob.objects.bulk_create(missing.values(), ignore_conflicts=True)
+                blobs.update(Blob.objects.in_bulk(missing, field_name="sha256"))
+            for file_path, sha256 in files:
+                self.link_to_blob(file_path, sha256)
+        return [blobs[sha256] for _, sha256 in files]
+
+    def link_to_blob(self, file_path, sha256):
+        blob_path = self.get_blob_path(sha256)
+        if blob_path.exists() and os.path.samefile(blob_path, file_path):
+            return
+        if blob_path.exists():
+            self.link(blob_path, file_path)
+        else:
+            # First copy of this content, the file itself becomes the blob
+            self.link(file_path, blob_path)
+
+    def get_ref_count(self, sha256):
+        # Tree paths (plugin and build trees) hardlinked to the blob. Replacing or deleting a tree path
+        # lowers it without any bookkeeping; paths that fell back to a copy do not need the blob.
+        blob_path = self.get_blob_path(sha256)
+        return blob_path.stat().st_nlink - 1 if blob_path.exists() else 0
+
+    def collect_garbage(self):
+        # A blob is unused once only the store itself links to it and no PluginFile points at it
+        removed = 0
+        for blob in Blob.objects.filter(plugin_files__isnull=True).iterator():
+            if self.get_ref_count(blob.sha256) > 0:
+                continue
+            blob_path = self.get_blob_path(blob.sha256)
+            blob_path.unlink(missing_ok=True)
+            blob.delete()
+            removed += 1
+        logger.info("Removed %d unused blobs", removed)
+        return removed
+
+
+class CompletionCounter:
+    # Countdown shared by a group of tasks through the cache (atomic DECR in Redis). Replaces chords:
+    # the task that brings the counter to zero starts the next stage, nothing polls the result backend.
+    timeout = 24 * 60 * 60
+    # Results of done()
+    PENDING = "pending"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    def __init__(self, key):
+        self.key = f"completion:{key}"
+        self.failed_key = f"{self.key}:failed"
+
+    def start(self, count):
+        cache.set(self.key, count, timeout=self.timeout)
+
+    def done(self, failed=False):
+        # PENDING while members are still running; the call that finishes the group gets SUCCEEDED or,
+        # if any member failed, FAILED
+        if failed:
+            cache.set(self.failed_key, True, timeout=self.timeout)
+        try:
+            remaining = cache.decr(self.key)
+        except ValueError:
+            # Counter expired or was never started
+            return self.PENDING
+        if remaining > 0:
+            return self.PENDING
+        group_failed = cache.get(self.failed_key, False)
+        cache.delete_many([self.key, self.failed_key])
+        return self.FAILED if group_failed else self.SUCCEEDED
+
+
+class TaskLock:
+    # In-flight marker for a unit of work (SET NX with a TTL in the cache). The TTL frees the key if
+    # the worker holding it dies without releasing.
+    def __init__(self, key, timeout):
+        self.key = f"lock:{key}"
+        self.timeout = timeout
+
+    def acquire(self):
+        return cache.add(self.key, True, timeout=self.timeout)
+
+    def release(self):
+        cache.delete(self.key)
+
+    def is_locked(self):
+        return cache.get(self.key) is not None
+
+
+class ZipStreamBuffer:
+    # Write-only sink for zipfile that hands out what was written since the last drain()
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+        self.drained = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        self.drained = self.offset
+        return data
+
+
+class ZipStream:
+    # Generates a ZIP archive chunk by chunk from (path, arcname) entries, memory use is bounded by
+    # chunk_size. Members with a suffix in stored_suffixes are already compressed and stored as-is.
+    stored_suffixes = {".smx", ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar", ".png", ".jpg", ".jpeg", ".mp3", ".ogg"}
+
+    def __init__(self, entries, chunk_size=256 * 1024):
+        self.entries = entries
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def get_compress_type(cls, path):
+        return zipfile.ZIP_STORED if Path(path).suffix.lower() in cls.stored_suffixes else zipfile.ZIP_DEFLATED
+
+    def __iter__(self):
+        buffer = ZipStreamBuffer()
+        with zipfile.ZipFile(buffer, "w") as zip_file:
+            for path, arcname in self.entries:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = self.get_compress_type(path)
+                with open(path, "rb") as source, zip_file.open(info, "w") as dest:
+                    while chunk := source.read(self.chunk_size):
+                        dest.write(chunk)
+                        if buffer.offset - buffer.drained >= self.chunk_size:
+                            yield buffer.drain()
+        # Last member data, data descriptors and the central directory
+        yield buffer.drain()
+
+
+class ArchiveCache:
+    # Keeps the generated archives of hot tags (PLUGINS_ARCHIVE_CACHE_THRESHOLD downloads within a
+    # day) on disk. File names carry a signature of the member list, so a changed tree is re-archived.
+    # Served archives get their mtime bumped, the least recently used go beyond PLUGINS_ARCHIVE_CACHE_SIZE.
+    def __init__(self):
+        self.path = Path(settings.MEDIA_ROOT) / "cache/archives"
+        self.threshold = settings.PLUGINS_ARCHIVE_CACHE_THRESHOLD
+        self.max_size = settings.PLUGINS_ARCHIVE_CACHE_SIZE
+
+    @staticmethod
+    def get_signature(entries):
+        digest = hashlib.sha256()
+        for path, arcname in entries:
+            stat = Path(path).stat()
+            digest.update(f"{arcname}\x00{stat.st_size}\x00{stat.st_mtime_ns}\n".encode())
+        return digest.hexdigest()[:16]
+
+    def get_path(self, key, entries):
+        return self.path / f"{key}-{self.get_signature(entries)}.zip"
+
+    def open(self, path):
+        # Returns the cached archive opened for reading, or None when it is missing or was just evicted
+        try:
+            archive = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        os.utime(archive.fileno())
+        return archive
+
+    def is_hot(self, key):
+        if not self.threshold:
+            return False
+        counter_key = f"archive-downloads:{key}"
+        cache.add(counter_key, 0, timeout=24 * 60 * 60)
+        try:
+            return cache.incr(counter_key) >= self.threshold
+        except ValueError:
+            return False
+
+    def store(self, chunks, path, key):
+        # Passes chunks through while writing them next to path; only a complete archive is kept
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, part_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+        completed = False
+        try:
+            with os.fdopen(fd, "wb") as part:
+                for chunk in chunks:
+                    part.write(chunk)
+                    yield chunk
+            for stale in self.path.glob(f"{key}-*.zip"):
+                stale.unlink(missing_ok=True)
+            os.replace(part_path, path)
+            completed = True
+        finally:
+            if not completed:
+                Path(part_path).unlink(missing_ok=True)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        archives = []
+        for path in self.path.glob("*.zip"):
+            try:
+                archives.append((path.stat(), path))
+            except FileNotFoundError:
+                continue
+        total = sum(stat.st_size for stat, _ in archives)
+        evicted = 0
+        for stat, path in sorted(archives, key=lambda archive: archive[0].st_mtime_ns):
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
+            evicted += 1
+        return evicted
+
+
+def copy_zip_entry(source, zip_file, info):
+    # Appends a member of source to zip_file as its compressed bytes, without inflating and deflating it
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    source.fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    member = zipfile.ZipInfo(info.filename, info.date_time)
+    member.compress_type = info.compress_type
+    member.create_system = info.create_system
+    member.external_attr = info.external_attr
+    member.CRC = info.CRC
+    member.compress_size = info.compress_size
+    member.file_size = info.file_size
+    # CRC and sizes go into the local header, a streamed member's data descriptor is not copied
+    member.flag_bits = info.flag_bits & ~0x08
+    member.header_offset = zip_file.fp.tell()
+    zip_file.fp.write(member.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, 1024 * 1024))
+        zip_file.fp.write(chunk)
+        remaining -= len(chunk)
+    zip_file.filelist.append(member)
+    zip_file.NameToInfo[member.filename] = member
+    zip_file.start_dir = zip_file.fp.tell()
+
+
 class BaseFileManager:
     def __init__(self):
         self.base_path = Path(settings.MEDIA_ROOT) / "downloads"
@@ -36,6 +422,7 @@ class BaseFileManager:
         self.sound_dir = "sound"
         self.models_dir = "models"
         self.materials_dir = "materials"
+        self.blob_store = BlobStore()
 
     def unzip(self, file_path: Path, dest_path: Path):
         full_dest_path = self.base_path / dest_path
@@ -44,17 +431,85 @@ class BaseFileManager:
             zip_ref.extractall(full_dest_path)
         # os.remove(file_path)
 
-    def zip(self, archive_name: str, file_path: Path, dest_path: Path):
+    def zip(self, archive_name: str, file_path: Path, dest_path: Path, base_archive: Path = None, incremental=True):
+        # Incremental: members listed unchanged in the manifest of base_archive (by default the archive
+        # being replaced) are copied from it still compressed, only new or changed files are deflated.
+        # incremental=False compresses everything again, e.g. after a change of the member layout.
         full_file_path = self.base_path / file_path
-        full_archive_path = self.base_path / dest_path
-        archive_path = full_archive_path / archive_name
-        plugin_dir_files = [file for file in full_file_path.rglob("*") if file.suffix != '.zip']
-        with default_storage.open(archive_path, 'wb+') as archive:
-            with zipfile.ZipFile(archive, 'w') as zip_file:
-                for file in plugin_dir_files:
-                    zip_file.write(file, file.relative_to(full_file_path))
+        archive_path = self.base_path / dest_path / archive_name
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        base_archive = Path(base_archive) if base_archive else archive_path
+        previous = self.read_manifest(base_archive) if incremental else {}
+        plugin_dir_files = sorted(file for file in full_file_path.rglob("*")
+                                  if file.is_file() and file.suffix != '.zip')
+        manifest = {}
+        part_path = archive_path.with_name(f"{archive_path.name}.{os.getpid()}.part")
+        try:
+            source = zipfile.ZipFile(base_archive) if previous else None
+            try:
+                with zipfile.ZipFile(part_path, 'w') as zip_file:
+                    for file in plugin_dir_files:
+                        arcname = file.relative_to(full_file_path).as_posix()
+                        entry = self.match_manifest_entry(previous.get(arcname), file)
+                        if entry and arcname in source.NameToInfo:
+                            copy_zip_entry(source, zip_file, source.getinfo(arcname))
+                        else:
+                            zip_file.write(file, arcname, compress_type=ZipStream.get_compress_type(file))
+                            stat = file.stat()
+                            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hash_file(file)}
+                        manifest[arcname] = entry
+            finally:
+                if source is not None:
+                    source.close()
+            os.replace(part_path, archive_path)
+        finally:
+            part_path.unlink(missing_ok=True)
+        self.write_manifest(archive_path, manifest)
         return archive_path
 
+    @staticmethod
+    def get_manifest_path(archive_path: Path):
+        return archive_path.with_name(f"{archive_path.name}.manifest.json")
+
+    def read_manifest(self, archive_path: Path):
+        # Only trusted while the archive is the one the manifest was written for
+        manifest_path = self.get_manifest_path(archive_path)
+        if not archive_path.exists() or not manifest_path.exists():
+            return {}
+        try:
+            manifest = json.loads(manifest_path.read_text())
+        except ValueError:
+            return {}
+        stat = archive_path.stat()
+        if manifest.get("archive") != {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}:
+            return {}
+        return manifest.get("entries", {})
+
+    def write_manifest(self, archive_path: Path, entries):
+        stat = archive_path.stat()
+        manifest_path = self.get_manifest_path(archive_path)
+        part_path = manifest_path.with_name(f"{manifest_path.name}.{os.getpid()}.part")
+        part_path.write_text(json.dumps({
+            "archive": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+            "entries": entries,
+        }))
+        os.replace(part_path, manifest_path)
+
+    @staticmethod
+    def match_manifest_entry(entry, file: Path):
+        # The manifest entry (with the current mtime) if file still has the recorded content, else None
+        if not entry:
+            return None
+        stat = file.stat()
+        if entry["size"] != stat.st_size:
+            return None
+        if entry["mtime_ns"] != stat.st_mtime_ns:
+            # Copied files get a new mtime, compare their content
+            if entry["sha256"] != hash_file(file):
+                return None
+            entry = dict(entry, mtime_ns=stat.st_mtime_ns)
+        return entry
+
     def move(self, file_path: Path, dest_path: Path):
         dest_path = self.base_path / dest_path
         dest_path.parent.mkdir(parents=True, exist_ok=True)
@@ -83,55 +538,88 @@ class MoveType(str, enum.Enum):
 
 
 class FileManager(BaseFileManager):
-    def save_file(self, response: Response, plugin_file, tag):
+    def get_file_path(self, plugin_file, tag):
         file_path = None
-        file_path_to_save = f"{tag.plugin.id}/{tag.version}/"
         base_path = self.base_plugins_download_path / tag.plugin.id / tag.version / "files"
         if plugin_file.file_type == PluginFile.FileType.SMX:
             file_path = base_path / self.plugins_dir / plugin_file.file_name
-            file_path_to_save = f"{tag.plugin.id}/{tag.version}/files/addons/sourcemod/plugins/{plugin_file.file_name}"
         elif plugin_file.file_type == PluginFile.FileType.SP:
             file_path = base_path / self.scripting_dir / plugin_file.file_name
-            file_path_to_save = f"{tag.plugin.id}/{tag.version}/files/addons/sourcemod/scripting/{plugin_file.file_name}"
         elif plugin_file.file_type == PluginFile.FileType.ZIP:
             file_path = self.base_plugins_download_path / tag.plugin.id / tag.version / "archives" / plugin_file.file_name
-            file_path_to_save = f"{tag.plugin.id}/{tag.version}/archives/{plugin_file.file_name}"
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        django_file = File(BytesIO(response.content), name=plugin_file.file_name)
-        plugin_file.file.save(file_path_to_save, django_file, save=True)
-
         return file_path
 
+    def save_file(self, download, plugin_file, commit=True):
+        # The body was already streamed to its final path, only point the FileField at it
+        plugin_file.blob = self.blob_store.add(download.path, download.sha256, download.size)
+        plugin_file.sha256 = download.sha256
+        plugin_file.size = download.size
+        plugin_file.file.name = str(Path(download.path).relative_to(settings.MEDIA_ROOT))
+        if commit:
+            plugin_file.save()
+        return download.path
+
     def move_files(self, obj_id: str, version: str, temp: bool = False):
         plugin_dir = self.base_plugins_download_path / obj_id / version if not temp else self.base_plugins_download_path / obj_id / version / "temp"
         dest_dir = self.base_plugins_download_path / obj_id / version / "files"
+        moved = []
         for file in plugin_dir.rglob("*"):
             if file.suffix == ".smx":
                 if "disabled" in file.parts:
-                    self.move(file, dest_dir / self.plugins_dir / "disabled" / file.name)
+                    moved.append(self.move(file, dest_dir / self.plugins_dir / "disabled" / file.name))
                 else:
-                    self.move(file, dest_dir / self.plugins_dir / file.name)
+                    moved.append(self.move(file, dest_dir / self.plugins_dir / file.name))
             elif file.suffix == ".sp":
-                self.move(file, dest_dir / self.scripting_dir / file.name)
+                moved.append(self.move(file, dest_dir / self.scripting_dir / file.name))
             elif file.suffix == ".inc":
-                self.move(file, dest_dir / self.include_dir / file.name)
+                moved.append(self.move(file, dest_dir / self.include_dir / file.name))
             elif "phrases" in file.name:
-                self.move(file, dest_dir / "translations" / file.name)
+                moved.append(self.move(file, dest_dir / "translations" / file.name))
             elif file.suffix == ".txt":
-                self.move(file, dest_dir / file.name)
+                moved.append(self.move(file, dest_dir / file.name))
             elif file.suffix == ".cfg":
-                self.move(file, dest_dir / file.name)
+                moved.append(self.move(file, dest_dir / file.name))
             elif file.suffix == ".bsp":
-                self.move(file, dest_dir / self.maps_dir / file.name)
+                moved.append(self.move(file, dest_dir / self.maps_dir / file.name))
             elif file.suffix in [".wav", ".mp3"]:
-                self.move(file, dest_dir / self.sound_dir / file.name)
+                moved.append(self.move(file, dest_dir / self.sound_dir / file.name))
             elif file.suffix == ".mdl":
-                self.move(file, dest_dir / self.models_dir / file.name)
+                moved.append(self.move(file, dest_dir / self.models_dir / file.name))
             elif file.suffix == ".vmt":
-                self.move(file, dest_dir / self.materials_dir / file.name)
+                moved.append(self.move(file, dest_dir / self.materials_dir / file.name))
+        # The Blob rows of the whole tree are looked up and inserted at once
+        self.blob_store.add_many(dict.fromkeys(moved))
+
+    @staticmethod
+    def get_archive_name(plugin_name: str, version: str):
+        # Storage-safe like FileField names (spaces become underscores), shared by archive_plugin_files
+        # and rebuild_archives
+        return get_valid_filename(f"{plugin_name} {version}.zip")
 
-    def archive_files(self, obj_id: str, archive_name: str, version: str):
-        dest_path = self.base_plugins_download_path / obj_id / version
+    def archive_files(self, obj_id: str, archive_name: str, version: str, incremental=True):
+        version_path = self.base_plugins_download_path / obj_id / version
+        return self.zip(archive_name, version_path / "files", version_path, incremental=incremental)
+
+    @staticmethod
+    def get_archive_hash(archive_name: str, members):
+        # members are (arcname, sha256) pairs in archive order. Changes with the archive name or any
+        # member's path or content.
+        digest = hashlib.sha256(archive_name.encode())
+        for arcname, sha256 in members:
+            digest.update(f"\x00{arcname}\x00{sha256}".encode())
+        return digest.hexdigest()
+
+    def get_tree_hash(self, archive_path: Path, entries, archive_name: str):
+        # Archive hash of entries; file hashes come from archive_path's manifest while size and mtime match
+        previous = self.read_manifest(archive_path)
+        members = []
+        for path, arcname in entries:
+            entry = self.match_manifest_entry(previous.get(arcname), path)
+            members.append((arcname, entry["sha256"] if entry else hash_file(path)))
+        return self.get_archive_hash(archive_name, members)
+
+    def get_archive_entries(self, obj_id: str, version: str):
+        # Same members as archive_files, in a stable order
         base_path = self.base_plugins_download_path / obj_id / version / "files"
-        archive_path = self.zip(archive_name, base_path, dest_path)
-        return archive_path
+        return [(file, file.relative_to(base_path).as_posix()) for file in sorted(base_path.rglob("*"))
+                if file.is_file() and file.suffix != '.zip']
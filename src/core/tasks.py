@@ -0,0 +1,24 @@
+from celery import shared_task
+
+from core.results import TaskResultCompactor
+from core.services import BlobStore
+
+
+@shared_task(name='core.tasks.collect_blobs')
+def collect_blobs():
+    removed = BlobStore().collect_garbage()
+    return {
+        "status": "success",
+        "message": f"Removed {removed} unused blobs",
+        "removed": removed,
+    }
+
+
+@shared_task(name='core.tasks.compact_task_results')
+def compact_task_results():
+    compacted = TaskResultCompactor().compact()
+    return {
+        "status": "success",
+        "message": f"Compacted {compacted} task results",
+        "compacted": compacted,
+    }
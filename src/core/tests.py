@@ -1,3 +1,294 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from celery import states
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django_celery_results.models import TaskResult
+
+from core.models import Blob, CachedPage, TaskResultAggregate
+from core.results import TaskResultCompactor
+from core.services import (ArchiveCache, BaseFileManager, BlobStore, CompletionCounter, PageCache, TaskLock,
+                           ZipStream, copy_zip_entry)
+from plugins.models import Plugin, PluginFile, Tag
+from plugins.tasks import download_plugin_file, get_plugin
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def make_response(status_code, body=b"", headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = BytesIO(body)
+    return response
+
+
+class PageCacheTests(TestCase):
+    url = "https://forums.alliedmods.net/showthread.php?t=1"
+
+    def setUp(self):
+        self.page_cache = PageCache()
+        self.page_cache.client = mock.Mock()
+
+    def fetch(self, response, **kwargs):
+        self.page_cache.client.get.return_value = response
+        return self.page_cache.fetch(self.url, **kwargs)
+
+    def sent_headers(self):
+        return self.page_cache.client.get.call_args.kwargs["headers"]
+
+    def test_validators_are_stored_after_save(self):
+        page = self.fetch(make_response(200, b"v1", {"ETag": '"1"', "Last-Modified": "Mon, 01 Jan 2024"}))
+        self.assertEqual(page.content, b"v1")
+        self.assertEqual(self.sent_headers(), {})
+        # A page that was fetched but not processed is fetched in full again
+        self.fetch(make_response(200, b"v1"))
+        self.assertEqual(self.sent_headers(), {})
+
+        self.page_cache.save(page)
+        self.assertIsNone(self.fetch(make_response(304)))
+        self.assertEqual(self.sent_headers(), {"If-None-Match": '"1"', "If-Modified-Since": "Mon, 01 Jan 2024"})
+
+    def test_unchanged_body_without_304(self):
+        self.page_cache.save(self.fetch(make_response(200, b"v1", {"ETag": '"1"'})))
+        self.assertIsNone(self.fetch(make_response(200, b"v1", {"ETag": '"2"'})))
+        self.assertEqual(CachedPage.objects.get().etag, '"2"')
+
+        page = self.fetch(make_response(200, b"v2"))
+        self.assertEqual(page.content, b"v2")
+
+    def test_force_skips_the_validators(self):
+        self.page_cache.save(self.fetch(make_response(200, b"v1", {"ETag": '"1"'})))
+        page = self.fetch(make_response(200, b"v1"), force=True)
+        self.assertEqual(self.sent_headers(), {})
+        self.assertEqual(page.content, b"v1")
+
+    def test_streamed_page_is_hashed_while_read(self):
+        self.page_cache.client.iter_content.side_effect = lambda response, chunk_size: iter([b"v", b"1"])
+        page = self.fetch(make_response(200, b"v1"), stream=True)
+        self.assertIsNone(page.content_hash)
+        self.assertEqual(b"".join(page.iter_content()), b"v1")
+        self.page_cache.save(page)
+        self.assertIsNone(self.fetch(make_response(200, b"v1")))
+
+
+class IncrementalZipTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.tree = self.media_root / "tree"
+        (self.tree / "addons/sourcemod/scripting").mkdir(parents=True)
+        for index in range(3):
+            (self.tree / f"addons/sourcemod/scripting/plugin{index}.sp").write_text(f"// plugin {index}\n" * 500)
+        (self.tree / "addons/sourcemod/plugins.smx").write_bytes(os.urandom(4096))
+
+    def read_members(self, archive_path):
+        with zipfile.ZipFile(archive_path) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+    def test_copy_zip_entry_from_streamed_archive(self):
+        # Streamed members carry a data descriptor (flag 0x08) that the copy must drop
+        entries = [(path, path.relative_to(self.tree).as_posix()) for path in sorted(self.tree.rglob("*"))
+                   if path.is_file()]
+        streamed_path = self.media_root / "streamed.zip"
+        streamed_path.write_bytes(b"".join(ZipStream(entries)))
+        copy_path = self.media_root / "copy.zip"
+        with zipfile.ZipFile(streamed_path) as source, zipfile.ZipFile(copy_path, "w") as zip_file:
+            self.assertTrue(all(info.flag_bits & 0x08 for info in source.infolist()))
+            for info in source.infolist():
+                copy_zip_entry(source, zip_file, info)
+        with zipfile.ZipFile(copy_path) as copied:
+            self.assertFalse(any(info.flag_bits & 0x08 for info in copied.infolist()))
+        self.assertEqual(self.read_members(copy_path), self.read_members(streamed_path))
+
+    def test_zip_reuses_unchanged_members(self):
+        with override_settings(MEDIA_ROOT=self.media_root):
+            file_manager = BaseFileManager()
+            first = file_manager.zip("first.zip", self.tree, self.media_root / "out")
+            manifest = file_manager.read_manifest(first)
+            self.assertEqual(set(manifest), set(self.read_members(first)))
+
+            # A copy gets a new mtime but keeps its content, a changed file is deflated again
+            changed = self.tree / "addons/sourcemod/scripting/plugin1.sp"
+            changed.write_text("// changed\n")
+            os.utime(self.tree / "addons/sourcemod/scripting/plugin0.sp")
+            (self.tree / "addons/sourcemod/scripting/new.sp").write_text("// new\n")
+            with mock.patch.object(zipfile.ZipFile, "write", autospec=True,
+                                   side_effect=zipfile.ZipFile.write) as write:
+                second = file_manager.zip("second.zip", self.tree, self.media_root / "out", base_archive=first)
+
+        deflated = sorted(Path(call.args[1]).name for call in write.call_args_list)
+        self.assertEqual(deflated, ["new.sp", "plugin1.sp"])
+        members = self.read_members(second)
+        self.assertEqual(members["addons/sourcemod/scripting/plugin1.sp"], b"// changed\n")
+        self.assertEqual(members["addons/sourcemod/scripting/plugin2.sp"],
+                         (self.tree / "addons/sourcemod/scripting/plugin2.sp").read_bytes())
+        self.assertEqual(len(members), 5)
+
+
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.store = BlobStore()
+
+    def add_file(self, name, content):
+        file_path = self.media_root / "downloads" / "plugins" / name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(content)
+        return file_path, self.store.add(file_path)
+
+    def test_identical_content_is_stored_once(self):
+        first_path, blob = self.add_file("first.smx", b"same")
+        second_path, same_blob = self.add_file("second.smx", b"same")
+        self.assertEqual(blob.pk, same_blob.pk)
+        self.assertTrue(os.path.samefile(first_path, second_path))
+        self.assertEqual(self.store.get_ref_count(blob.sha256), 2)
+
+    def test_collect_garbage_keeps_referenced_blobs(self):
+        linked_path, linked = self.add_file("linked.smx", b"linked")
+        _, unused = self.add_file("unused.smx", b"unused")
+        recorded_path, recorded = self.add_file("recorded.smx", b"recorded")
+        plugin = Plugin.objects.create(name="Example", original_name="example", author="author",
+                                       url="https://forums.alliedmods.net/showthread.php?t=1")
+        tag = Tag.objects.create(plugin=plugin, version="1.0")
+        PluginFile.objects.create(tag=tag, file_type=PluginFile.FileType.SMX, sha256=recorded.sha256, blob=recorded)
+        (self.media_root / "downloads" / "plugins" / "unused.smx").unlink()
+        recorded_path.unlink()
+
+        self.assertEqual(self.store.collect_garbage(), 1)
+        self.assertEqual(set(Blob.objects.values_list("sha256", flat=True)), {linked.sha256, recorded.sha256})
+        self.assertFalse(self.store.exists(unused.sha256))
+        self.assertTrue(self.store.exists(recorded.sha256))
+        self.assertEqual(linked_path.read_bytes(), b"linked")
+
+
+@override_settings(PLUGINS_ARCHIVE_CACHE_SIZE=25)
+class ArchiveCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.archive_cache = ArchiveCache()
+
+    def store(self, key, signature="a", chunks=(b"0123456789",)):
+        path = self.archive_cache.path / f"{key}-{signature}.zip"
+        self.assertEqual(b"".join(self.archive_cache.store(iter(chunks), path, key)), b"".join(chunks))
+        return path
+
+    def cached_files(self):
+        return sorted(path.name for path in self.archive_cache.path.iterdir())
+
+    def test_complete_archive_replaces_the_stale_one(self):
+        self.store("tag1", "a")
+        path = self.store("tag1", "b", [b"01234", b"56789"])
+        self.assertEqual(self.cached_files(), ["tag1-b.zip"])
+        self.assertEqual(path.read_bytes(), b"0123456789")
+
+    def test_aborted_download_leaves_nothing(self):
+        path = self.archive_cache.path / "tag1-a.zip"
+        chunks = self.archive_cache.store(iter([b"01234", b"56789"]), path, "tag1")
+        self.assertEqual(next(chunks), b"01234")
+        chunks.close()
+        self.assertEqual(self.cached_files(), [])
+
+    def test_least_recently_served_archive_is_evicted(self):
+        first = self.store("tag1")
+        second = self.store("tag2")
+        os.utime(first, ns=(1, 1))
+        os.utime(second, ns=(2, 2))
+        # Serving the older archive makes it the most recently used one
+        self.archive_cache.open(first).close()
+        self.store("tag3")
+        self.assertEqual(self.cached_files(), ["tag1-a.zip", "tag3-a.zip"])
+        self.assertIsNone(self.archive_cache.open(second))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class CompletionCounterTests(SimpleTestCase):
+    def test_last_member_finishes_the_group(self):
+        counter = CompletionCounter("test-success")
+        counter.start(2)
+        self.assertEqual(counter.done(), CompletionCounter.PENDING)
+        self.assertEqual(counter.done(), CompletionCounter.SUCCEEDED)
+
+    def test_failure_is_reported_only_when_all_members_finished(self):
+        counter = CompletionCounter("test-failure")
+        counter.start(3)
+        self.assertEqual(counter.done(failed=True), CompletionCounter.PENDING)
+        self.assertEqual(counter.done(), CompletionCounter.PENDING)
+        self.assertEqual(counter.done(), CompletionCounter.FAILED)
+
+    def test_unknown_counter_is_pending(self):
+        self.assertEqual(CompletionCounter("test-missing").done(), CompletionCounter.PENDING)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class TaskLockTests(SimpleTestCase):
+    def test_acquire_is_exclusive_until_released(self):
+        lock = TaskLock("test-lock", timeout=60)
+        self.assertTrue(lock.acquire())
+        self.assertTrue(TaskLock("test-lock", timeout=60).is_locked())
+        self.assertFalse(TaskLock("test-lock", timeout=60).acquire())
+        lock.release()
+        self.assertFalse(lock.is_locked())
+        self.assertTrue(TaskLock("test-lock", timeout=60).acquire())
+        lock.release()
+
+
+@override_settings(TASK_RESULT_RETENTION_DAYS=3)
+class TaskResultCompactorTests(TestCase):
+    def add_result(self, task_name, status, done, duration):
+        result = TaskResult.objects.create(task_id=f"{task_name}-{TaskResult.objects.count()}", task_name=task_name,
+                                           status=status)
+        TaskResult.objects.filter(pk=result.pk).update(date_started=done - timedelta(seconds=duration),
+                                                       date_done=done)
+
+    def test_old_results_are_rolled_up(self):
+        now = timezone.make_aware(datetime(2024, 5, 10, 12))
+        old = now - timedelta(days=5)
+        for duration in range(1, 11):
+            self.add_result("plugins.tasks.get_plugin", states.SUCCESS, old, duration)
+        self.add_result("plugins.tasks.get_plugin", states.FAILURE, old, 20)
+        self.add_result("plugins.tasks.get_plugin", states.SUCCESS, now, 1)
+
+        self.assertEqual(TaskResultCompactor().compact(now), 11)
+        aggregate = TaskResultAggregate.objects.get()
+        self.assertEqual((aggregate.count, aggregate.failures, aggregate.duration_count), (11, 1, 11))
+        self.assertEqual(aggregate.duration_p50, 6)
+        self.assertEqual(aggregate.duration_max, 20)
+        self.assertEqual(TaskResult.objects.count(), 1)
+
+        # A late result of an already compacted day is merged into its aggregate
+        self.add_result("plugins.tasks.get_plugin", states.FAILURE, old, 30)
+        self.assertEqual(TaskResultCompactor().compact(now), 1)
+        aggregate.refresh_from_db()
+        self.assertEqual((aggregate.count, aggregate.failures, aggregate.duration_max), (12, 2, 30))
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(TaskResultCompactor.percentile(values, 50), 50)
+        self.assertEqual(TaskResultCompactor.percentile(values, 99), 99)
+        self.assertIsNone(TaskResultCompactor.percentile([], 50))
+
+
+class ResultPolicyTests(SimpleTestCase):
+    def test_none_policy_ignores_result(self):
+        # Applied once Celery loads its configuration, on top of the queue defaults
+        self.assertTrue(download_plugin_file.ignore_result)
+        self.assertTrue(download_plugin_file.acks_late)
+        self.assertFalse(get_plugin.ignore_result)
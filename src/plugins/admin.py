@@ -5,7 +5,7 @@ from django.shortcuts import redirect
 from unfold.admin import ModelAdmin, TabularInline
 from unfold.contrib.inlines.admin import NonrelatedTabularInline
 from unfold.decorators import action
-from plugins.tasks import download_plugin_files as download_plugin_files_task
+from plugins.tasks import download_plugin_files as download_plugin_files_task, get_pipeline_lock
 from plugins.models import Plugin, Tag, PluginFile
 
 
@@ -34,7 +34,7 @@ class PluginFilesTagInline(NonrelatedTabularInline):  # NonrelatedStackedInline
 class PluginTagInline(TabularInline):
     model = Tag
     tab = True
-    fields = ['tagged_name', 'version', 'is_latest', "archive_file"]
+    fields = ['tagged_name', 'version', 'is_latest', 'stage', "archive_file"]
     extra = 0
 
 
@@ -48,6 +48,10 @@ class PluginAdmin(ModelAdmin):
 
     @action(description="Pobierz pliki", )
     def download_plugin_files(self, request: HttpRequest, object_id: int):
+        tag = Tag.objects.filter(plugin_id=object_id, is_latest=True).first()
+        if tag and get_pipeline_lock(tag.id).is_locked():
+            messages.warning(request, "Pobieranie plikow jest juz w toku")
+            return redirect("admin:plugins_plugin_changelist")
         download_plugin_files_task.delay(object_id)
         messages.success(request, "Pomyslnie rozpoczeto pobieranie plikow")
         return redirect("admin:plugins_plugin_changelist")
@@ -0,0 +1,335 @@
+import re
+from html.parser import HTMLParser
+
+import markdown
+from bs4 import BeautifulSoup, UnicodeDammit
+from bs4.builder import HTMLTreeBuilder
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+DEFAULT_PARSER = "lxml" if lxml is not None else "html.parser"
+
+# The post body is cut out of the page source instead of serialized from the tree, because lxml repairs
+# malformed posts differently from html.parser and the stored description would change
+POST_MESSAGE_RE = re.compile(r'<div\b[^>]*?\sid\s*=\s*["\']?post_message_', re.IGNORECASE)
+TAG_RE = re.compile(r'<(/?)([a-zA-Z][^\s/>]*)[^>]*?(/?)>')
+
+
+class ThreadPageExtractor:
+    # Extracts plugin_info from an AlliedModders thread page in a single pass over one parsed tree,
+    # built by lxml when it is installed. Returns the same dict as SourceModPluginDownloader.get_plugin_info.
+    detail_labels = {f'Plugin {key.capitalize()}: ': key for key in ['version', 'category', 'game']}
+
+    def __init__(self, base_url="https://forums.alliedmods.net/", parser=DEFAULT_PARSER):
+        self.base_url = base_url
+        self.parser = parser
+
+    def extract(self, content, plugin_url):
+        if isinstance(content, bytes):
+            # The same encoding detection BeautifulSoup runs on bytes
+            content = UnicodeDammit(content, is_html=True).unicode_markup
+        soup = None
+        if self.parser == "lxml":
+            name, details, author, anchors = self.walk_lxml(content)
+        else:
+            soup = BeautifulSoup(content, 'html.parser')
+            name, details, author, anchors = self.walk_soup(soup)
+        return {
+            "name": name,
+            "description": self.get_description(content, soup) or "No description available",
+            "author": self.get_author(author),
+            "version": details.get('version') if details.get('version') else "1.0",
+            "category": details.get('category') if details.get('category') else "Any",
+            "game": details.get('game') if details.get('game') else "Team Fortress 2",
+            "url": plugin_url,
+            "download_links": self.get_links(anchors),
+        }
+
+    def walk_lxml(self, content):
+        # Returns the name, the details, the author link as (text, href) and the attachment links as
+        # (text, href, following text)
+        root = lxml.html.document_fromstring(content)
+        name = None
+        post_table = None
+        author = None
+        anchors = None
+        details = {}
+        for element in root.iter('table', 'div', 'fieldset'):
+            if element.tag == 'table':
+                if post_table is None and (element.get('id') or '').startswith('post'):
+                    post_table = element
+            elif element.tag == 'div':
+                element_id = element.get('id') or ''
+                if name is None and 'font-size: 14pt' in (element.get('style') or ''):
+                    name = element.find('.//a').text_content()
+                if author is None and element_id.startswith('postmenu_'):
+                    author = next((
+                        (get_text(a), a.get('href')) for a in element.iter('a')
+                        if 'bigusername' in (a.get('class') or '').split()
+                    ), False)
+                key = self.detail_labels.get(get_string(element))
+                if key and key not in details and post_table is not None \
+                        and any(parent is post_table for parent in element.iterancestors('table')):
+                    details[key] = self.get_detail(element)
+            elif anchors is None and 'fieldset' in (element.get('class') or '').split():
+                anchors = [(a.text_content().strip(), a.get('href'), get_next_string(a))
+                           for a in element.iter('a') if a.get('href') is not None]
+        return name, {key: value for key, value in details.items() if value is not None}, author or None, anchors
+
+    @staticmethod
+    def get_detail(div):
+        td = next(div.iterancestors('td'), None)
+        next_td = next(td.itersiblings('td'), None) if td is not None else None
+        if next_td is not None:
+            return get_text(next_td.find('.//div'))
+        return None
+
+    def walk_soup(self, soup):
+        name_div = None
+        post_table = None
+        menu_div = None
+        fieldset = None
+        detail_divs = {}
+
+        for element in soup.find_all(['table', 'div', 'fieldset']):
+            if element.name == 'table':
+                if post_table is None and (element.get('id') or '').startswith('post'):
+                    post_table = element
+            elif element.name == 'div':
+                if name_div is None and 'font-size: 14pt' in (element.get('style') or ''):
+                    name_div = element
+                if menu_div is None and (element.get('id') or '').startswith('postmenu_'):
+                    menu_div = element
+                key = self.detail_labels.get(element.string) if element.string else None
+                if key and key not in detail_divs and post_table is not None \
+                        and any(parent is post_table for parent in element.parents):
+                    detail_divs[key] = element
+            elif fieldset is None and 'fieldset' in (element.get('class') or []):
+                fieldset = element
+
+        details = {}
+        for key, div in detail_divs.items():
+            next_td = div.find_parent('td').find_next_sibling('td')
+            if next_td:
+                details[key] = next_td.find('div').get_text(strip=True)
+        author = None
+        if menu_div:
+            author_tag = menu_div.find('a', class_='bigusername')
+            if author_tag:
+                author = (author_tag.get_text(strip=True), author_tag['href'])
+        anchors = None
+        if fieldset:
+            anchors = [(a_tag.text.strip(), a_tag['href'], a_tag.find_next_sibling(string=True))
+                       for a_tag in fieldset.find_all('a', href=True)]
+        return name_div.find('a').text if name_div else None, details, author, anchors
+
+    @staticmethod
+    def get_description(content, soup=None):
+        start = POST_MESSAGE_RE.search(content)
+        if start is None:
+            return None
+        body = get_post_body(content, start.end())
+        if body is not None:
+            # html.parser builds the same elements for the cut-out body as for the page, serializing them
+            # gives what decode_contents() returns in get_plugin_description
+            body = BeautifulSoup(body, 'html.parser').decode()
+        else:
+            # Unbalanced markup closes elements outside the post, only an html.parser tree of the whole
+            # page has the post body get_plugin_description sees
+            soup = soup or BeautifulSoup(content, 'html.parser')
+            div = soup.find('div', id=lambda x: x and x.startswith('post_message_'))
+            if div is None:
+                return None
+            body = div.decode_contents()
+        # Parsed again on its own like get_plugin_description does
+        soup = BeautifulSoup(body, 'html.parser')
+        for code_block in soup.find_all('code'):
+            wrapper = soup.new_tag('div', **{'class': 'mockup-code'})
+            pre = soup.new_tag('pre', **{'data-prefix': '$'})
+            code_block.wrap(pre)
+            pre.wrap(wrapper)
+        return markdown.markdown(str(soup))
+
+    def get_author(self, author):
+        if author:
+            name, href = author
+            return {
+                "name": name,
+                "profile_url": f"{self.base_url}{href}"
+            }
+        return {
+            "name": "Unknown",
+            "profile_url": None
+        }
+
+    def get_links(self, anchors):
+        files = []
+        if anchors is None:
+            return files
+        for file_name, file_url, next_string in anchors:
+            if file_name == "Get Source":
+                sp_file_name = next_string.strip().split(" - ")[0].replace("(", "").strip()
+                files.append({"source": {"file_name": sp_file_name, "url": f"{self.base_url}{file_url}"}})
+            if file_name == "Get Plugin":
+                files.append({"plugin": {"file_name": "Get Plugin", "url": file_url}})
+            if "smx" in file_name:
+                files.append({"compiled_plugin": {"file_name": file_name, "url": f"{self.base_url}{file_url}"}})
+            if file_name.endswith(".zip"):
+                files.append({"zip_attachment": {"file_name": file_name, "url": f"{self.base_url}{file_url}"}})
+        for file in files:
+            if "plugin" in file:
+                source_file = [f for f in files if "source" in f][0]
+                file['plugin']['file_name'] = source_file['source']['file_name'].split(".")[0] + ".smx"
+        return files
+
+
+def get_post_body(content, start):
+    # Source of the post body from the end of the <div id="post_message_..." match to its closing tag.
+    # Returns None unless every tag inside is closed within the post, so html.parser builds the same
+    # elements from the cut-out body as from the whole page.
+    body_start = content.find('>', start) + 1
+    if not body_start:
+        return None
+    open_tags = []
+    for tag in TAG_RE.finditer(content, body_start):
+        closing, name, self_closing = tag.group(1), tag.group(2).lower(), tag.group(3)
+        if closing:
+            if name in open_tags:
+                del open_tags[len(open_tags) - 1 - open_tags[::-1].index(name):]
+            elif name == 'div':
+                return content[body_start:tag.start()]
+            else:
+                return None
+        elif name in ('script', 'style'):
+            return None
+        elif not self_closing and name not in HTMLTreeBuilder.empty_element_tags:
+            open_tags.append(name)
+    return None
+
+
+def get_string(element):
+    # lxml counterpart of BeautifulSoup's Tag.string: the text of an element with a single text child,
+    # or of its only child element
+    while True:
+        if len(element) == 0:
+            return element.text
+        if len(element) > 1 or element.text or element[0].tail:
+            return None
+        element = element[0]
+
+
+def get_text(element):
+    # lxml counterpart of BeautifulSoup's get_text(strip=True)
+    return "".join(text.strip() for text in element.itertext())
+
+
+def get_next_string(element):
+    # lxml counterpart of BeautifulSoup's find_next_sibling(string=True)
+    if element.tail is not None:
+        return element.tail
+    return next((sibling.tail for sibling in element.itersiblings() if sibling.tail is not None), None)
+
+
+class ListingParser(HTMLParser):
+    # Incremental parser for the sourcemod.net plugins.php listing. Feed it chunks of the body and
+    # collect finished rows with pop_rows(); only the current row is kept in memory.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.wells_seen = 0
+        self.div_depth = 0
+        self.well_depth = None
+        self.table_depth = 0
+        self.table_done = False
+        self.headers = None
+        self.updated_index = -1
+        self.cells = None
+        self.cell = None
+        self.rows = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'div':
+            self.div_depth += 1
+            if self.well_depth is None and 'well' in (dict(attrs).get('class') or '').split():
+                self.wells_seen += 1
+                if self.wells_seen == 2:
+                    self.well_depth = self.div_depth
+            return
+        if self.well_depth is None or self.table_done:
+            return
+        if tag == 'table':
+            self.table_depth += 1
+        elif self.table_depth != 1:
+            return
+        elif tag == 'tr':
+            self.end_row()
+            self.cells = []
+        elif tag in ('td', 'th') and self.cells is not None:
+            self.end_cell()
+            self.cell = {"text": [], "href": None, "link_text": None}
+        elif tag == 'a' and self.cell is not None and self.cell["href"] is None:
+            self.cell["href"] = dict(attrs).get('href')
+            self.cell["link_text"] = []
+
+    def handle_endtag(self, tag):
+        if tag == 'div':
+            if self.well_depth == self.div_depth:
+                self.end_row()
+                self.well_depth = None
+                self.table_done = True
+            self.div_depth -= 1
+            return
+        if self.well_depth is None or self.table_done:
+            return
+        if tag == 'table':
+            if self.table_depth == 1:
+                self.end_row()
+                self.table_done = True
+            self.table_depth -= 1
+        elif self.table_depth != 1:
+            return
+        elif tag == 'tr':
+            self.end_row()
+        elif tag in ('td', 'th'):
+            self.end_cell()
+        elif tag == 'a' and self.cell is not None and isinstance(self.cell["link_text"], list):
+            self.cell["link_text"] = "".join(self.cell["link_text"])
+
+    def handle_data(self, data):
+        if self.cell is None:
+            return
+        self.cell["text"].append(data)
+        if isinstance(self.cell["link_text"], list):
+            self.cell["link_text"].append(data)
+
+    def end_cell(self):
+        if self.cell is not None:
+            self.cell["text"] = "".join(self.cell["text"]).strip()
+            if isinstance(self.cell["link_text"], list):
+                self.cell["link_text"] = "".join(self.cell["link_text"])
+            self.cells.append(self.cell)
+            self.cell = None
+
+    def end_row(self):
+        if self.cells is None:
+            return
+        self.end_cell()
+        cells, self.cells = self.cells, None
+        if self.headers is None:
+            self.headers = [cell["text"].lower() for cell in cells]
+            self.updated_index = next(
+                (i for i, header in enumerate(self.headers) if 'updated' in header or 'date' in header), -1)
+            return
+        if len(cells) < 2 or cells[1]["href"] is None:
+            return
+        self.rows.append({
+            'name': cells[1]["link_text"].strip(),
+            'url': cells[1]["href"].strip(),
+            'last_updated': cells[self.updated_index]["text"],
+        })
+
+    def pop_rows(self):
+        rows, self.rows = self.rows, []
+        return rows
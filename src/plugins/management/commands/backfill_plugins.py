@@ -0,0 +1,46 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from plugins.services import IncrementalCrawler, PluginIngestor
+
+
+class Command(BaseCommand):
+    help = ("Scrape every plugin thread of the listing and write them with the bulk ingestion path. "
+            "Pages are fetched in threads and ingested in batches.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Plugins written per transaction")
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent page fetches")
+
+    def handle(self, *args, **options):
+        crawler = IncrementalCrawler()
+        downloader = crawler.downloader
+        ingestor = PluginIngestor()
+        urls = list(crawler.iter_plan(full=True))
+        self.stdout.write(f"Backfilling {len(urls)} plugins")
+
+        def scrape(url):
+            page = downloader.page_cache.fetch(url, force=True)
+            return page, downloader.extractor.extract(page.content, url)
+
+        written = 0
+        db_seconds = 0
+        queries = 0
+        with ThreadPoolExecutor(options["workers"]) as executor:
+            for start in range(0, len(urls), options["batch_size"]):
+                scraped = list(executor.map(scrape, urls[start:start + options["batch_size"]]))
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    written += len(ingestor.ingest([plugin_info for _, plugin_info in scraped]))
+                    for page, plugin_info in scraped:
+                        downloader.page_cache.save(page)
+                        crawler.checkpoint(plugin_info['url'])
+                db_seconds += time.perf_counter() - started
+                queries += len(captured)
+                self.stdout.write(f"{written}/{len(urls)}")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} plugins in {db_seconds:.2f}s of DB time "
+                                             f"({queries} queries)"))
@@ -0,0 +1,238 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from plugins.models import PluginFile
+from plugins.services import SourceModPluginDownloader, IncrementalCrawler
+from plugins.tasks import archive_plugin_files
+from tf2modportal.http import close_http_client, get_http_client
+from tf2modportal.replay import FixtureStore
+
+FORUM_URL = "https://forums.alliedmods.net/"
+
+
+def letters(number):
+    # Plugin names must survive Plugin.prepare_name, which strips digits
+    name = ""
+    number += 1
+    while number:
+        number, remainder = divmod(number - 1, 26)
+        name = chr(ord("a") + remainder) + name
+    return name.capitalize()
+
+
+class SyntheticCatalog:
+    # Writes a replayable listing, thread pages and attachments for num_plugins fake plugins
+    def __init__(self, store, num_plugins, listing_url):
+        self.store = store
+        self.num_plugins = num_plugins
+        self.listing_url = listing_url
+
+    def html(self, url, body):
+        self.store.save("GET", url, 200, {"Content-Type": "text/html; charset=utf-8"}, body.encode())
+
+    def binary(self, url, body):
+        self.store.save("GET", url, 200, {"Content-Type": "application/octet-stream"}, body)
+
+    def build(self):
+        rows = []
+        for index in range(self.num_plugins):
+            thread_url = f"{FORUM_URL}showthread.php?t={index}"
+            rows.append(f'<tr><td><img src="tf.gif"></td><td><a href="{thread_url}">Synthetic {letters(index)}</a>'
+                        f'</td><td>Fun Stuff</td><td>author{index}</td><td>2024-01-01</td></tr>')
+            self.build_plugin(index, thread_url)
+        self.html(self.listing_url, '<html><body><div class="well">search</div><div class="well"><table>'
+                                    '<tr><th>Mod</th><th>Title</th><th>Category</th><th>Author</th>'
+                                    f'<th>Last Updated</th></tr>{"".join(rows)}</table></div></body></html>')
+
+    def build_plugin(self, index, thread_url):
+        name = f"synthetic_{index}"
+        source = f'#include <sourcemod>\npublic Plugin myinfo = {{ name = "{name}" }};\n' * 50
+        self.binary(f"{FORUM_URL}attachment.php?attachmentid={index}1", source.encode())
+        self.binary(f"http://www.sourcemod.net/vbcompiler.php?file_id={index}1", os.urandom(8 * 1024))
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr(f"addons/sourcemod/plugins/{name}_extra.smx", os.urandom(16 * 1024))
+            zip_file.writestr(f"addons/sourcemod/scripting/{name}_extra.sp", source)
+            zip_file.writestr("addons/sourcemod/scripting/include/shared.inc", "#define SHARED 1\n" * 200)
+            zip_file.writestr(f"addons/sourcemod/translations/{name}.phrases.txt", '"Phrases" {}\n' * 100)
+        self.binary(f"{FORUM_URL}attachment.php?attachmentid={index}2", archive.getvalue())
+
+        self.html(thread_url, f"""<html><body><table id="post{index}"><tr><td>
+<div id="postmenu_{index}"><a class="bigusername" href="member.php?u={index}">author{index}</a></div>
+<div style="font-size: 14pt"><a href="{thread_url}">[TF2] Synthetic {letters(index)}</a></div>
+<table><tr><td><div>Plugin Version: </div></td><td><div>1.0.{index}</div></td></tr>
+<tr><td><div>Plugin Category: </div></td><td><div>Fun Stuff</div></td></tr>
+<tr><td><div>Plugin Game: </div></td><td><div>Team Fortress 2</div></td></tr></table>
+<div id="post_message_{index}">Synthetic plugin <b>{index}</b><code>sm_synthetic 1</code></div>
+<fieldset class="fieldset"><legend>Attached Files</legend>
+<a href="attachment.php?attachmentid={index}1">Get Source</a> ({name}.sp - 10 views - 2 KB)<br/>
+<a href="http://www.sourcemod.net/vbcompiler.php?file_id={index}1">Get Plugin</a><br/>
+<a href="attachment.php?attachmentid={index}2">{name}.zip</a> (20 KB)
+</fieldset></td></tr></table></body></html>""")
+
+
+class Command(BaseCommand):
+    help = ("Run the crawl pipeline (listing -> scrape -> download -> extract -> archive) against a replayed "
+            "synthetic catalog and report time, queries, HTTP traffic, bytes written and peak memory per stage. "
+            "All database changes are rolled back.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plugins", type=int, default=50, help="Number of synthetic plugins")
+        parser.add_argument("--fixtures", help="Replay this recorded fixture directory instead of a synthetic "
+                                               "catalog (see HTTP_RECORD_DIR)")
+        parser.add_argument("--keep", action="store_true", help="Keep the temporary media directory")
+
+    def handle(self, *args, **options):
+        work_dir = Path(tempfile.mkdtemp(prefix="tf2modportal-bench-"))
+        media_root = work_dir / "media"
+        fixtures_dir = Path(options["fixtures"]) if options["fixtures"] else work_dir / "fixtures"
+        listing_url = SourceModPluginDownloader.get_listing_url()
+        if not options["fixtures"]:
+            SyntheticCatalog(FixtureStore(fixtures_dir), options["plugins"], listing_url).build()
+
+        overrides = {
+            "MEDIA_ROOT": media_root,
+            "HTTP_REPLAY_DIR": str(fixtures_dir),
+            "HTTP_RECORD_DIR": None,
+            "HTTP_RATE_LIMITS": {},
+            "HTTP_CIRCUIT_ERROR_RATE": 0,
+            "PLUGINS_LISTING_MODS": [5],
+        }
+        close_http_client()
+        results = []
+        try:
+            with override_settings(**overrides), transaction.atomic():
+                self.run_pipeline(media_root, results)
+                http_stats = get_http_client().stats.snapshot()
+                transaction.set_rollback(True)
+        finally:
+            close_http_client()
+            if options["keep"]:
+                self.stdout.write(f"Kept {work_dir}")
+            else:
+                shutil.rmtree(work_dir)
+        self.report(results)
+        self.report_http(http_stats)
+
+    def run_pipeline(self, media_root, results):
+        downloader = SourceModPluginDownloader()
+        state = {}
+
+        def listing():
+            state["urls"] = list(IncrementalCrawler().iter_plan(full=True))
+            return len(state["urls"])
+
+        def scrape():
+            state["plugins"] = [downloader.get_plugin(url, force=True)[0] for url in state["urls"]]
+            return len(state["plugins"])
+
+        def download():
+            state["tags"] = []
+            count = 0
+            for plugin in state["plugins"]:
+                plugin_files, tag = plugin.get_files_to_download(plugin.get_latest_version())
+                state["tags"].append(tag)
+                plugin_files = list(plugin_files)
+                if settings.PLUGINS_DOWNLOAD_BATCH:
+                    errors = downloader.download_files(tag, plugin_files)
+                    if errors:
+                        raise CommandError(f"Download failed: {errors}")
+                else:
+                    for plugin_file in plugin_files:
+                        downloader.download_file(tag, plugin_file)
+                count += len(plugin_files)
+            return count
+
+        def extract():
+            count = 0
+            for tag in state["tags"]:
+                archives = tag.files.filter(file_type=PluginFile.FileType.ZIP)
+                if archives:
+                    downloader.extract_downloaded_files(tag, archives)
+                    count += 1
+            return count
+
+        def archive():
+            for tag in state["tags"]:
+                archive_plugin_files.apply(kwargs={"tag_id": tag.id})
+            return len(state["tags"])
+
+        tracemalloc.start()
+        try:
+            for name, stage in [("listing", listing), ("scrape", scrape), ("download", download),
+                                ("extract", extract), ("archive", archive)]:
+                results.append(self.measure(name, stage, media_root))
+        finally:
+            tracemalloc.stop()
+
+    @staticmethod
+    def disk_usage(path):
+        # Hardlinked blobs are counted once
+        seen = set()
+        total = 0
+        for file in Path(path).rglob("*"):
+            if file.is_file():
+                stat = file.stat()
+                if stat.st_ino not in seen:
+                    seen.add(stat.st_ino)
+                    total += stat.st_size
+        return total
+
+    @staticmethod
+    def http_totals():
+        host_stats = get_http_client().stats.snapshot().values()
+        return sum(stats["requests"] for stats in host_stats), sum(stats["bytes"] for stats in host_stats)
+
+    def measure(self, name, stage, media_root):
+        bytes_before = self.disk_usage(media_root)
+        requests_before, fetched_before = self.http_totals()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        # get_plugin prints every parsed plugin_info
+        with CaptureQueriesContext(connection) as queries, contextlib.redirect_stdout(io.StringIO()):
+            items = stage()
+        elapsed = time.perf_counter() - started
+        requests_after, fetched_after = self.http_totals()
+        return {
+            "stage": name,
+            "items": items,
+            "seconds": elapsed,
+            "queries": len(queries),
+            "requests": requests_after - requests_before,
+            "fetched": fetched_after - fetched_before,
+            "bytes": self.disk_usage(media_root) - bytes_before,
+            "peak_memory": tracemalloc.get_traced_memory()[1],
+        }
+
+    def report(self, results):
+        self.stdout.write(f"{'stage':<10}{'items':>8}{'seconds':>10}{'queries':>10}{'requests':>10}"
+                          f"{'fetched KiB':>14}{'written KiB':>14}{'peak KiB':>12}")
+        for result in results:
+            self.stdout.write(f"{result['stage']:<10}{result['items']:>8}{result['seconds']:>10.3f}"
+                              f"{result['queries']:>10}{result['requests']:>10}{result['fetched'] / 1024:>14.1f}"
+                              f"{result['bytes'] / 1024:>14.1f}{result['peak_memory'] / 1024:>12.1f}")
+        self.stdout.write(f"{'total':<10}{'':>8}{sum(r['seconds'] for r in results):>10.3f}"
+                          f"{sum(r['queries'] for r in results):>10}{sum(r['requests'] for r in results):>10}"
+                          f"{sum(r['fetched'] for r in results) / 1024:>14.1f}"
+                          f"{sum(r['bytes'] for r in results) / 1024:>14.1f}")
+
+    def report_http(self, http_stats):
+        # Latency is the time to the response headers, streamed bodies are not included
+        self.stdout.write(f"\n{'host':<32}{'requests':>10}{'errors':>8}{'fetched KiB':>14}{'avg ms':>10}")
+        for host, stats in sorted(http_stats.items()):
+            average = stats["elapsed"] / stats["requests"] * 1000 if stats["requests"] else 0
+            self.stdout.write(f"{host:<32}{stats['requests']:>10}{stats['errors']:>8}"
+                              f"{stats['bytes'] / 1024:>14.1f}{average:>10.2f}")
@@ -0,0 +1,51 @@
+import time
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand, CommandError
+
+from plugins.extractors import ThreadPageExtractor, DEFAULT_PARSER
+from plugins.services import SourceModPluginDownloader
+
+
+class Command(BaseCommand):
+    help = "Compare ThreadPageExtractor with the BeautifulSoup get_plugin_info path over saved thread pages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("corpus", help="Directory with saved thread pages (*.html)")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--parser", default=DEFAULT_PARSER, help="Tree builder used by the extractor")
+
+    def handle(self, *args, **options):
+        pages = [(path, path.read_bytes()) for path in sorted(Path(options["corpus"]).glob("*.html"))]
+        if not pages:
+            raise CommandError(f"No *.html pages found in {options['corpus']}")
+
+        downloader = SourceModPluginDownloader()
+        extractor = ThreadPageExtractor(downloader.get_blank_url(), parser=options["parser"])
+
+        def legacy(content, url):
+            downloader.soup = BeautifulSoup(content, 'html.parser')
+            return downloader.get_plugin_info(url)
+
+        mismatches = 0
+        for path, content in pages:
+            url = path.as_uri()
+            if legacy(content, url) != extractor.extract(content, url):
+                mismatches += 1
+                self.stderr.write(f"Output differs for {path.name}")
+
+        results = {}
+        for label, func in [("legacy", legacy), (f"extractor ({options['parser']})", extractor.extract)]:
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                for path, content in pages:
+                    func(content, path.as_uri())
+            results[label] = time.perf_counter() - started
+
+        runs = len(pages) * options["repeat"]
+        for label, elapsed in results.items():
+            self.stdout.write(f"{label:<28} {elapsed:8.3f}s total  {elapsed / runs * 1000:8.2f}ms/page")
+        legacy_time, extractor_time = results.values()
+        self.stdout.write(f"Speedup: {legacy_time / extractor_time:.2f}x over {len(pages)} pages, "
+                          f"{mismatches} mismatching outputs")
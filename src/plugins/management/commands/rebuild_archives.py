@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+
+from core.services import FileManager
+from plugins.models import Tag
+
+
+def rebuild_archive(job):
+    # Runs in a worker process and does not touch the database, the parent writes the results
+    tag_id, plugin_id, plugin_name, version, archive_hash, force = job
+    file_manager = FileManager()
+    archive_name = file_manager.get_archive_name(plugin_name, version)
+    entries = file_manager.get_archive_entries(plugin_id, version)
+    if not entries:
+        return tag_id, "empty", None, None, 0
+    archive_path = file_manager.base_plugins_download_path / plugin_id / version / archive_name
+    content_hash = file_manager.get_tree_hash(archive_path, entries, archive_name)
+    if not force and content_hash == archive_hash and archive_path.exists():
+        return tag_id, "unchanged", None, None, 0
+    # --force is for layout changes, so nothing is copied over from the old archive then
+    file_manager.archive_files(plugin_id, archive_name, version, incremental=not force)
+    return tag_id, "rebuilt", content_hash, archive_path, archive_path.stat().st_size
+
+
+class Command(BaseCommand):
+    help = ("Rebuild Tag.archive_file from the extracted file trees in a process pool. Tags whose content hash "
+            "has not changed are skipped, so an interrupted run continues where it stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--plugin", action="append", default=[], help="Plugin id or name (repeatable)")
+        parser.add_argument("--tag", action="append", default=[], help="Tag id (repeatable)")
+        parser.add_argument("--latest", action="store_true", help="Only the latest tag of every plugin")
+        parser.add_argument("--force", action="store_true", help="Rebuild even if the content hash is unchanged")
+        parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+        parser.add_argument("--batch-size", type=int, default=100, help="Results written per database update")
+
+    def get_tags(self, options):
+        tags = Tag.objects.select_related('plugin').order_by('id')
+        if options["plugin"]:
+            tags = tags.filter(Q(plugin__id__in=options["plugin"]) | Q(plugin__name__in=options["plugin"]))
+        if options["tag"]:
+            tags = tags.filter(id__in=options["tag"])
+        if options["latest"]:
+            tags = tags.filter(is_latest=True)
+        return list(tags)
+
+    def handle(self, *args, **options):
+        tags = {tag.id: tag for tag in self.get_tags(options)}
+        jobs = [
+            (tag.id, tag.plugin.id, tag.plugin.name, tag.version, tag.archive_hash, options["force"])
+            for tag in tags.values()
+        ]
+        self.stdout.write(f"Rebuilding archives of {len(jobs)} tags")
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+
+        counts = {"rebuilt": 0, "unchanged": 0, "empty": 0}
+        written_bytes = 0
+        pending = []
+        started = time.perf_counter()
+        with ProcessPoolExecutor(options["workers"], initializer=django.setup) as executor:
+            for done, (tag_id, status, content_hash, archive_path, size) in enumerate(
+                    executor.map(rebuild_archive, jobs, chunksize=4), 1):
+                counts[status] += 1
+                if status == "rebuilt":
+                    pending.append((tags[tag_id], content_hash, archive_path))
+                    written_bytes += size
+                if len(pending) >= options["batch_size"]:
+                    self.save(pending)
+                if done % options["batch_size"] == 0 or done == len(jobs):
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"{done}/{len(jobs)} tags, {done / elapsed:.1f} tags/s, "
+                                      f"{written_bytes / elapsed / 1024 / 1024:.1f} MiB/s")
+        self.save(pending)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {counts['rebuilt']}, unchanged {counts['unchanged']}, without files {counts['empty']} "
+            f"in {time.perf_counter() - started:.2f}s"))
+
+    @staticmethod
+    def save(pending):
+        # Persisting the hashes per batch is what lets an interrupted run resume
+        stale_files = []
+        for tag, content_hash, archive_path in pending:
+            stale_file = tag.assign_archive(archive_path, content_hash)
+            if stale_file is not None:
+                stale_files.append(stale_file)
+        Tag.objects.bulk_update([tag for tag, _, _ in pending], ['archive_file', 'archive_hash'])
+        for stale_file in stale_files:
+            stale_file.unlink(missing_ok=True)
+        pending.clear()
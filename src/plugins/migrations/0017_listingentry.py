@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:22
+
+import django.utils.timezone
+import prefix_id.field
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plugins', '0016_alter_pluginfile_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingEntry',
+            fields=[
+                ('id', prefix_id.field.PrefixIDField(editable=False, max_length=30, prefix='listing', primary_key=True, serialize=False, unique=True)),
+                ('url', models.URLField(max_length=500, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('last_updated', models.CharField(blank=True, max_length=255, null=True)),
+                ('row_hash', models.CharField(max_length=64)),
+                ('processed_hash', models.CharField(blank=True, max_length=64, null=True)),
+                ('last_seen_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('verified_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
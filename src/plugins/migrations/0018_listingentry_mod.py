@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plugins', '0017_listingentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listingentry',
+            name='mod',
+            field=models.IntegerField(default=5),
+        ),
+    ]
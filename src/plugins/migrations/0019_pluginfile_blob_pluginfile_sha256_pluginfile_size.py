@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_blob'),
+        ('plugins', '0018_listingentry_mod'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pluginfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='plugin_files', to='core.blob'),
+        ),
+        migrations.AddField(
+            model_name='pluginfile',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='pluginfile',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
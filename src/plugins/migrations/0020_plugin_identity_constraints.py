@@ -0,0 +1,87 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:32
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models, transaction
+from django.db.models import Count
+
+
+def merge_duplicates(apps, schema_editor):
+    # Concurrent get_plugin tasks could insert the same plugin/tag twice; fold the copies into one
+    # row before the unique constraints are added.
+    Plugin = apps.get_model('plugins', 'Plugin')
+    Tag = apps.get_model('plugins', 'Tag')
+    PluginFile = apps.get_model('plugins', 'PluginFile')
+    Build = apps.get_model('builds', 'Build')
+    BuildTag = Build.plugins_tags.through
+    PluginGame = Plugin.supported_games.through
+
+    duplicates = Plugin.objects.values('original_name', 'author').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        plugins = list(Plugin.objects.filter(original_name=duplicate['original_name'], author=duplicate['author'])
+                       .annotate(tags_count=Count('tags')).order_by('-tags_count', 'id'))
+        keeper, others = plugins[0], [plugin.id for plugin in plugins[1:]]
+        games = set(PluginGame.objects.filter(plugin_id=keeper.id).values_list('supportedgame_id', flat=True))
+        for game_id in set(PluginGame.objects.filter(plugin_id__in=others).values_list('supportedgame_id', flat=True)):
+            if game_id not in games:
+                PluginGame.objects.create(plugin_id=keeper.id, supportedgame_id=game_id)
+        Tag.objects.filter(plugin_id__in=others).update(plugin_id=keeper.id)
+        Plugin.objects.filter(id__in=others).delete()
+
+    stale_paths = set()
+    duplicates = Tag.objects.values('plugin_id', 'version').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        tags = list(Tag.objects.filter(plugin_id=duplicate['plugin_id'], version=duplicate['version'])
+                    .annotate(files_count=Count('files')).order_by('-is_latest', '-files_count', 'id'))
+        keeper, others = tags[0], [tag.id for tag in tags[1:]]
+        builds = set(BuildTag.objects.filter(tag_id=keeper.id).values_list('build_id', flat=True))
+        for build_id in set(BuildTag.objects.filter(tag_id__in=others).values_list('build_id', flat=True)):
+            if build_id not in builds:
+                BuildTag.objects.create(build_id=build_id, tag_id=keeper.id)
+        # Files the kept tag lacks move over, the rest go with the duplicate tags
+        files = set(PluginFile.objects.filter(tag_id=keeper.id).values_list('file_type', 'file_name'))
+        kept_paths = set(PluginFile.objects.filter(tag_id=keeper.id).values_list('file', flat=True))
+        kept_paths.add(keeper.archive_file.name)
+        for plugin_file in PluginFile.objects.filter(tag_id__in=others).order_by('id'):
+            if (plugin_file.file_type, plugin_file.file_name) not in files:
+                files.add((plugin_file.file_type, plugin_file.file_name))
+                kept_paths.add(plugin_file.file.name)
+                PluginFile.objects.filter(id=plugin_file.id).update(tag_id=keeper.id)
+            else:
+                stale_paths.add(plugin_file.file.name)
+        stale_paths.update(Tag.objects.filter(id__in=others).values_list('archive_file', flat=True))
+        stale_paths -= kept_paths
+        Tag.objects.filter(id__in=others).delete()
+
+    # Merged plugins bring their own latest tag, keep the one matching the plugin version
+    for plugin in Plugin.objects.filter(tags__is_latest=True).annotate(latest_count=Count('tags')) \
+            .filter(latest_count__gt=1):
+        latest_tags = Tag.objects.filter(plugin_id=plugin.id, is_latest=True)
+        latest = latest_tags.filter(version=plugin.version).first() or latest_tags.first()
+        latest_tags.exclude(id=latest.id).update(is_latest=False)
+
+    def delete_stale_files():
+        for path in stale_paths:
+            if path:
+                default_storage.delete(path)
+
+    # Files of dropped rows are removed once the merge is committed
+    transaction.on_commit(delete_stale_files)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('builds', '0002_remove_build_plugins_build_plugins_tags'),
+        ('plugins', '0019_pluginfile_blob_pluginfile_sha256_pluginfile_size'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='plugin',
+            constraint=models.UniqueConstraint(fields=('original_name', 'author'), name='unique_plugin_identity'),
+        ),
+        migrations.AddConstraint(
+            model_name='tag',
+            constraint=models.UniqueConstraint(fields=('plugin', 'version'), name='unique_tag_plugin_version'),
+        ),
+    ]
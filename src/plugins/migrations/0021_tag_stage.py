@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+def mark_archived_tags(apps, schema_editor):
+    # Tags that already have an archive went through the whole pipeline
+    Tag = apps.get_model('plugins', 'Tag')
+    Tag.objects.exclude(archive_file__isnull=True).exclude(archive_file='').update(stage='archived')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plugins', '0020_plugin_identity_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='stage',
+            field=models.CharField(choices=[('scraped', 'Scraped'), ('files_downloaded', 'Files downloaded'), ('extracted', 'Extracted'), ('archived', 'Archived')], default='scraped', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='stage_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_archived_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plugins', '0022_listingentry_refresh_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='archive_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.15 on 2026-10-18 10:21
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicates(apps, schema_editor):
+    # Concurrent ingest batches could create the same game twice; fold the copies into one row before
+    # the unique constraint is added.
+    SupportedGame = apps.get_model('plugins', 'SupportedGame')
+    Plugin = apps.get_model('plugins', 'Plugin')
+    PluginGame = Plugin.supported_games.through
+
+    duplicates = SupportedGame.objects.values('name', 'app_id').annotate(count=Count('id')).filter(count__gt=1)
+    for duplicate in duplicates:
+        games = list(SupportedGame.objects.filter(name=duplicate['name'], app_id=duplicate['app_id']).order_by('id'))
+        keeper, others = games[0], [game.id for game in games[1:]]
+        plugins = set(PluginGame.objects.filter(supportedgame_id=keeper.id).values_list('plugin_id', flat=True))
+        for plugin_id in set(PluginGame.objects.filter(supportedgame_id__in=others).values_list('plugin_id', flat=True)):
+            if plugin_id not in plugins:
+                PluginGame.objects.create(plugin_id=plugin_id, supportedgame_id=keeper.id)
+        SupportedGame.objects.filter(id__in=others).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plugins', '0023_tag_archive_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='supportedgame',
+            constraint=models.UniqueConstraint(fields=('name', 'app_id'), name='unique_supported_game'),
+        ),
+    ]
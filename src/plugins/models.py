@@ -2,25 +2,69 @@ import re
 import uuid
 from pathlib import Path
 
-import requests
 from django.conf import settings
-from django.core.files.storage import default_storage
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 from prefix_id import PrefixIDField
 
+from tf2modportal.http import get_http_client
+
+
+NAME_NOISE_PATTERN = re.compile(
+    r'\b(TF2|tf2|Team Fortress 2|v?\d+(\.\d+)*|(\d{4}-\d{2}-\d{2})|(\d{2}/\d{2}/\d{4})|[-_:\"\'{}\[\]\\/|.,()])\b',
+    re.IGNORECASE)
+SPECIAL_CHARACTERS_PATTERN = re.compile(r'[-_:\"\'{}\[\]\\/|.,()]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
 
 class Tag(models.Model):
+    class Stage(models.TextChoices):
+        # In pipeline order, a re-run continues after the last reached stage
+        SCRAPED = 'scraped', 'Scraped'
+        FILES_DOWNLOADED = 'files_downloaded', 'Files downloaded'
+        EXTRACTED = 'extracted', 'Extracted'
+        ARCHIVED = 'archived', 'Archived'
+
     id = PrefixIDField(prefix="tag", primary_key=True)
     tagged_name = models.CharField(max_length=255)
     plugin = models.ForeignKey('Plugin', on_delete=models.CASCADE, related_name='tags')
     version = models.CharField(max_length=255)
     is_latest = models.BooleanField(default=False)
     archive_file = models.FileField(upload_to='downloads/plugins', blank=True, null=True)
+    archive_hash = models.CharField(max_length=64, blank=True, default="")
+    stage = models.CharField(max_length=32, choices=Stage.choices, default=Stage.SCRAPED)
+    stage_updated_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['plugin', 'version'], name='unique_tag_plugin_version'),
+        ]
 
     def __str__(self):
         return f"{self.tagged_name}"
 
+    def has_reached(self, stage):
+        stages = list(Tag.Stage.values)
+        return stages.index(self.stage) >= stages.index(stage)
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self.stage_updated_at = timezone.now()
+        Tag.objects.filter(pk=self.pk).update(stage=self.stage, stage_updated_at=self.stage_updated_at)
+
+    def assign_archive(self, archive_path, archive_hash):
+        # Points archive_file at an archive under MEDIA_ROOT (not saved). Returns the previous archive
+        # file if it had another name, for the caller to delete once the tag is saved.
+        media_root = Path(settings.MEDIA_ROOT)
+        archive_name = Path(archive_path).relative_to(media_root).as_posix()
+        stale_file = None
+        if self.archive_file and self.archive_file.name != archive_name:
+            stale_file = media_root / self.archive_file.name
+        self.archive_file.name = archive_name
+        self.archive_hash = archive_hash
+        return stale_file
+
     def prepare_author(self):
         # Remove spaces from author name, replace with underscores, and make lowercase, e.g. qwizi
         return self.plugin.author.replace(" ", "_").lower()
@@ -71,10 +115,17 @@ class PluginFile(models.Model):
     file = models.FileField(upload_to='downloads/plugins/', blank=True, null=True, max_length=255)
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='files', blank=True, null=True)
     download_url = models.URLField(blank=True, null=True)
+    sha256 = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    size = models.BigIntegerField(blank=True, null=True)
+    blob = models.ForeignKey('core.Blob', on_delete=models.SET_NULL, related_name='plugin_files', blank=True,
+                             null=True)
 
     def __str__(self):
         return f"{self.file_type} {self.file.name}"
 
+    def is_downloaded(self):
+        return bool(self.sha256 and self.file and self.get_file_path().exists())
+
     def get_file_path(self):
         return Path(settings.MEDIA_ROOT) / self.file.name
 
@@ -101,6 +152,11 @@ class SupportedGame(models.Model):
     app_id = models.IntegerField()
     icon = models.URLField()
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'app_id'], name='unique_supported_game'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -123,21 +179,27 @@ class Plugin(models.Model):
     description = models.TextField(blank=True, null=True)
     url = models.URLField(null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['original_name', 'author'], name='unique_plugin_identity'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.plugin_source}"
 
-    def prepare_name(self):
+    @staticmethod
+    def clean_name(original_name):
         # Remove any variations of TF2, Team Fortress 2, version numbers, dates, and special characters
-        pattern = re.compile(
-            r'\b(TF2|tf2|Team Fortress 2|v?\d+(\.\d+)*|(\d{4}-\d{2}-\d{2})|(\d{2}/\d{2}/\d{4})|[-_:\"\'{}\[\]\\/|.,()])\b',
-            re.IGNORECASE)
-        cleaned_name = pattern.sub('', self.original_name)
+        cleaned_name = NAME_NOISE_PATTERN.sub('', original_name)
         # Remove any remaining special characters
-        cleaned_name = re.sub(r'[-_:\"\'{}\[\]\\/|.,()]', '', cleaned_name)
+        cleaned_name = SPECIAL_CHARACTERS_PATTERN.sub('', cleaned_name)
         # Remove extra spaces
-        cleaned_name = re.sub(r'\s+', ' ', cleaned_name)
+        cleaned_name = WHITESPACE_PATTERN.sub(' ', cleaned_name)
         return cleaned_name.strip()
 
+    def prepare_name(self):
+        return self.clean_name(self.original_name)
+
     def slugify(self):
         return slugify(self.name)
 
@@ -148,8 +210,6 @@ class Plugin(models.Model):
                 return short_id
 
     def download_file(self, url, file_name, file_type):
-        response = requests.get(url)
-        response.raise_for_status()
         file_path = None
         if file_type == PluginFile.FileType.SP:
             file_path = Path(
@@ -157,9 +217,7 @@ class Plugin(models.Model):
         if file_type == PluginFile.FileType.SMX:
             file_path = Path(
                 settings.MEDIA_ROOT) / "tmp/downloads/plugins/" / self.id / file_name
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        with default_storage.open(file_path, 'wb+') as destination:
-            destination.write(response.content)
+        get_http_client().download(url, file_path)
 
     def get_files_to_download(self, version):
         tag = self.tags.filter(version=version).first()
@@ -180,5 +238,34 @@ class Plugin(models.Model):
         if not self.short_id:
             self.short_id = self.generate_short_id()
         self.name = self.prepare_name()
-        self.slug = self.slugify()
+        # A slug is kept once set, it may carry the short id that made it unique
+        if not self.slug:
+            self.slug = self.slugify()
+            if Plugin.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
+                self.slug = f"{self.slug}-{self.short_id}"
         super().save(*args, **kwargs)
+
+
+class ListingEntry(models.Model):
+    # Snapshot of one row of the sourcemod.net plugin listing. row_hash is the listing state last
+    # seen, processed_hash the state last scraped successfully (the crawl checkpoint).
+    id = PrefixIDField(prefix="listing", primary_key=True)
+    url = models.URLField(max_length=500, unique=True)
+    mod = models.IntegerField(default=5)
+    name = models.CharField(max_length=255)
+    last_updated = models.CharField(max_length=255, blank=True, null=True)
+    row_hash = models.CharField(max_length=64)
+    processed_hash = models.CharField(max_length=64, blank=True, null=True)
+    last_seen_at = models.DateTimeField(default=timezone.now)
+    verified_at = models.DateTimeField(blank=True, null=True)
+    # Adaptive refresh: the interval grows while the thread stays unchanged and resets on a change
+    changed_at = models.DateTimeField(blank=True, null=True)
+    check_interval = models.PositiveIntegerField(blank=True, null=True)
+    next_check_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def is_pending(self):
+        return self.processed_hash != self.row_hash
@@ -1,4 +1,11 @@
+import codecs
+import hashlib
+import random
+import time
+import uuid
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from pathlib import Path
 
 import markdown
@@ -6,9 +13,20 @@ import requests
 from bs4 import BeautifulSoup
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.text import slugify
 
-from core.services import FileManager
-from plugins.models import Plugin, Category, SupportedGame, PluginFile, Tag
+from core.services import FileManager, PageCache
+from plugins.extractors import ThreadPageExtractor, ListingParser
+from plugins.models import Plugin, Category, SupportedGame, PluginFile, Tag, ListingEntry
+from tf2modportal.circuitbreaker import CircuitOpenError
+from tf2modportal.http import RETRY_STATUSES, get_http_client
+
+
+class PluginPageError(Exception):
+    pass
 
 
 class SourceModPluginDownloader:
@@ -16,6 +34,9 @@ class SourceModPluginDownloader:
         self.url = "https://forums.alliedmods.net/"
         self.soup = None
         self.file_manager = FileManager()
+        self.client = get_http_client()
+        self.page_cache = PageCache()
+        self.extractor = ThreadPageExtractor(self.url)
 
     def get_blank_url(self):
         return self.url
@@ -146,49 +167,77 @@ class SourceModPluginDownloader:
         }
 
     def download_file(self, tag, plugin_file):
-        response = requests.get(plugin_file.download_url)
-        response.raise_for_status()
-        file_path = self.file_manager.save_file(response, plugin_file, tag)
+        file_path = self.file_manager.get_file_path(plugin_file, tag)
+        if plugin_file.is_downloaded():
+            return file_path
+        download = self.client.download(plugin_file.download_url, file_path)
+        self.file_manager.save_file(download, plugin_file)
         return file_path
 
+    def fetch_file(self, url, file_path):
+        # Runs in a worker thread: HTTP only, the database is updated by download_files afterwards
+        attempts = settings.PLUGINS_DOWNLOAD_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                return self.client.download(url, file_path)
+            except requests.RequestException as e:
+                if attempt + 1 == attempts or not self.is_retryable(e):
+                    raise
+                time.sleep(settings.HTTP_BACKOFF_FACTOR * 2 ** attempt)
+
+    @staticmethod
+    def is_retryable(error):
+        # A missing or removed attachment (404, 410) stays missing, only transient failures are retried
+        if isinstance(error, requests.HTTPError):
+            return error.response is not None and error.response.status_code in RETRY_STATUSES
+        return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+    def download_files(self, tag, plugin_files):
+        # Downloads all files of a tag concurrently over the shared client and records them with one
+        # bulk update. Returns {plugin_file_id: error} for files that failed every attempt.
+        pending = [plugin_file for plugin_file in plugin_files if not plugin_file.is_downloaded()]
+        if not pending:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(settings.PLUGINS_DOWNLOAD_WORKERS, len(pending))) as executor:
+            futures = [
+                (plugin_file, executor.submit(self.fetch_file, plugin_file.download_url,
+                                              self.file_manager.get_file_path(plugin_file, tag)))
+                for plugin_file in pending
+            ]
+        errors = {}
+        circuit_error = None
+        downloaded = []
+        for plugin_file, future in futures:
+            try:
+                download = future.result()
+            except CircuitOpenError as e:
+                circuit_error = e
+                continue
+            except Exception as e:
+                errors[plugin_file.id] = repr(e)
+                continue
+            self.file_manager.save_file(download, plugin_file, commit=False)
+            downloaded.append(plugin_file)
+        PluginFile.objects.bulk_update(downloaded, ['blob', 'sha256', 'size', 'file'])
+        if circuit_error is not None:
+            raise circuit_error
+        return errors
+
     def archive_files(self, plugin_id, plugin_name, version):
-        archive_name = f"{plugin_name} {version}.zip"
-        return self.file_manager.archive_files(plugin_id, archive_name, version)
+        # Returns the archive path and its content hash
+        archive_name = self.file_manager.get_archive_name(plugin_name, version)
+        archive_path = self.file_manager.archive_files(plugin_id, archive_name, version)
+        entries = self.file_manager.get_archive_entries(plugin_id, version)
+        return archive_path, self.file_manager.get_tree_hash(archive_path, entries, archive_name)
 
     def save_to_db(self, plugin_info):
-        category, _ = Category.objects.get_or_create(name=plugin_info['category'])
-        supported_game, _ = SupportedGame.objects.get_or_create(name=plugin_info['game'], app_id=440,
-                                                                icon="https://www.sourcemod.net/images/tf.gif")
-        plugin = Plugin.objects.create(
-            original_name=plugin_info['name'],
-            description=plugin_info['description'],
-            author=plugin_info['author']['name'],
-            version=plugin_info['version'],
-            url=plugin_info['url'],
-            category=category,
-        )
-        plugin.supported_games.add(supported_game)
-        tag, _ = Tag.objects.get_or_create(plugin=plugin, version=plugin_info['version'], defaults={"is_latest": True})
-
-        plugin_files = []
-        if len(plugin_info['download_links']) > 0:
-            for link in plugin_info['download_links']:
-                file_type = PluginFile.FileType.SP if "source" in link else PluginFile.FileType.SMX
-                if "source" in link:
-                    file_type = PluginFile.FileType.SP
-                if "plugin" in link:
-                    file_type = PluginFile.FileType.SMX
-                if "compiled_plugin" in link:
-                    file_type = PluginFile.FileType.SMX
-                if "zip_attachment" in link:
-                    file_type = PluginFile.FileType.ZIP
-                plugin_files.append(PluginFile.objects.create(
-                    file_type=file_type,
-                    file_name=link[list(link.keys())[0]]['file_name'],
-                    download_url=link[list(link.keys())[0]]['url'],
-                    tag=tag
-                ))
-        return plugin, plugin_files
+        # Returns the plugin and whether anything was written
+        ingested = PluginIngestor().ingest([plugin_info])
+        if not ingested:
+            # ingest skips entries without a name
+            raise PluginPageError(f"No plugin name found on {plugin_info.get('url')}")
+        plugin, tag, created, changed = ingested[0]
+        return plugin, changed
 
     def make_archive(self, name, version):
         plugin_dir = Path(settings.MEDIA_ROOT) / "downloads/plugins" / name
@@ -200,34 +249,42 @@ class SourceModPluginDownloader:
                     zip_file.write(file, file.relative_to(plugin_dir))
         return archive_path.name
 
-    def get_plugin(self, plugin_url):
-        response = requests.get(plugin_url)
-        response.raise_for_status()
-        self.soup = BeautifulSoup(response.content, 'html.parser')
-        plugin_info = self.get_plugin_info(plugin_url)
+    def get_plugin(self, plugin_url, force=False):
+        # Returns (plugin, changed); plugin is None when the thread page has not changed since the last crawl
+        page = self.page_cache.fetch(plugin_url, force=force)
+        if page is None:
+            return None, False
+        plugin_info = self.extractor.extract(page.content, plugin_url)
         print(plugin_info)
-        if Plugin.objects.filter(original_name=plugin_info['name'], author=plugin_info["author"]["name"]).exists():
-            plugin = Plugin.objects.get(original_name=plugin_info['name'], author=plugin_info["author"]["name"])
-            if Tag.objects.filter(plugin=plugin, version=plugin_info['version']).exists():
-                return plugin
-
-        plugin, plugin_file = self.save_to_db(plugin_info)
-        return plugin
-
-    def find_plugins(self):
-        url = "https://www.sourcemod.net/plugins.php?cat=0&mod=5&title=&author=&description=&search=1"
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        plugins = []
-        rows = soup.find_all('div', class_='well')[1].find('table').find_all('tr')[1:]
-        for row in rows:
-            name_a = row.find_all('td')[1].find('a')
-            plugins.append({
-                'name': name_a.text.strip(),
-                'url': name_a['href'].strip()
-            })
-        return plugins
+        plugin, changed = self.save_to_db(plugin_info)
+        self.page_cache.save(page)
+        return plugin, changed
+
+    @staticmethod
+    def get_listing_url(mod=5):
+        return f"https://www.sourcemod.net/plugins.php?cat=0&mod={mod}&title=&author=&description=&search=1"
+
+    def fetch_listing(self, mod=5, force=False):
+        # Returns None when the listing has not changed since the last crawl
+        return self.page_cache.fetch(self.get_listing_url(mod), force=force, stream=True)
+
+    def iter_listing(self, page):
+        # Yields {name, url, last_updated} rows while the listing body is still being downloaded
+        parser = ListingParser()
+        decoder = codecs.getincrementaldecoder(page.response.encoding or 'utf-8')(errors='replace')
+        for chunk in page.iter_content():
+            parser.feed(decoder.decode(chunk))
+            yield from parser.pop_rows()
+        parser.feed(decoder.decode(b'', final=True))
+        parser.close()
+        yield from parser.pop_rows()
+        self.page_cache.save(page)
+
+    def find_plugins(self, force=False, mod=5):
+        page = self.fetch_listing(mod, force=force)
+        if page is None:
+            return None
+        return list(self.iter_listing(page))
 
     def extract_downloaded_files(self, tag, plugin_files):
         plugin_dir = Path(settings.MEDIA_ROOT) / "downloads/plugins" / tag.plugin.id / tag.version / "temp"
@@ -240,31 +297,333 @@ class SourceModPluginDownloader:
         return plugin_dir
 
     def add_extracted_files_to_db(self, tag):
-        plugin_dir = Path(settings.MEDIA_ROOT) / "downloads/plugins" / tag.plugin.id / tag.version / "files"
-        added_files = set()
-
+        # Records the .sp/.smx files of the extracted tree the tag does not have yet, with one lookup and
+        # one insert for the whole tree
+        base_name = f"downloads/plugins/{tag.plugin.id}/{tag.version}/files"
+        plugin_dir = Path(settings.MEDIA_ROOT) / base_name
+        file_types = {
+            ".sp": (PluginFile.FileType.SP, "addons/sourcemod/scripting"),
+            ".smx": (PluginFile.FileType.SMX, "addons/sourcemod/plugins"),
+        }
+        known = set(tag.files.filter(file_type__in=[file_type for file_type, _ in file_types.values()])
+                    .values_list('file_type', 'file_name'))
+        files = []
         for file in plugin_dir.rglob("*"):
-            if file.suffix == ".sp" and file.name not in added_files:
-                if not PluginFile.objects.filter(file_name=file.name, tag=tag,
-                                                 file_type=PluginFile.FileType.SP).exists():
-                    plugin_file = PluginFile.objects.create(
-                        file_type=PluginFile.FileType.SP,
-                        file_name=file.name,
-                        tag=tag,
-                    )
-                    file_name = f"downloads/plugins/{tag.plugin.id}/{tag.version}/files/addons/sourcemod/scripting/{file.name}"
-                    plugin_file.file.name = file_name
-                    plugin_file.save()
-                    added_files.add(file.name)
-            if file.suffix == ".smx" and file.name not in added_files:
-                if not PluginFile.objects.filter(file_name=file.name, tag=tag,
-                                                 file_type=PluginFile.FileType.SMX).exists():
-                    plugin_file = PluginFile.objects.create(
-                        file_type=PluginFile.FileType.SMX,
-                        file_name=file.name,
-                        tag=tag,
-                    )
-                    file_name = f"downloads/plugins/{tag.plugin.id}/{tag.version}/files/addons/sourcemod/plugins/{file.name}"
-                    plugin_file.file.name = file_name
-                    plugin_file.save()
-                    added_files.add(file.name)
+            if file.suffix in file_types and (file_types[file.suffix][0], file.name) not in known:
+                known.add((file_types[file.suffix][0], file.name))
+                files.append(file)
+        plugin_files = []
+        for file, blob in zip(files, self.file_manager.blob_store.add_many(files)):
+            file_type, directory = file_types[file.suffix]
+            plugin_file = PluginFile(file_type=file_type, file_name=file.name, tag=tag, blob=blob, sha256=blob.sha256,
+                                     size=blob.size)
+            plugin_file.file.name = f"{base_name}/{directory}/{file.name}"
+            plugin_files.append(plugin_file)
+        PluginFile.objects.bulk_create(plugin_files)
+
+
+class PluginIngestor:
+    # Writes many parsed plugin_info dicts with a handful of bulk queries in one transaction.
+    # Categories and games are resolved from in-process maps, names/slugs/short ids are computed
+    # without per-row lookups.
+    game_app_id = 440
+    game_icon = "https://www.sourcemod.net/images/tf.gif"
+
+    @staticmethod
+    def get_link_file_type(link):
+        if "zip_attachment" in link:
+            return PluginFile.FileType.ZIP
+        if "source" in link:
+            return PluginFile.FileType.SP
+        return PluginFile.FileType.SMX
+
+    def resolve_categories(self, names):
+        # Slugs are the unique key, names that slugify the same share one category
+        slugs = {name: slugify(name) for name in names}
+        categories = {category.slug: category for category in Category.objects.filter(slug__in=slugs.values())}
+        missing = {slug: Category(name=name, slug=slug) for name, slug in slugs.items() if slug not in categories}
+        if missing:
+            Category.objects.bulk_create(missing.values(), ignore_conflicts=True)
+            categories = {category.slug: category for category in Category.objects.filter(slug__in=slugs.values())}
+        return {name: categories[slug] for name, slug in slugs.items()}
+
+    def resolve_games(self, names):
+        games = {game.name: game for game in SupportedGame.objects.filter(name__in=names, app_id=self.game_app_id)}
+        missing = [SupportedGame(name=name, app_id=self.game_app_id, icon=self.game_icon)
+                   for name in names if name not in games]
+        if missing:
+            # Another worker may insert the same game, the re-read picks up whichever row won
+            SupportedGame.objects.bulk_create(missing, ignore_conflicts=True)
+            games = {game.name: game for game in SupportedGame.objects.filter(name__in=names, app_id=self.game_app_id)}
+        return games
+
+    @staticmethod
+    def generate_short_ids(count, slugs=()):
+        # Returns count unused short ids and which of slugs are taken; the first round checks both at once
+        short_ids, taken_slugs = set(), set()
+        while len(short_ids) < count:
+            candidates = {str(uuid.uuid4())[:8] for _ in range(count - len(short_ids))}
+            rows = Plugin.objects.filter(Q(short_id__in=candidates) | Q(slug__in=slugs)).values_list('short_id', 'slug')
+            taken_slugs |= {slug for _, slug in rows if slug in slugs}
+            short_ids |= candidates - {short_id for short_id, _ in rows}
+            slugs = ()
+        return list(short_ids), taken_slugs
+
+    def build_new_plugins(self, infos):
+        plugins = []
+        for info in infos:
+            plugin = Plugin(original_name=info['name'], author=info['author']['name'])
+            plugin.name = Plugin.clean_name(plugin.original_name)
+            plugin.slug = plugin.slugify()
+            plugins.append(plugin)
+        short_ids, taken = self.generate_short_ids(len(plugins), {plugin.slug for plugin in plugins})
+        # Slugs are unique, append the short id where two plugins clean up to the same name
+        seen = set()
+        for plugin, short_id in zip(plugins, short_ids):
+            plugin.short_id = short_id
+            if plugin.slug in taken or plugin.slug in seen:
+                plugin.slug = f"{plugin.slug}-{plugin.short_id}"
+            seen.add(plugin.slug)
+        return plugins
+
+    @staticmethod
+    def build_tag(plugin, version):
+        tag = Tag(plugin=plugin, version=version, is_latest=True)
+        tag.tagged_name = tag.prepare_tagged_name()
+        return tag
+
+    @transaction.atomic
+    def ingest(self, plugin_infos):
+        # Returns [(plugin, tag, created, changed)] in input order. created is True when this call
+        # inserted the tag, changed when the plugin row or its tags were written at all.
+        infos = {}
+        for info in plugin_infos:
+            if info.get('name'):
+                infos[(info['name'], info['author']['name'])] = info
+        if not infos:
+            return []
+
+        existing = {
+            (plugin.original_name, plugin.author): plugin
+            for plugin in Plugin.objects.filter(original_name__in={name for name, _ in infos}).select_related('category')
+            if (plugin.original_name, plugin.author) in infos
+        }
+        changed = {
+            key for key, plugin in existing.items()
+            if (plugin.description, plugin.version, plugin.url, plugin.category.name if plugin.category else None)
+            != (infos[key]['description'], infos[key]['version'], infos[key]['url'], infos[key]['category'])
+        }
+        new_plugins = self.build_new_plugins([info for key, info in infos.items() if key not in existing])
+        plugins = dict(existing)
+        plugins.update({(plugin.original_name, plugin.author): plugin for plugin in new_plugins})
+        changed.update(plugin_key for plugin_key in plugins if plugin_key not in existing)
+
+        inserted = set()
+        if changed:
+            categories = self.resolve_categories({infos[key]['category'] for key in changed})
+            games = self.resolve_games({infos[key]['game'] for key in changed})
+            for key in changed:
+                plugin = plugins[key]
+                plugin.description = infos[key]['description']
+                plugin.version = infos[key]['version']
+                plugin.url = infos[key]['url']
+                plugin.category = categories[infos[key]['category']]
+            # One upsert on the (original_name, author) identity; a plugin inserted concurrently by
+            # another worker is updated instead of duplicated
+            Plugin.objects.bulk_create([plugins[key] for key in changed], update_conflicts=True,
+                                       unique_fields=['original_name', 'author'],
+                                       update_fields=['description', 'version', 'url', 'category'], batch_size=500)
+            if new_plugins:
+                # Ids of rows that lost the race belong to the other worker
+                for plugin in Plugin.objects.filter(original_name__in={plugin.original_name for plugin in new_plugins}):
+                    key = (plugin.original_name, plugin.author)
+                    if key in plugins and key not in existing:
+                        plugins[key] = plugin
+                # Rows this call inserted are invisible to other workers until commit, so they have no tags
+                inserted = {plugin.id for plugin in new_plugins} & {plugin.id for plugin in plugins.values()}
+            Plugin.supported_games.through.objects.bulk_create([
+                Plugin.supported_games.through(plugin_id=plugins[key].id, supportedgame_id=games[infos[key]['game']].id)
+                for key in changed
+            ], ignore_conflicts=True)
+
+        tags = {
+            (tag.plugin_id, tag.version): tag
+            for tag in Tag.objects.filter(plugin_id__in=[plugin.id for plugin in plugins.values()
+                                                         if plugin.id not in inserted])
+        } if len(inserted) < len(plugins) else {}
+        new_tags = []
+        for key, plugin in plugins.items():
+            if (plugin.id, infos[key]['version']) not in tags:
+                tag = self.build_tag(plugin, infos[key]['version'])
+                tags[(plugin.id, tag.version)] = tag
+                new_tags.append(tag)
+        created_tags = []
+        if new_tags:
+            Tag.objects.bulk_create(new_tags, ignore_conflicts=True, batch_size=500)
+            # Only tags of older plugins can lose a race or replace a latest tag
+            contested = [tag for tag in new_tags if tag.plugin_id not in inserted]
+            stored = set(Tag.objects.filter(id__in=[tag.id for tag in contested]).values_list('id', flat=True)) \
+                if contested else set()
+            created_tags = [tag for tag in new_tags if tag.plugin_id in inserted or tag.id in stored]
+            for tag in contested:
+                if tag.id not in stored:
+                    tags[(tag.plugin_id, tag.version)] = Tag.objects.get(plugin_id=tag.plugin_id, version=tag.version)
+            # A new version becomes the latest one of its plugin
+            latest = [tag for tag in contested if tag.id in stored]
+            if latest:
+                Tag.objects.filter(plugin_id__in=[tag.plugin_id for tag in latest], is_latest=True) \
+                    .exclude(id__in=[tag.id for tag in latest]).update(is_latest=False)
+
+        PluginFile.objects.bulk_create([
+            PluginFile(
+                file_type=self.get_link_file_type(link),
+                file_name=link[list(link.keys())[0]]['file_name'],
+                download_url=link[list(link.keys())[0]]['url'],
+                tag=tag,
+            )
+            for tag in created_tags
+            for link in infos[(tag.plugin.original_name, tag.plugin.author)]['download_links']
+        ], batch_size=500)
+
+        created_ids = {tag.id for tag in created_tags}
+        results = []
+        for info in plugin_infos:
+            if not info.get('name'):
+                continue
+            key = (info['name'], info['author']['name'])
+            plugin = plugins[key]
+            tag = tags[(plugin.id, info['version'])]
+            results.append((plugin, tag, tag.id in created_ids, key in changed or tag.id in created_ids))
+        return results
+
+
+class IncrementalCrawler:
+    def __init__(self):
+        self.downloader = SourceModPluginDownloader()
+        self.mods = settings.PLUGINS_LISTING_MODS
+        self.reverify_batch = settings.PLUGINS_CRAWL_REVERIFY_BATCH
+        self.batch_size = 200
+        self.stats = {}
+
+    @staticmethod
+    def row_hash(row):
+        return hashlib.sha256(f"{row['name']}\x00{row.get('last_updated') or ''}".encode()).hexdigest()
+
+    def update_snapshot(self, mod, rows, entries, now):
+        # Only new rows and rows whose data differs are written, the rest just get last_seen_at
+        new_entries = []
+        changed_entries = []
+        seen_ids = []
+        for row in rows:
+            row_hash = self.row_hash(row)
+            entry = entries.get(row['url'])
+            if entry is None:
+                entry = ListingEntry(url=row['url'], mod=mod, name=row['name'], last_updated=row.get('last_updated'),
+                                     row_hash=row_hash, last_seen_at=now)
+                entries[entry.url] = entry
+                new_entries.append(entry)
+            elif (entry.mod, entry.name, entry.last_updated, entry.row_hash) \
+                    != (mod, row['name'], row.get('last_updated'), row_hash):
+                if entry.row_hash != row_hash:
+                    # The listing reports an update, check the thread on the next refresh run
+                    entry.next_check_at = now
+                entry.mod = mod
+                entry.name = row['name']
+                entry.last_updated = row.get('last_updated')
+                entry.row_hash = row_hash
+                entry.last_seen_at = now
+                changed_entries.append(entry)
+            else:
+                entry.last_seen_at = now
+                seen_ids.append(entry.id)
+        ListingEntry.objects.bulk_create(new_entries, batch_size=500)
+        ListingEntry.objects.bulk_update(changed_entries, ['mod', 'name', 'last_updated', 'row_hash', 'last_seen_at',
+                                                           'next_check_at'], batch_size=500)
+        if seen_ids:
+            ListingEntry.objects.filter(id__in=seen_ids).update(last_seen_at=now)
+        return [entries[row['url']] for row in rows]
+
+    def iter_listing_entries(self, mod, entries, full):
+        # Streams the listing and persists the snapshot in batches, so rows can be scheduled before
+        # the whole page is parsed. An unchanged listing falls back to the stored snapshot.
+        page = self.downloader.fetch_listing(mod, force=full)
+        if page is None:
+            yield from [entry for entry in entries.values() if entry.mod == mod]
+            return
+        now = timezone.now()
+        batch = []
+        for row in self.downloader.iter_listing(page):
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield from self.update_snapshot(mod, batch, entries, now)
+                batch = []
+        yield from self.update_snapshot(mod, batch, entries, now)
+
+    def iter_plan(self, full=False):
+        # Yields plugin urls to scrape; per-run counters are available in self.stats afterwards
+        self.stats = {"mode": "full" if full else "incremental", "total": 0, "processed": 0, "skipped": 0,
+                      "pending": 0, "reverified": 0}
+        entries = {entry.url: entry for entry in ListingEntry.objects.all()}
+        scheduled = set()
+        for mod in self.mods:
+            for entry in self.iter_listing_entries(mod, entries, full):
+                self.stats["total"] += 1
+                if full or entry.is_pending:
+                    self.stats["pending"] += 1
+                    scheduled.add(entry.url)
+                    yield entry.url
+
+        if not full:
+            reverify = ListingEntry.objects.filter(processed_hash=F('row_hash')) \
+                .order_by(F('verified_at').asc(nulls_first=True)).values_list('url', flat=True)
+            for url in reverify.iterator():
+                if self.stats["reverified"] >= self.reverify_batch:
+                    break
+                if url in scheduled:
+                    continue
+                self.stats["reverified"] += 1
+                yield url
+
+        self.stats["processed"] = self.stats["pending"] + self.stats["reverified"]
+        self.stats["skipped"] = self.stats["total"] - self.stats["processed"]
+
+    @staticmethod
+    def checkpoint(plugin_url):
+        ListingEntry.objects.filter(url=plugin_url).update(processed_hash=F('row_hash'), verified_at=timezone.now())
+
+
+class RefreshScheduler:
+    # Per-thread refresh schedule on ListingEntry: the check interval doubles (by
+    # PLUGINS_REFRESH_BACKOFF) every time a thread is found unchanged, up to the max, and drops
+    # back to the min when it changed. Jitter spreads checks that would otherwise line up.
+    def __init__(self):
+        self.min_interval = settings.PLUGINS_REFRESH_MIN_INTERVAL
+        self.max_interval = settings.PLUGINS_REFRESH_MAX_INTERVAL
+        self.backoff = settings.PLUGINS_REFRESH_BACKOFF
+        self.jitter = 0.1
+
+    def get_interval(self, interval, changed):
+        if changed or not interval:
+            return self.min_interval
+        return min(int(interval * self.backoff), self.max_interval)
+
+    def record(self, plugin_url, changed, now=None):
+        now = now or timezone.now()
+        entry = ListingEntry.objects.filter(url=plugin_url).first()
+        if entry is None:
+            return None
+        entry.check_interval = self.get_interval(entry.check_interval, changed)
+        entry.next_check_at = now + timedelta(
+            seconds=entry.check_interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+        if changed:
+            entry.changed_at = now
+        entry.save(update_fields=['check_interval', 'next_check_at', 'changed_at'])
+        return entry
+
+    @staticmethod
+    def iter_due(limit, now=None):
+        # Never checked threads first, then the most overdue ones
+        now = now or timezone.now()
+        due = ListingEntry.objects.filter(Q(next_check_at__lte=now) | Q(next_check_at__isnull=True)) \
+            .order_by(F('next_check_at').asc(nulls_first=True)).values_list('url', flat=True)[:limit]
+        yield from due.iterator()
@@ -1,43 +1,120 @@
-from pathlib import Path
+import logging
+import random
+import uuid
 
-from celery import shared_task, group, chord, chain
+from celery import shared_task, chain
 from celery.exceptions import Ignore
 from django.conf import settings
-from django.core.files.storage import default_storage
 
+from core.services import CompletionCounter, TaskLock
 from plugins.models import Plugin, PluginFile, Tag
-from plugins.services import SourceModPluginDownloader
+from plugins.services import SourceModPluginDownloader, IncrementalCrawler, RefreshScheduler, PluginPageError
+from tf2modportal.circuitbreaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+def get_scrape_lock(plugin_url):
+    return TaskLock(f"scrape:{plugin_url}", settings.PLUGINS_SCRAPE_LOCK_TIMEOUT)
+
+
+def get_pipeline_lock(tag_id):
+    return TaskLock(f"pipeline:{tag_id}", settings.PLUGINS_PIPELINE_LOCK_TIMEOUT)
+
+
+def defer(task, error):
+    # Re-queues the task until the host's circuit closes again instead of failing it. The jitter
+    # keeps deferred tasks from all hitting the half-open probe at once.
+    return task.retry(exc=error, countdown=error.retry_after + random.uniform(1, 30), max_retries=None)
 
 
 @shared_task(bind=True, name='plugins.tasks.get_plugin')
-def get_plugin(self, plugin_url):
+def get_plugin(self, plugin_url, force=False):
+    # The scrape lock is taken by get_plugins when it enqueues the url and kept while deferred
+    deferred = False
     try:
         plugin_downloader = SourceModPluginDownloader()
-        plugin = plugin_downloader.get_plugin(plugin_url)
+        plugin, changed = plugin_downloader.get_plugin(plugin_url, force=force)
+        IncrementalCrawler.checkpoint(plugin_url)
+        RefreshScheduler().record(plugin_url, changed)
+        if plugin is None:
+            return {
+                "status": "skipped",
+                "message": "Plugin page not modified",
+                "url": plugin_url
+            }
         download_plugin_files.s(plugin.id).apply_async()
         return {
             "status": "success",
-            "message": f"Downloaded {plugin.name}",
+            "message": f"Downloaded {plugin.name}" if changed else f"{plugin.name} is up to date",
             "plugin": plugin.name,
+            "changed": changed,
             "url": plugin_url
         }
+    except CircuitOpenError as e:
+        deferred = True
+        raise defer(self, e)
+    except PluginPageError as e:
+        logger.warning("Skipping %s: %s", plugin_url, e)
+        RefreshScheduler().record(plugin_url, False)
+        self.update_state(state='FAILURE', meta={'error': str(e)})
+        raise Ignore()
     except Exception as e:
+        # Back off failing threads as well, they are retried on their next due time
+        RefreshScheduler().record(plugin_url, False)
         self.update_state(state='FAILURE', meta={'error': repr(e)})
         raise Ignore()
+    finally:
+        if not deferred:
+            get_scrape_lock(plugin_url).release()
 
 
 @shared_task(bind=True, name='plugins.tasks.get_plugins')
-def get_plugins(self):
+def get_plugins(self, full=False):
+    # Incremental by default: only new/changed listing rows plus a small re-verification slice.
+    # full=True re-scrapes every row and bypasses the page cache (backfills).
     try:
-        plugin_downloader = SourceModPluginDownloader()
-        plugins = plugin_downloader.find_plugins()
-        tasks = [get_plugin.s(plugin['url']) for plugin in plugins]
-        job = group(tasks)
-        job.apply_async()
+        crawler = IncrementalCrawler()
+        # Enqueue while the listing is still streaming in instead of building one big group. Urls
+        # whose previous get_plugin is still queued or running are dropped.
+        duplicates = 0
+        for plugin_url in crawler.iter_plan(full=full):
+            if not get_scrape_lock(plugin_url).acquire():
+                duplicates += 1
+                continue
+            get_plugin.s(plugin_url, force=full).apply_async()
+        stats = crawler.stats
+        return {
+            "status": "success",
+            "message": f"Scheduled {stats['processed'] - duplicates} plugins for download, skipped {stats['skipped']}, "
+                       f"{duplicates} already in progress",
+            "num_plugins": stats['processed'] - duplicates,
+            "duplicates": duplicates,
+            **stats,
+        }
+    except Exception as e:
+        self.update_state(state='FAILURE', meta={'error': str(e)})
+        raise Ignore()
+
+
+@shared_task(bind=True, name='plugins.tasks.refresh_due_plugins')
+def refresh_due_plugins(self, limit=None):
+    # Re-checks only the threads whose adaptive refresh time has come, see RefreshScheduler
+    try:
+        limit = limit or settings.PLUGINS_REFRESH_BATCH
+        scheduled = 0
+        duplicates = 0
+        for plugin_url in RefreshScheduler.iter_due(limit):
+            if not get_scrape_lock(plugin_url).acquire():
+                duplicates += 1
+                continue
+            get_plugin.s(plugin_url).apply_async()
+            scheduled += 1
         return {
             "status": "success",
-            "message": f"Scheduled {len(plugins)} plugins for download",
-            "num_plugins": len(plugins),
+            "message": f"Scheduled {scheduled} due plugins, {duplicates} already in progress",
+            "num_plugins": scheduled,
+            "duplicates": duplicates,
         }
     except Exception as e:
         self.update_state(state='FAILURE', meta={'error': str(e)})
@@ -51,13 +128,28 @@ def archive_plugin_files(self, *args, **kwargs):
         return {"status": "error", "message": "No tag_id provided"}
     try:
         tag = Tag.objects.get(id=tag_id)
+        if settings.PLUGINS_STREAM_ARCHIVES:
+            # PluginDownloadView zips the file tree on the fly
+            tag.set_stage(Tag.Stage.ARCHIVED)
+            return {
+                "status": "skipped",
+                "message": f"Archives are streamed, nothing to build for {tag.plugin.name} {tag.version}",
+                "tag_id": tag.id,
+            }
+        if tag.has_reached(Tag.Stage.ARCHIVED) and tag.archive_file:
+            return {
+                "status": "skipped",
+                "message": f"{tag.plugin.name} {tag.version} is already archived",
+                "tag_id": tag.id,
+            }
         plugin_downloader = SourceModPluginDownloader()
-        archive_file = plugin_downloader.archive_files(tag.plugin.id, tag.plugin.name, tag.version)
-        archive_file_rel = Path(archive_file).relative_to(Path(settings.MEDIA_ROOT) / "downloads/plugins")
-        if not tag.archive_file:
-            with default_storage.open(archive_file, 'rb') as archive:
-                tag.archive_file.save(archive_file_rel, archive)
-            Path.unlink(Path(archive_file))
+        # Written in place under the same name rebuild_archives uses, not through FileField storage
+        archive_path, archive_hash = plugin_downloader.archive_files(tag.plugin.id, tag.plugin.name, tag.version)
+        stale_file = tag.assign_archive(archive_path, archive_hash)
+        tag.save(update_fields=['archive_file', 'archive_hash'])
+        if stale_file is not None:
+            stale_file.unlink(missing_ok=True)
+        tag.set_stage(Tag.Stage.ARCHIVED)
         return {
             "status": "success",
             "message": f"Archived {tag.plugin.name} {tag.version}",
@@ -69,6 +161,10 @@ def archive_plugin_files(self, *args, **kwargs):
     except Exception as e:
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise Ignore()
+    finally:
+        # Last stage of the download pipeline, a run started outside of it does not own the lock
+        if kwargs.get("pipeline"):
+            get_pipeline_lock(tag_id).release()
 
 
 @shared_task(bind=True)
@@ -79,56 +175,155 @@ def extract_downloads_files(self, *args, **kwargs):
         plugin_downloader = SourceModPluginDownloader()
         plugin_files = tag.files.filter(file_type=PluginFile.FileType.ZIP)
         plugin_downloader.extract_downloaded_files(tag, plugin_files)
+        tag.set_stage(Tag.Stage.EXTRACTED)
         return {
             "status": "success",
             "message": "Extracted downloaded files",
         }
 
     except Exception as e:
+        if kwargs.get("pipeline"):
+            get_pipeline_lock(kwargs.get("tag_id")).release()
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise Ignore()
 
 
-@shared_task(bind=True, name='plugins.tasks.download_plugin_file')
-def download_plugin_file(self, tag_id, plugin_file_id):
+def get_post_download_tasks(tag):
+    # Continues after the last stage the tag reached. The stages release the pipeline lock taken by
+    # download_plugin_files.
+    post_download_tasks = []
+    if not tag.has_reached(Tag.Stage.EXTRACTED) \
+            and PluginFile.objects.filter(tag_id=tag.id, file_type=PluginFile.FileType.ZIP).exists():
+        post_download_tasks.append(extract_downloads_files.si(tag_id=tag.id, pipeline=True))
+    post_download_tasks.append(archive_plugin_files.si(tag_id=tag.id, pipeline=True))
+    return chain(*post_download_tasks)
+
+
+def split_downloads(plugin_files):
+    # Returns (batched, single) file ids. Sizes are only known after a download, so the split goes by
+    # type: .sp/.smx files go to one batched task, ZIP attachments (up to hundreds of MB of maps and
+    # models) keep a task of their own.
+    batched = []
+    single = []
+    for plugin_file in plugin_files:
+        if settings.PLUGINS_DOWNLOAD_BATCH and plugin_file.file_type != PluginFile.FileType.ZIP:
+            batched.append(plugin_file.id)
+        else:
+            single.append(plugin_file.id)
+    return batched, single
+
+
+def complete_download(tag_id, completion_key, failed=False):
+    if completion_key is None:
+        return
+    result = CompletionCounter(completion_key).done(failed=failed)
+    if result == CompletionCounter.SUCCEEDED:
+        tag = Tag.objects.get(id=tag_id)
+        tag.set_stage(Tag.Stage.FILES_DOWNLOADED)
+        get_post_download_tasks(tag).apply_async()
+    elif result == CompletionCounter.FAILED:
+        # Only once every member has finished, a new run must not overlap the remaining downloads
+        logger.warning("Download of tag %s failed, skipping extract/archive", tag_id)
+        get_pipeline_lock(tag_id).release()
+
+
+@shared_task(bind=True, name='plugins.tasks.download_plugin_file', ignore_result=True)
+def download_plugin_file(self, tag_id, plugin_file_id, completion_key=None):
     try:
         tag = Tag.objects.get(id=tag_id)
         plugin_file = PluginFile.objects.get(id=plugin_file_id)
         plugin_downloader = SourceModPluginDownloader()
 
         plugin_downloader.download_file(tag, plugin_file)
-        return {
-            "status": "success",
-            "message": f"Downloaded {plugin_file.file_name} for {tag.plugin.name} {tag.version}",
-            "tag_id": tag.id,
-            "plugin_file_id": plugin_file.id
-        }
+    except CircuitOpenError as e:
+        raise defer(self, e)
+    except Exception as e:
+        complete_download(tag_id, completion_key, failed=True)
+        self.update_state(state='FAILURE', meta={'error': str(e)})
+        raise Ignore()
+    complete_download(tag_id, completion_key)
+    return {
+        "status": "success",
+        "message": f"Downloaded {plugin_file.file_name} for {tag.plugin.name} {tag.version}",
+        "tag_id": tag.id,
+        "plugin_file_id": plugin_file.id
+    }
+
+
+@shared_task(bind=True, name='plugins.tasks.download_tag_files', ignore_result=True)
+def download_tag_files(self, tag_id, plugin_file_ids, completion_key=None):
+    try:
+        tag = Tag.objects.select_related('plugin').get(id=tag_id)
+        plugin_files = list(PluginFile.objects.filter(id__in=plugin_file_ids))
+        plugin_downloader = SourceModPluginDownloader()
+        errors = plugin_downloader.download_files(tag, plugin_files)
+        if errors:
+            raise Exception(f"Failed to download {len(errors)} of {len(plugin_files)} files: {errors}")
+    except CircuitOpenError as e:
+        # Files that made it are recorded, the retry only fetches the rest
+        raise defer(self, e)
     except Exception as e:
+        complete_download(tag_id, completion_key, failed=True)
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise Ignore()
+    complete_download(tag_id, completion_key)
+    return {
+        "status": "success",
+        "message": f"Downloaded {len(plugin_files)} files for {tag.plugin.name} {tag.version}",
+        "tag_id": tag.id,
+    }
 
 
 @shared_task(bind=True, name='plugins.tasks.download_plugin_files')
 def download_plugin_files(self, plugin_id):
+    pipeline_lock = None
     try:
         plugin = Plugin.objects.get(id=plugin_id)
         version = plugin.tags.filter(is_latest=True).first().version
         plugin_files, tag = plugin.get_files_to_download(version)
-        download_tasks = [download_plugin_file.s(tag.id, plugin_file.id) for plugin_file in plugin_files]
-        # job = chord(download_tasks)(archive_plugin_files.s(tag_id=tag.id))
-        post_download_tasks = []
-        if any(plugin_file.file_type == PluginFile.FileType.ZIP for plugin_file in plugin_files):
-            post_download_tasks.append(extract_downloads_files.s(tag_id=tag.id))
-        post_download_tasks.append(archive_plugin_files.s(tag_id=tag.id))
-
-        job = chord(download_tasks)(chain(*post_download_tasks))
+        # One download/extract/archive run per tag at a time, released by the last stage
+        pipeline_lock = get_pipeline_lock(tag.id)
+        if not pipeline_lock.acquire():
+            return {
+                "status": "skipped",
+                "message": f"Download of {plugin.name} {version} is already in progress",
+                "plugin": plugin.name,
+                "tag_id": tag.id,
+                "duplicate": True,
+            }
+        if tag.has_reached(Tag.Stage.ARCHIVED) and (tag.archive_file or settings.PLUGINS_STREAM_ARCHIVES):
+            pipeline_lock.release()
+            return {
+                "status": "skipped",
+                "message": f"{plugin.name} {version} is already archived",
+                "plugin": plugin.name,
+                "tag_id": tag.id,
+            }
+        # Files downloaded by an earlier, partially failed run are not fetched again
+        plugin_files = [plugin_file for plugin_file in plugin_files if not plugin_file.is_downloaded()] \
+            if not tag.has_reached(Tag.Stage.FILES_DOWNLOADED) else []
+        batched, single = split_downloads(plugin_files)
+        if not plugin_files:
+            if not tag.has_reached(Tag.Stage.FILES_DOWNLOADED):
+                tag.set_stage(Tag.Stage.FILES_DOWNLOADED)
+            get_post_download_tasks(tag).apply_async()
+        else:
+            # The last finished download starts extract/archive, see CompletionCounter
+            completion_key = f"downloads:{tag.id}:{uuid.uuid4().hex}"
+            CompletionCounter(completion_key).start(len(single) + (1 if batched else 0))
+            if batched:
+                download_tag_files.s(tag.id, batched, completion_key=completion_key).apply_async()
+            for plugin_file_id in single:
+                download_plugin_file.s(tag.id, plugin_file_id, completion_key=completion_key).apply_async()
         return {
             "status": "success",
-            "message": f"Scheduled {len(plugin_files)} files for download",
+            "message": f"Scheduled {len(plugin_files)} files for download, resuming from {tag.stage}",
             "plugin": plugin.name,
             "tag_id": tag.id,
             "version": version
         }
     except Exception as e:
+        if pipeline_lock is not None:
+            pipeline_lock.release()
         self.update_state(state='FAILURE', meta={'error': str(e)})
         raise Ignore()
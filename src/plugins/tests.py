@@ -1,3 +1,541 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from bs4 import BeautifulSoup
+from django.core.management import call_command
+from django.http import FileResponse
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from plugins.extractors import ListingParser, ThreadPageExtractor
+from plugins.models import Category, ListingEntry, Plugin, PluginFile, SupportedGame, Tag
+from plugins.services import IncrementalCrawler, PluginIngestor, RefreshScheduler, SourceModPluginDownloader
+from plugins.tasks import (archive_plugin_files, download_plugin_files, get_pipeline_lock, get_post_download_tasks,
+                           split_downloads)
+from tf2modportal.http import close_http_client
+from tf2modportal.replay import FixtureStore
+
+LISTING = """<html><body><div class="well">search</div><div class="well"><table>
+<tr><th>Mod</th><th>Title</th><th>Category</th><th>Author</th><th>Last Updated</th></tr>
+<tr><td><img src="tf.gif"></td><td><a href="https://forums.alliedmods.net/showthread.php?t=1"> First &amp; Best </a></td>
+<td>Fun Stuff</td><td>alice</td><td>2024-01-01</td></tr>
+<tr><td><img src="tf.gif"></td><td><a href="https://forums.alliedmods.net/showthread.php?t=2">Second<b>Bold</b></a></td>
+<td>Admin</td><td>bob</td><td>2024-02-03</td></tr>
+</table></div><div class="well"><table><tr><td>x</td><td><a href="ignored">Ignored</a></td></tr></table></div>
+</body></html>"""
+
+THREAD_PAGE = """<html><body><table id="post7"><tr><td>
+<div id="postmenu_7"><a class="bigusername" href="member.php?u=7">author7</a></div>
+<div style="font-size: 14pt"><a href="showthread.php?t=7">[TF2] Example Plugin</a></div>
+<table><tr><td><div>Plugin Version: </div></td><td><div>1.2.3</div></td></tr>
+<tr><td><div>Plugin Category: </div></td><td><div>Fun Stuff</div></td></tr>
+<tr><td><div>Plugin Game: </div></td><td><div>Team Fortress 2</div></td></tr></table>
+<div id="post_message_7">{message}</div>
+<fieldset class="fieldset"><legend>Attached Files</legend>
+<a href="attachment.php?attachmentid=71">Get Source</a> (example.sp - 10 views - 2 KB)<br/>
+<a href="http://www.sourcemod.net/vbcompiler.php?file_id=71">Get Plugin</a><br/>
+<a href="attachment.php?attachmentid=72">example.zip</a> (20 KB)
+</fieldset></td></tr></table></body></html>"""
+
+
+def plugin_info(name="Example", version="1.0", description="Description"):
+    return {
+        "name": name,
+        "description": description,
+        "author": {"name": "author", "profile_url": None},
+        "version": version,
+        "category": "Fun Stuff",
+        "game": "Team Fortress 2",
+        "url": f"https://forums.alliedmods.net/showthread.php?t={name}",
+        "download_links": [{"source": {"file_name": "example.sp", "url": "https://example.com/example.sp"}}],
+    }
+
+
+class PluginIngestorTests(TestCase):
+    def test_insert_then_unchanged(self):
+        [(plugin, tag, created, changed)] = PluginIngestor().ingest([plugin_info()])
+        self.assertTrue(created)
+        self.assertTrue(changed)
+        self.assertEqual(tag.files.count(), 1)
+
+        [(same_plugin, same_tag, created, changed)] = PluginIngestor().ingest([plugin_info()])
+        self.assertEqual((same_plugin.id, same_tag.id), (plugin.id, tag.id))
+        self.assertFalse(created)
+        self.assertFalse(changed)
+        self.assertEqual(Plugin.objects.count(), 1)
+
+    def test_changed_row_is_updated_in_place(self):
+        [(plugin, tag, _, _)] = PluginIngestor().ingest([plugin_info()])
+        [(updated, same_tag, created, changed)] = PluginIngestor().ingest([plugin_info(description="New")])
+        self.assertEqual(updated.id, plugin.id)
+        self.assertEqual(same_tag.id, tag.id)
+        self.assertFalse(created)
+        self.assertTrue(changed)
+        self.assertEqual(Plugin.objects.get().description, "New")
+
+    def test_new_version_becomes_latest(self):
+        [(plugin, old_tag, _, _)] = PluginIngestor().ingest([plugin_info()])
+        [(_, new_tag, created, changed)] = PluginIngestor().ingest([plugin_info(version="2.0")])
+        self.assertTrue(created)
+        self.assertTrue(changed)
+        self.assertEqual(list(Tag.objects.filter(plugin=plugin, is_latest=True)), [new_tag])
+        old_tag.refresh_from_db()
+        self.assertFalse(old_tag.is_latest)
+
+    def test_batch_skips_entries_without_name(self):
+        results = PluginIngestor().ingest([plugin_info("First"), plugin_info(None), plugin_info("Second")])
+        self.assertEqual([plugin.original_name for plugin, _, _, _ in results], ["First", "Second"])
+        self.assertEqual(PluginIngestor().ingest([plugin_info(None)]), [])
+
+    def test_new_plugins_skip_the_tag_lookups(self):
+        PluginIngestor().ingest([plugin_info("First")])
+        # Savepoint pair, plugin lookup, categories, games, short ids/slugs, upsert, re-read, games link,
+        # tags and files
+        with self.assertNumQueries(11):
+            results = PluginIngestor().ingest([plugin_info("Second"), plugin_info("Third")])
+        self.assertTrue(all(created for _, _, created, _ in results))
+        self.assertEqual(Tag.objects.filter(is_latest=True).count(), 3)
+        self.assertEqual(PluginFile.objects.count(), 3)
+
+    def test_deduplicated_slug_survives_a_save(self):
+        [(first, _, _, _), (second, _, _, _)] = PluginIngestor().ingest([plugin_info("Example"),
+                                                                         plugin_info("[TF2] Example")])
+        self.assertEqual(first.slug, "example")
+        self.assertEqual(second.slug, f"example-{second.short_id}")
+        second = Plugin.objects.get(pk=second.pk)
+        second.save()
+        self.assertEqual(Plugin.objects.get(pk=second.pk).slug, f"example-{second.short_id}")
+
+        third = Plugin.objects.create(original_name="Example 2.0", author="other", version="1.0")
+        self.assertEqual(third.slug, f"example-{third.short_id}")
+
+    def test_categories_and_games_are_reused(self):
+        category = Category.objects.create(name="Fun stuff")
+        game = SupportedGame.objects.create(name="Team Fortress 2", app_id=PluginIngestor.game_app_id,
+                                            icon="https://example.com/tf.gif")
+        PluginIngestor().ingest([plugin_info("First")])
+        PluginIngestor().ingest([plugin_info("Second")])
+        self.assertEqual(Category.objects.get(), category)
+        self.assertEqual(SupportedGame.objects.get(), game)
+        self.assertEqual(set(Plugin.objects.values_list("category", flat=True)), {category.pk})
+        self.assertEqual(list(game.plugins.order_by("original_name").values_list("original_name", flat=True)),
+                         ["First", "Second"])
+
+
+class ListingParserTests(TestCase):
+    @staticmethod
+    def legacy_rows(content):
+        # The BeautifulSoup parsing find_plugins used before the streaming parser
+        soup = BeautifulSoup(content, 'html.parser')
+        rows = soup.find_all('div', class_='well')[1].find('table').find_all('tr')[1:]
+        return [{'name': row.find_all('td')[1].find('a').text.strip(),
+                 'url': row.find_all('td')[1].find('a')['href'].strip()} for row in rows]
+
+    def test_chunked_feed_matches_legacy_parsing(self):
+        parser = ListingParser()
+        rows = []
+        for start in range(0, len(LISTING), 7):
+            parser.feed(LISTING[start:start + 7])
+            rows.extend(parser.pop_rows())
+        parser.close()
+        rows.extend(parser.pop_rows())
+        self.assertEqual([{'name': row['name'], 'url': row['url']} for row in rows], self.legacy_rows(LISTING))
+        self.assertEqual([row['last_updated'] for row in rows], ["2024-01-01", "2024-02-03"])
+
+    def test_find_plugins_matches_legacy_parsing(self):
+        fixtures_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(fixtures_dir.cleanup)
+        FixtureStore(fixtures_dir.name).save("GET", SourceModPluginDownloader.get_listing_url(), 200,
+                                             {"Content-Type": "text/html; charset=utf-8"}, LISTING.encode())
+        close_http_client()
+        self.addCleanup(close_http_client)
+        with override_settings(HTTP_REPLAY_DIR=fixtures_dir.name, HTTP_RECORD_DIR=None, HTTP_RATE_LIMITS={},
+                               HTTP_CIRCUIT_ERROR_RATE=0):
+            rows = SourceModPluginDownloader().find_plugins(force=True)
+        self.assertEqual([{'name': row['name'], 'url': row['url']} for row in rows], self.legacy_rows(LISTING))
+
+
+class IncrementalCrawlerTests(TestCase):
+    first_url = "https://forums.alliedmods.net/showthread.php?t=1"
+    second_url = "https://forums.alliedmods.net/showthread.php?t=2"
+
+    def setUp(self):
+        fixtures_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(fixtures_dir.cleanup)
+        self.store = FixtureStore(fixtures_dir.name)
+        settings_override = override_settings(HTTP_REPLAY_DIR=fixtures_dir.name, HTTP_RECORD_DIR=None,
+                                              HTTP_RATE_LIMITS={}, HTTP_CIRCUIT_ERROR_RATE=0,
+                                              PLUGINS_LISTING_MODS=[5], PLUGINS_CRAWL_REVERIFY_BATCH=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        close_http_client()
+        self.addCleanup(close_http_client)
+
+    def plan(self, listing):
+        self.store.save("GET", SourceModPluginDownloader.get_listing_url(), 200,
+                        {"Content-Type": "text/html; charset=utf-8"}, listing.encode())
+        crawler = IncrementalCrawler()
+        with mock.patch.object(ListingEntry.objects, "bulk_update", wraps=ListingEntry.objects.bulk_update) as update:
+            urls = list(crawler.iter_plan())
+        self.updated = [entry.url for call in update.call_args_list for entry in call.args[0]]
+        return urls, crawler.stats
+
+    def test_new_rows_are_scheduled(self):
+        urls, stats = self.plan(LISTING)
+        self.assertEqual(urls, [self.first_url, self.second_url])
+        self.assertEqual((stats["total"], stats["pending"], stats["skipped"]), (2, 2, 0))
+        self.assertEqual(ListingEntry.objects.count(), 2)
+
+    def test_checkpointed_rows_are_skipped(self):
+        self.plan(LISTING)
+        IncrementalCrawler.checkpoint(self.first_url)
+        urls, stats = self.plan(LISTING)
+        self.assertEqual(urls, [self.second_url])
+        self.assertEqual((stats["total"], stats["pending"], stats["skipped"]), (2, 1, 1))
+        # Rows that did not change are not rewritten
+        self.assertEqual(self.updated, [])
+
+    def test_changed_row_is_scheduled_again(self):
+        self.plan(LISTING)
+        IncrementalCrawler.checkpoint(self.first_url)
+        IncrementalCrawler.checkpoint(self.second_url)
+        urls, _ = self.plan(LISTING.replace("2024-02-03", "2024-03-01"))
+        self.assertEqual(urls, [self.second_url])
+        self.assertEqual(self.updated, [self.second_url])
+        entry = ListingEntry.objects.get(url=self.second_url)
+        self.assertEqual(entry.last_updated, "2024-03-01")
+        self.assertIsNotNone(entry.next_check_at)
+
+
+
+@override_settings(PLUGINS_REFRESH_MIN_INTERVAL=60, PLUGINS_REFRESH_MAX_INTERVAL=300, PLUGINS_REFRESH_BACKOFF=2)
+class RefreshSchedulerTests(TestCase):
+    now = timezone.make_aware(datetime(2024, 5, 10, 12))
+
+    def add_entry(self, number, next_check_at=None):
+        return ListingEntry.objects.create(url=f"https://forums.alliedmods.net/showthread.php?t={number}",
+                                           name=f"Plugin {number}", row_hash="hash", next_check_at=next_check_at)
+
+    def test_interval_backs_off_until_a_change(self):
+        scheduler = RefreshScheduler()
+        entry = self.add_entry(1)
+        intervals = [scheduler.record(entry.url, changed, now=self.now).check_interval
+                     for changed in [False, False, False, False, True]]
+        self.assertEqual(intervals, [60, 120, 240, 300, 60])
+        entry.refresh_from_db()
+        self.assertEqual(entry.changed_at, self.now)
+        # Jitter keeps the next check within 10% of the interval
+        self.assertLessEqual(abs((entry.next_check_at - self.now).total_seconds() - 60), 6)
+
+    def test_unknown_thread_is_ignored(self):
+        self.assertIsNone(RefreshScheduler().record("https://forums.alliedmods.net/showthread.php?t=9", True))
+
+    def test_never_checked_then_most_overdue_first(self):
+        self.add_entry(1, self.now - timedelta(minutes=5))
+        self.add_entry(2, self.now - timedelta(hours=1))
+        self.add_entry(3)
+        self.add_entry(4, self.now + timedelta(minutes=5))
+        due = list(RefreshScheduler.iter_due(10, now=self.now))
+        self.assertEqual([url.rsplit("=", 1)[1] for url in due], ["3", "2", "1"])
+        self.assertEqual(len(list(RefreshScheduler.iter_due(2, now=self.now))), 2)
+
+class ThreadPageExtractorTests(TestCase):
+    def assertMatchesLegacy(self, content):
+        downloader = SourceModPluginDownloader()
+        downloader.soup = BeautifulSoup(content, 'html.parser')
+        expected = downloader.get_plugin_info("https://forums.alliedmods.net/showthread.php?t=7")
+        for parser in ["lxml", "html.parser"]:
+            with self.subTest(parser=parser):
+                extracted = ThreadPageExtractor(downloader.get_blank_url(), parser=parser).extract(
+                    content, "https://forums.alliedmods.net/showthread.php?t=7")
+                self.assertEqual(extracted, expected)
+        return extracted
+
+    def test_well_formed_post(self):
+        extracted = self.assertMatchesLegacy(THREAD_PAGE.format(message="Plugin <b>7</b><code>sm_example 1</code>"))
+        self.assertEqual(extracted["name"], "[TF2] Example Plugin")
+        self.assertEqual(extracted["version"], "1.2.3")
+        self.assertEqual(len(extracted["download_links"]), 3)
+
+    def test_malformed_post(self):
+        self.assertMatchesLegacy(THREAD_PAGE.format(
+            message="Intro <p>unclosed <code>sm_a 1<br>sm_b 2</code> <b>bold <i>x</b></i> tail"))
+
+    def test_post_closing_outer_elements(self):
+        # A stray </td> ends the post early in the html.parser tree of the page
+        self.assertMatchesLegacy(THREAD_PAGE.format(message="<div>Intro <br/><b>bold</td> tail"))
+
+    def test_bytes_are_decoded_like_beautifulsoup(self):
+        page = THREAD_PAGE.format(message="Plugin für <b>TF2</b>").replace(
+            "<html>", '<html><head><meta charset="windows-1252"></head>')
+        extracted = self.assertMatchesLegacy(page.encode("windows-1252"))
+        self.assertIn("für", extracted["description"])
+
+
+class SplitDownloadsTests(TestCase):
+    def setUp(self):
+        plugin = Plugin.objects.create(name="Example", original_name="example", author="author",
+                                       url="https://forums.alliedmods.net/showthread.php?t=1")
+        tag = Tag.objects.create(plugin=plugin, version="1.0")
+        self.source = PluginFile.objects.create(tag=tag, file_type=PluginFile.FileType.SP)
+        self.compiled = PluginFile.objects.create(tag=tag, file_type=PluginFile.FileType.SMX)
+        self.archive = PluginFile.objects.create(tag=tag, file_type=PluginFile.FileType.ZIP)
+
+    def test_zip_attachments_get_their_own_task(self):
+        batched, single = split_downloads([self.source, self.compiled, self.archive])
+        self.assertEqual(batched, [self.source.id, self.compiled.id])
+        self.assertEqual(single, [self.archive.id])
+
+    @override_settings(PLUGINS_DOWNLOAD_BATCH=False)
+    def test_every_file_is_single_without_batching(self):
+        batched, single = split_downloads([self.source, self.compiled, self.archive])
+        self.assertEqual(batched, [])
+        self.assertEqual(single, [self.source.id, self.compiled.id, self.archive.id])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   PLUGINS_STREAM_ARCHIVES=True)
+class PipelineLockTests(TestCase):
+    def setUp(self):
+        plugin = Plugin.objects.create(name="Example", original_name="example", author="author",
+                                       url="https://forums.alliedmods.net/showthread.php?t=1")
+        self.tag = Tag.objects.create(plugin=plugin, version="1.0")
+        self.lock = get_pipeline_lock(self.tag.id)
+        self.assertTrue(self.lock.acquire())
+        self.addCleanup(self.lock.release)
+
+    def test_archive_outside_the_pipeline_keeps_the_lock(self):
+        archive_plugin_files.apply(kwargs={"tag_id": self.tag.id})
+        self.assertTrue(self.lock.is_locked())
+
+    def test_last_pipeline_stage_releases_the_lock(self):
+        [stage] = get_post_download_tasks(self.tag).tasks
+        stage.apply()
+        self.assertFalse(self.lock.is_locked())
+
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   PLUGINS_STREAM_ARCHIVES=False)
+class StageResumeTests(TestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.plugin = Plugin.objects.create(name="Example", original_name="example", author="author",
+                                            version="1.0", url="https://forums.alliedmods.net/showthread.php?t=1")
+        self.tag = Tag.objects.create(plugin=self.plugin, version="1.0", is_latest=True)
+        self.downloaded = PluginFile.objects.create(tag=self.tag, file_type=PluginFile.FileType.SP,
+                                                    download_url="https://example.com/example.sp", sha256="0" * 64,
+                                                    file="downloads/example.sp")
+        (self.media_root / "downloads").mkdir()
+        (self.media_root / "downloads/example.sp").write_text("// example")
+        self.pending = PluginFile.objects.create(tag=self.tag, file_type=PluginFile.FileType.SMX,
+                                                 download_url="https://example.com/example.smx")
+        self.archive = PluginFile.objects.create(tag=self.tag, file_type=PluginFile.FileType.ZIP,
+                                                 download_url="https://example.com/example.zip")
+        self.addCleanup(get_pipeline_lock(self.tag.id).release)
+
+    def stage_names(self):
+        return [task.name for task in get_post_download_tasks(self.tag).tasks]
+
+    def test_post_download_stages_continue_after_the_last_reached(self):
+        self.tag.set_stage(Tag.Stage.FILES_DOWNLOADED)
+        self.assertEqual(self.stage_names(), ["plugins.tasks.extract_downloads_files",
+                                              "plugins.tasks.archive_plugin_files"])
+        self.tag.set_stage(Tag.Stage.EXTRACTED)
+        self.assertEqual(self.stage_names(), ["plugins.tasks.archive_plugin_files"])
+
+    @mock.patch("plugins.tasks.download_plugin_file")
+    @mock.patch("plugins.tasks.download_tag_files")
+    def test_only_missing_files_are_downloaded_again(self, download_tag_files, download_plugin_file):
+        download_plugin_files.apply(args=[self.plugin.id])
+        download_tag_files.s.assert_called_once_with(self.tag.id, [self.pending.id], completion_key=mock.ANY)
+        download_plugin_file.s.assert_called_once_with(self.tag.id, self.archive.id, completion_key=mock.ANY)
+
+    @mock.patch("plugins.tasks.get_post_download_tasks")
+    @mock.patch("plugins.tasks.download_tag_files")
+    def test_downloaded_tag_goes_straight_to_extract(self, download_tag_files, get_post_download_tasks):
+        self.tag.set_stage(Tag.Stage.FILES_DOWNLOADED)
+        download_plugin_files.apply(args=[self.plugin.id])
+        download_tag_files.s.assert_not_called()
+        get_post_download_tasks.return_value.apply_async.assert_called_once_with()
+
+    @mock.patch("plugins.tasks.get_post_download_tasks")
+    def test_archived_tag_is_skipped(self, get_post_download_tasks):
+        self.tag.set_stage(Tag.Stage.ARCHIVED)
+        Tag.objects.filter(pk=self.tag.pk).update(archive_file="downloads/example.zip")
+        result = download_plugin_files.apply(args=[self.plugin.id]).result
+        self.assertEqual(result["status"], "skipped")
+        get_post_download_tasks.assert_not_called()
+        self.assertFalse(get_pipeline_lock(self.tag.id).is_locked())
+
+class FetchFileTests(TestCase):
+    url = "https://forums.alliedmods.net/attachment.php?attachmentid=1"
+
+    def setUp(self):
+        self.downloader = SourceModPluginDownloader()
+        self.downloader.client = mock.Mock()
+
+    @staticmethod
+    def http_error(status_code):
+        response = requests.Response()
+        response.status_code = status_code
+        return requests.HTTPError(response=response)
+
+    @override_settings(PLUGINS_DOWNLOAD_ATTEMPTS=3)
+    @mock.patch("plugins.services.time.sleep")
+    def test_transient_errors_are_retried(self, sleep):
+        self.downloader.client.download.side_effect = [requests.ConnectionError(), self.http_error(503), "download"]
+        self.assertEqual(self.downloader.fetch_file(self.url, "example.sp"), "download")
+        self.assertEqual(self.downloader.client.download.call_count, 3)
+
+    @override_settings(PLUGINS_DOWNLOAD_ATTEMPTS=3)
+    @mock.patch("plugins.services.time.sleep")
+    def test_missing_attachment_is_not_retried(self, sleep):
+        for status_code in [404, 410]:
+            self.downloader.client.download.reset_mock()
+            self.downloader.client.download.side_effect = self.http_error(status_code)
+            with self.assertRaises(requests.HTTPError):
+                self.downloader.fetch_file(self.url, "example.sp")
+            self.assertEqual(self.downloader.client.download.call_count, 1)
+        sleep.assert_not_called()
+
+
+class ExtractedFilesTests(TestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        plugin = Plugin.objects.create(name="Example", original_name="example", author="author",
+                                       url="https://forums.alliedmods.net/showthread.php?t=1")
+        self.tag = Tag.objects.create(plugin=plugin, version="1.0")
+        self.files_dir = self.media_root / "downloads/plugins" / plugin.id / "1.0" / "files"
+        for name, content in [("plugins/first.smx", b"first"), ("plugins/second.smx", b"second"),
+                              ("scripting/first.sp", b"// first"), ("scripting/include/shared.inc", b"// shared"),
+                              ("translations/first.phrases.txt", b"phrases")]:
+            file_path = self.files_dir / "addons/sourcemod" / name
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_bytes(content)
+
+    def test_files_are_recorded_once(self):
+        downloader = SourceModPluginDownloader()
+        # Known files, savepoint pair, blob lookup, insert and re-read, file insert
+        with self.assertNumQueries(7):
+            downloader.add_extracted_files_to_db(self.tag)
+        files = {(plugin_file.file_type, plugin_file.file.name) for plugin_file in self.tag.files.all()}
+        prefix = f"downloads/plugins/{self.tag.plugin.id}/1.0/files/addons/sourcemod"
+        self.assertEqual(files, {(PluginFile.FileType.SMX, f"{prefix}/plugins/first.smx"),
+                                 (PluginFile.FileType.SMX, f"{prefix}/plugins/second.smx"),
+                                 (PluginFile.FileType.SP, f"{prefix}/scripting/first.sp")})
+        for plugin_file in self.tag.files.all():
+            self.assertTrue(plugin_file.is_downloaded())
+            self.assertEqual(plugin_file.blob.sha256, plugin_file.sha256)
+
+        downloader.add_extracted_files_to_db(self.tag)
+        self.assertEqual(self.tag.files.count(), 3)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   PLUGINS_STREAM_ARCHIVES=True, PLUGINS_ARCHIVE_CACHE_THRESHOLD=2)
+class PluginDownloadViewTests(TestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        plugin = Plugin.objects.create(name="Example", original_name="example", author="author",
+                                       url="https://forums.alliedmods.net/showthread.php?t=1")
+        self.tag = Tag.objects.create(plugin=plugin, version="1.0")
+        self.files_dir = self.media_root / "downloads/plugins" / plugin.id / "1.0" / "files"
+        self.members = {"addons/sourcemod/plugins/example.smx": b"compiled",
+                        "addons/sourcemod/scripting/example.sp": b"// source\n" * 100}
+        for name, content in self.members.items():
+            (self.files_dir / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.files_dir / name).write_bytes(content)
+
+    def download(self):
+        response = self.client.get(reverse("plugins:download", args=[self.tag.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="example 1.0.zip"')
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zip_file:
+            self.assertEqual({name: zip_file.read(name) for name in zip_file.namelist()}, self.members)
+        return response
+
+    def cached_archives(self):
+        cache_dir = self.media_root / "cache/archives"
+        return sorted(path.name for path in cache_dir.iterdir()) if cache_dir.exists() else []
+
+    def test_tree_is_streamed_as_a_zip(self):
+        self.assertNotIsInstance(self.download(), FileResponse)
+        self.assertEqual(self.cached_archives(), [])
+
+    def test_hot_tag_is_served_from_the_cache(self):
+        self.download()
+        self.assertNotIsInstance(self.download(), FileResponse)
+        [archive_name] = self.cached_archives()
+        self.assertIsInstance(self.download(), FileResponse)
+
+        # A changed tree gets a new archive
+        (self.files_dir / "addons/sourcemod/plugins/example.smx").write_bytes(b"recompiled")
+        self.members["addons/sourcemod/plugins/example.smx"] = b"recompiled"
+        self.assertNotIsInstance(self.download(), FileResponse)
+        self.assertNotEqual(self.cached_archives(), [archive_name])
+        self.assertEqual(len(self.cached_archives()), 1)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   PLUGINS_STREAM_ARCHIVES=False)
+class RebuildArchivesTests(TestCase):
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # A name with a space, which storage-safe archive names turn into an underscore
+        plugin = Plugin.objects.create(name="Example Plugin", original_name="Example Plugin", author="author",
+                                       url="https://forums.alliedmods.net/showthread.php?t=1")
+        self.tag = Tag.objects.create(plugin=plugin, version="1.0")
+        self.version_dir = self.media_root / "downloads/plugins" / plugin.id / "1.0"
+        source = self.version_dir / "files/addons/sourcemod/scripting/example.sp"
+        source.parent.mkdir(parents=True)
+        source.write_text("// example\n")
+
+    def rebuild(self, *args):
+        output = io.StringIO()
+        call_command("rebuild_archives", "--workers", "1", *args, stdout=output)
+        self.tag.refresh_from_db()
+        return output.getvalue()
+
+    def test_rebuild_keeps_the_archive_stage_name(self):
+        archive_plugin_files.apply(kwargs={"tag_id": self.tag.id})
+        self.tag.refresh_from_db()
+        archive_name = self.tag.archive_file.name
+        self.assertTrue(archive_name.endswith("/1.0/Example_Plugin_1.0.zip"))
+
+        self.assertIn("Rebuilt 0, unchanged 1", self.rebuild())
+        self.assertIn("Rebuilt 1, unchanged 0", self.rebuild("--force"))
+        self.assertEqual(self.tag.archive_file.name, archive_name)
+        self.assertEqual([path.name for path in self.version_dir.glob("*.zip")], ["Example_Plugin_1.0.zip"])
+
+    def test_changed_tree_is_rebuilt(self):
+        self.assertIn("Rebuilt 1", self.rebuild())
+        archive_hash = self.tag.archive_hash
+        (self.version_dir / "files/addons/sourcemod/scripting/example.sp").write_text("// changed\n")
+        self.assertIn("Rebuilt 1", self.rebuild())
+        self.assertNotEqual(self.tag.archive_hash, archive_hash)
+        with zipfile.ZipFile(self.media_root / self.tag.archive_file.name) as zip_file:
+            self.assertEqual(zip_file.read("addons/sourcemod/scripting/example.sp"), b"// changed\n")
@@ -1,11 +1,13 @@
 import os
 
-from django.http import HttpResponse, JsonResponse, FileResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from django.views import View
 from django.views.generic import ListView, DetailView
 
+from core.services import ArchiveCache, FileManager, ZipStream
 from plugins.models import Plugin, Tag
 
 
@@ -36,7 +38,11 @@ class PluginDetailView(DetailView):
 class PluginDownloadView(View):
     def get(self, request, *args, **kwargs):
         pk = self.kwargs['pk']
-        tag = get_object_or_404(Tag, pk=pk)
+        tag = get_object_or_404(Tag.objects.select_related('plugin'), pk=pk)
+        if settings.PLUGINS_STREAM_ARCHIVES:
+            response = self.stream_archive(tag)
+            if response is not None:
+                return response
         archive_file = tag.archive_file
         if archive_file:
             file_name = os.path.basename(archive_file.name)
@@ -44,3 +50,21 @@ class PluginDownloadView(View):
             response['Content-Disposition'] = f'attachment; filename="{file_name}"'
             return response
         return redirect(reverse("plugins:detail", kwargs={"tagged_name": tag.tagged_name}))
+
+    @staticmethod
+    def stream_archive(tag):
+        entries = FileManager().get_archive_entries(tag.plugin.id, tag.version)
+        if not entries:
+            return None
+        file_name = f"{tag.plugin.name} {tag.version}.zip"
+        archive_cache = ArchiveCache()
+        cached_path = archive_cache.get_path(tag.id, entries)
+        cached_archive = archive_cache.open(cached_path)
+        if cached_archive is not None:
+            return FileResponse(cached_archive, as_attachment=True, filename=file_name)
+        chunks = iter(ZipStream(entries))
+        if archive_cache.is_hot(tag.id):
+            chunks = archive_cache.store(chunks, cached_path, tag.id)
+        response = StreamingHttpResponse(chunks, content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+        return response
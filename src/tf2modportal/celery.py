@@ -4,6 +4,7 @@ import os
 
 from celery import Celery
 from django.conf import settings
+from kombu import Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tf2modportal.settings')
@@ -13,9 +14,68 @@ app = Celery('tf2modportal')  # Replace 'your_project' with your project's name.
 # Configure Celery using settings from Django settings.py.
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# One queue per pipeline stage so a slow archive cannot starve page scrapes and CPU-bound work does
+# not share a pool with I/O-bound downloads. Worker layout (see docker-compose.yml):
+#   I/O workers:  -Q crawl,download,celery --pool=threads --prefetch-multiplier=4
+#                 with CELERY_WORKER_CONCURRENCY=20, which also sizes the HTTP connection pool
+#                 (or --pool=gevent where gevent is installed)
+#   CPU workers:  -Q extract,archive --pool=prefork --prefetch-multiplier=1
+# Both kinds can be scaled independently.
+DEFAULT_QUEUE = 'celery'
+QUEUE_TASKS = {
+    'crawl': [
+        'plugins.tasks.get_plugins',
+        'plugins.tasks.get_plugin',
+        'plugins.tasks.refresh_due_plugins',
+        'plugins.tasks.download_plugin_files',
+    ],
+    'download': [
+        'plugins.tasks.download_plugin_file',
+        'plugins.tasks.download_tag_files',
+        'sourcemod.tasks.download_latest_sourcemod_version',
+        'metamod.tasks.download_latest_metamod_version',
+    ],
+    'extract': [
+        'plugins.tasks.extract_downloads_files',
+        'sourcemod.tasks.extract_sourcemod_files',
+        'metamod.tasks.extract_metamod_files',
+    ],
+    'archive': [
+        'plugins.tasks.archive_plugin_files',
+        'builds.tasks.assemble_build',
+        'core.tasks.collect_blobs',
+    ],
+}
+# Per-queue task defaults. acks_late puts a task back on the queue when its worker dies mid-run,
+# every task of these queues is safe to run twice. Time limits are enforced by prefork and gevent
+# pools; on the threads pool downloads are bounded by the HTTP timeouts instead.
+QUEUE_DEFAULTS = {
+    'crawl': {'acks_late': True, 'soft_time_limit': 5 * 60, 'time_limit': 6 * 60},
+    'download': {'acks_late': True, 'soft_time_limit': 30 * 60, 'time_limit': 35 * 60},
+    'extract': {'acks_late': True, 'soft_time_limit': 10 * 60, 'time_limit': 12 * 60},
+    'archive': {'acks_late': True, 'soft_time_limit': 15 * 60, 'time_limit': 20 * 60},
+}
+TASK_ANNOTATIONS = {task: dict(QUEUE_DEFAULTS[queue]) for queue, tasks in QUEUE_TASKS.items() for task in tasks}
+
 app.conf.update(
-    worker_prefetch_multiplier=10
+    worker_prefetch_multiplier=int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', '1')),
+    task_default_queue=DEFAULT_QUEUE,
+    task_queues=[Queue(DEFAULT_QUEUE)] + [Queue(queue) for queue in QUEUE_TASKS],
+    task_routes={task: {'queue': queue} for queue, tasks in QUEUE_TASKS.items() for task in tasks},
+    task_annotations=TASK_ANNOTATIONS,
 )
 
+
+@app.on_after_configure.connect
+def apply_result_policies(sender, **kwargs):
+    # Tasks with the "none" result policy store nothing (see core/results.py). Django settings are read
+    # here and not at import, tf2modportal/__init__.py imports this module while settings load.
+    annotations = {task: dict(options) for task, options in sender.conf.task_annotations.items()}
+    for task, policy in settings.TASK_RESULT_POLICIES.items():
+        if policy == 'none':
+            annotations.setdefault(task, {})['ignore_result'] = True
+    sender.conf.task_annotations = annotations
+
+
 # Load tasks from all registered Django app configs.
-app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
\ No newline at end of file
+app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
@@ -0,0 +1,132 @@
+import logging
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Per-host breaker state in a Redis hash, shared by every worker. Uses the Redis clock like the
+# rate limiter. BEFORE returns the seconds until a request may be made (0 = go ahead): an open
+# circuit rejects everything until its cooldown ends, then lets exactly one probe through
+# (half-open) and rejects the rest until that probe reports back.
+BEFORE_SCRIPT = """
+local probe_timeout = tonumber(ARGV[1])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HGET', KEYS[1], 'state')
+if state == 'open' then
+    local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until'))
+    if now < open_until then
+        return tostring(open_until - now)
+    end
+    redis.call('HSET', KEYS[1], 'state', 'half_open', 'probe_until', now + probe_timeout)
+elseif state == 'half_open' then
+    local probe_until = tonumber(redis.call('HGET', KEYS[1], 'probe_until'))
+    if now < probe_until then
+        return tostring(probe_until - now)
+    end
+    -- The previous probe never reported back, let this request probe instead
+    redis.call('HSET', KEYS[1], 'probe_until', now + probe_timeout)
+end
+return '0'
+"""
+
+# AFTER records one outcome (ARGV[1] = 1 for success). While closed, requests and failures are counted
+# in fixed windows and the circuit opens once the error rate is reached. A probe closes the circuit
+# on success and re-opens it on failure. Returns the resulting state.
+AFTER_SCRIPT = """
+local success = ARGV[1] == '1'
+local error_rate = tonumber(ARGV[2])
+local min_requests = tonumber(ARGV[3])
+local window = tonumber(ARGV[4])
+local cooldown = tonumber(ARGV[5])
+local ttl = tonumber(ARGV[6])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+if state == 'half_open' then
+    if success then
+        redis.call('DEL', KEYS[1])
+        return 'closed'
+    end
+    redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', now + cooldown)
+    redis.call('EXPIRE', KEYS[1], ttl)
+    return 'open'
+elseif state == 'open' then
+    return 'open'
+end
+local window_start = tonumber(redis.call('HGET', KEYS[1], 'window_start'))
+if not window_start or now - window_start >= window then
+    redis.call('HSET', KEYS[1], 'window_start', now, 'requests', 0, 'failures', 0)
+end
+local requests = redis.call('HINCRBY', KEYS[1], 'requests', 1)
+local failures = tonumber(redis.call('HGET', KEYS[1], 'failures'))
+if not success then
+    failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+if requests >= min_requests and failures / requests >= error_rate then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'open_until', now + cooldown)
+    return 'open'
+end
+return 'closed'
+"""
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit for {host} is open, retry in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self):
+        self.error_rate = settings.HTTP_CIRCUIT_ERROR_RATE
+        self.min_requests = settings.HTTP_CIRCUIT_MIN_REQUESTS
+        self.window = settings.HTTP_CIRCUIT_WINDOW
+        self.cooldown = settings.HTTP_CIRCUIT_COOLDOWN
+        self.probe_timeout = settings.HTTP_CIRCUIT_PROBE_TIMEOUT
+        self.scripts = None
+
+    @property
+    def enabled(self):
+        return self.error_rate > 0
+
+    def get_scripts(self):
+        if self.scripts is None:
+            connection = get_redis_connection("default")
+            self.scripts = connection.register_script(BEFORE_SCRIPT), connection.register_script(AFTER_SCRIPT)
+        return self.scripts
+
+    @staticmethod
+    def get_key(host):
+        return f"circuit:{host}"
+
+    def before_request(self, host):
+        if not self.enabled:
+            return
+        try:
+            retry_after = float(self.get_scripts()[0](keys=[self.get_key(host)], args=[self.probe_timeout]))
+        except RedisError as e:
+            # Let traffic through when Redis is unavailable
+            logger.warning("Circuit breaker unavailable for %s: %s", host, e)
+            return
+        if retry_after > 0:
+            raise CircuitOpenError(host, retry_after)
+
+    def record(self, host, success):
+        if not self.enabled:
+            return None
+        ttl = int(max(self.window, self.cooldown + self.probe_timeout) * 2)
+        try:
+            state = self.get_scripts()[1](keys=[self.get_key(host)], args=[
+                1 if success else 0, self.error_rate, self.min_requests, self.window, self.cooldown, ttl])
+        except RedisError as e:
+            logger.warning("Circuit breaker unavailable for %s: %s", host, e)
+            return None
+        state = state.decode() if isinstance(state, bytes) else state
+        if state == "open" and not success:
+            logger.warning("Circuit for %s is open", host)
+        return state
@@ -0,0 +1,280 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from tf2modportal.circuitbreaker import CircuitBreaker
+from tf2modportal.ratelimit import RateLimiter
+from tf2modportal.replay import FixtureStore, RecordingAdapter, ReplayAdapter
+
+logger = logging.getLogger(__name__)
+
+
+# Overload and outage answers that request() retries with backoff
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class HttpStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = defaultdict(lambda: {"requests": 0, "errors": 0, "bytes": 0, "elapsed": 0.0})
+
+    def record(self, host, elapsed, num_bytes, error=False):
+        with self.lock:
+            host_stats = self.hosts[host]
+            host_stats["requests"] += 1
+            host_stats["bytes"] += num_bytes
+            host_stats["elapsed"] += elapsed
+            if error:
+                host_stats["errors"] += 1
+
+    def add_bytes(self, host, num_bytes):
+        with self.lock:
+            self.hosts[host]["bytes"] += num_bytes
+
+    def snapshot(self):
+        with self.lock:
+            return {host: dict(host_stats) for host, host_stats in self.hosts.items()}
+
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class DownloadVerificationError(Exception):
+    pass
+
+
+class DownloadResult:
+    def __init__(self, path, size, sha256):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+
+class HttpClient:
+    def __init__(self):
+        self.timeout = (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+        self.max_age = settings.HTTP_SESSION_MAX_AGE
+        self.created_at = time.monotonic()
+        self.pid = os.getpid()
+        self.stats = HttpStats()
+        self.rate_limiter = RateLimiter()
+        self.circuit_breaker = CircuitBreaker()
+        self.session = self.create_session()
+
+    def create_session(self):
+        # Retries happen in request(), where every attempt passes the rate limiter and the circuit breaker
+        # One urllib3 pool per host (pool_connections) with up to pool_maxsize kept-alive sockets each
+        adapter_kwargs = {
+            "pool_connections": settings.HTTP_POOL_CONNECTIONS,
+            "pool_maxsize": settings.HTTP_POOL_MAXSIZE,
+            "max_retries": 0,
+        }
+        if settings.HTTP_REPLAY_DIR:
+            adapter = ReplayAdapter(FixtureStore(settings.HTTP_REPLAY_DIR))
+        elif settings.HTTP_RECORD_DIR:
+            adapter = RecordingAdapter(FixtureStore(settings.HTTP_RECORD_DIR), **adapter_kwargs)
+        else:
+            adapter = HTTPAdapter(**adapter_kwargs)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "User-Agent": settings.HTTP_USER_AGENT,
+            "Accept-Encoding": "gzip, deflate",
+        })
+        return session
+
+    def is_expired(self):
+        return self.pid != os.getpid() or time.monotonic() - self.created_at > self.max_age
+
+    def close(self):
+        self.session.close()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        host = urlsplit(url).netloc
+        attempts = settings.HTTP_RETRIES + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                response = self.send(method, url, host, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == attempts:
+                    raise
+                delay = self.get_backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == attempts:
+                    return response
+                delay = max(self.get_backoff(attempt), self.get_retry_after(response))
+                response.close()
+            logger.info("%s %s failed, retrying in %.1fs (attempt %d/%d)", method, url, delay, attempt, attempts)
+            time.sleep(delay)
+
+    def send(self, method, url, host, **kwargs):
+        self.circuit_breaker.before_request(host)
+        self.rate_limiter.acquire(host)
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.stats.record(host, time.monotonic() - started, 0, error=True)
+            self.circuit_breaker.record(host, success=False)
+            raise
+        # Only outages count against the host, a 404 is a healthy answer
+        self.circuit_breaker.record(host, success=response.status_code < 500 and response.status_code != 429)
+        elapsed = time.monotonic() - started
+        # Streamed bodies are counted by the caller once they are consumed
+        num_bytes = 0 if kwargs.get("stream") else len(response.content)
+        self.stats.record(host, elapsed, num_bytes, error=response.status_code >= 400)
+        logger.debug("%s %s -> %s in %.3fs (%d bytes)", method, url, response.status_code, elapsed, num_bytes)
+        return response
+
+    @staticmethod
+    def get_backoff(attempt):
+        return settings.HTTP_BACKOFF_FACTOR * 2 ** (attempt - 1)
+
+    @staticmethod
+    def get_retry_after(response):
+        # Only the delta-seconds form, an HTTP date falls back to the exponential backoff
+        try:
+            return min(float(response.headers.get("Retry-After", 0)), settings.HTTP_RATE_LIMIT_MAX_WAIT)
+        except ValueError:
+            return 0
+
+    def iter_content(self, response, chunk_size=64 * 1024):
+        num_bytes = 0
+        try:
+            for chunk in response.iter_content(chunk_size):
+                num_bytes += len(chunk)
+                yield chunk
+        finally:
+            response.close()
+            self.stats.add_bytes(urlsplit(response.url).netloc, num_bytes)
+
+    def download(self, url, file_path, chunk_size=256 * 1024, **kwargs):
+        # Streams the body to a temp file next to file_path and renames it into place, hashing on the fly
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        response = self.get(url, stream=True, **kwargs)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as destination:
+                for chunk in self.iter_content(response, chunk_size):
+                    destination.write(chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return DownloadResult(file_path, size, hasher.hexdigest())
+
+    def download_resumable(self, url, file_path, expected_size=None, expected_sha256=None, chunk_size=256 * 1024):
+        # Like download(), but keeps a <name>.part file between attempts and continues it with a Range
+        # request after dropped connections or a failed task, then verifies the size/checksum.
+        file_path = Path(file_path)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = file_path.with_name(f"{file_path.name}.part")
+        attempts = settings.HTTP_RESUME_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                size, total = self.fetch_range(url, part_path, chunk_size)
+                break
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.Timeout):
+                if attempt == attempts:
+                    raise
+                logger.warning("Download of %s interrupted at %d bytes, resuming (attempt %d/%d)",
+                               url, part_path.stat().st_size if part_path.exists() else 0, attempt, attempts)
+
+        sha256 = hash_file(part_path)
+        expected_size = expected_size or total
+        if (expected_size is not None and size != expected_size) or (expected_sha256 and sha256 != expected_sha256):
+            part_path.unlink(missing_ok=True)
+            raise DownloadVerificationError(f"{url}: got {size} bytes / sha256 {sha256}, "
+                                            f"expected {expected_size} bytes / sha256 {expected_sha256}")
+        os.replace(part_path, file_path)
+        return DownloadResult(file_path, size, sha256)
+
+    def fetch_range(self, url, part_path, chunk_size):
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = self.get(url, stream=True, headers=headers)
+        if response.status_code == 416:
+            # Range starts past the end, so the partial file is stale or already complete; start over
+            response.close()
+            part_path.unlink(missing_ok=True)
+            offset = 0
+            response = self.get(url, stream=True)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            response.close()
+            raise
+        total = None
+        if response.status_code == 206:
+            content_range = response.headers.get("Content-Range", "")
+            if "/" in content_range and not content_range.endswith("/*"):
+                total = int(content_range.rsplit("/", 1)[1])
+        else:
+            # Server ignored the Range header and sent the whole body
+            offset = 0
+            if response.headers.get("Content-Length") and not response.headers.get("Content-Encoding"):
+                total = int(response.headers["Content-Length"])
+        size = offset
+        with open(part_path, "ab" if offset else "wb") as destination:
+            for chunk in self.iter_content(response, chunk_size):
+                destination.write(chunk)
+                size += len(chunk)
+        return size, total
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def close_http_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_http_client():
+    # Session is shared by every downloader in the worker process, recycled after HTTP_SESSION_MAX_AGE
+    # and never shared across a fork (Celery prefork children get their own pools).
+    global _client
+    with _client_lock:
+        if _client is None or _client.is_expired():
+            if _client is not None:
+                logger.info("Recycling HTTP session, stats: %s", _client.stats.snapshot())
+                _client.close()
+            _client = HttpClient()
+        return _client
@@ -0,0 +1,67 @@
+import logging
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+# Token bucket kept in a Redis hash per host, so every Celery worker draws from the same budget.
+# Uses the Redis clock to avoid skew between worker machines. Returns the seconds to wait for a
+# token (0 when one was taken).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class RateLimiter:
+    def __init__(self):
+        self.limits = settings.HTTP_RATE_LIMITS
+        self.max_wait = settings.HTTP_RATE_LIMIT_MAX_WAIT
+        self.script = None
+
+    def get_script(self):
+        if self.script is None:
+            self.script = get_redis_connection("default").register_script(TOKEN_BUCKET_SCRIPT)
+        return self.script
+
+    def acquire(self, host):
+        limit = self.limits.get(host)
+        if not limit:
+            return 0
+        rate, burst = limit
+        waited = 0
+        while True:
+            try:
+                wait = float(self.get_script()(keys=[f"ratelimit:{host}"], args=[rate, burst]))
+            except RedisError as e:
+                # Fail open, a Redis outage should not stop the crawl
+                logger.warning("Rate limiter unavailable for %s: %s", host, e)
+                return waited
+            if wait <= 0:
+                return waited
+            if waited + wait > self.max_wait:
+                raise RateLimitExceeded(f"No request slot for {host} within {self.max_wait}s")
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,84 @@
+import hashlib
+import json
+from io import BytesIO
+from pathlib import Path
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
+
+# Headers that describe the wire encoding; recorded bodies are stored already decoded
+SKIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+class FixtureStore:
+    # Directory of recorded responses, one <key>.json (status, headers) + <key>.body pair per request
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @staticmethod
+    def get_key(method, url):
+        return hashlib.sha256(f"{method.upper()} {url}".encode()).hexdigest()[:32]
+
+    def save(self, method, url, status_code, headers, body):
+        self.path.mkdir(parents=True, exist_ok=True)
+        key = self.get_key(method, url)
+        headers = {name: value for name, value in headers.items() if name.lower() not in SKIPPED_HEADERS}
+        (self.path / f"{key}.body").write_bytes(body)
+        (self.path / f"{key}.json").write_text(json.dumps({
+            "method": method.upper(),
+            "url": url,
+            "status_code": status_code,
+            "headers": headers,
+        }, indent=2))
+
+    def load(self, method, url):
+        key = self.get_key(method, url)
+        meta_path = self.path / f"{key}.json"
+        if not meta_path.exists():
+            return None
+        return json.loads(meta_path.read_text()), (self.path / f"{key}.body").read_bytes()
+
+
+class RecordingAdapter(HTTPAdapter):
+    # Passes requests through to the network and writes every response into a FixtureStore
+    def __init__(self, store, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.store = store
+
+    def send(self, request, stream=False, **kwargs):
+        response = super().send(request, stream=False, **kwargs)
+        self.store.save(request.method, request.url, response.status_code, response.headers, response.content)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    # Serves responses from a FixtureStore without touching the network
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        fixture = self.store.load(request.method, request.url)
+        if fixture is None:
+            raise requests.ConnectionError(f"No recorded response for {request.method} {request.url}",
+                                           request=request)
+        meta, body = fixture
+        headers = dict(meta["headers"], **{"Content-Length": str(len(body))})
+        raw = HTTPResponse(body=BytesIO(body), headers=headers, status=meta["status_code"], preload_content=False,
+                           decode_content=False)
+        response = requests.Response()
+        response.status_code = meta["status_code"]
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = raw
+        response.url = request.url
+        response.request = request
+        response.reason = "Replayed"
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        pass
@@ -2,13 +2,13 @@ import os
 import shutil
 import tarfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import requests
 from bs4 import BeautifulSoup
-from django.core.files.storage import default_storage
 
 from tf2modportal import settings
+from tf2modportal.http import get_http_client
 
 
 class BaseSourceModeDownloader:
@@ -24,9 +24,10 @@ class BaseSourceModeDownloader:
         self.linux_file_name = None
         self.windows_file_name = None
         self.model = None
+        self.client = get_http_client()
 
     def download(self):
-        response = requests.get(self.url)
+        response = self.client.get(self.url)
         response.raise_for_status()
 
         # Parse the HTML content
@@ -37,8 +38,12 @@ class BaseSourceModeDownloader:
         if self.version_exists():
             return {"status": "skipped", "version": self.version}
 
-        self.windows_file_name = self.download_file(windows_link, "windows")
-        self.linux_file_name = self.download_file(linux_link, "linux")
+        # Both platform packages are fetched at the same time over the shared client
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            windows_future = executor.submit(self.download_file, windows_link, "windows")
+            linux_future = executor.submit(self.download_file, linux_link, "linux")
+            self.windows_file_name = windows_future.result()
+            self.linux_file_name = linux_future.result()
         self.save_to_db()
 
     def get_download_links(self):
@@ -60,17 +65,12 @@ class BaseSourceModeDownloader:
         return link.split('/')[-1].split('-')[1]
 
     def download_file(self, link, platform):
-        response = requests.get(link)
-        response.raise_for_status()
         filename = Path(link).name
         if platform == "windows":
             file_path = self.windows_dir / filename
         else:
             file_path = self.linux_dir / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-
-        with default_storage.open(file_path, 'wb+') as destination:
-            destination.write(response.content)
+        self.client.download_resumable(link, file_path)
         return filename
 
     def save_to_db(self):
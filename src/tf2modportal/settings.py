@@ -166,18 +166,112 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CELERY_BROKER_URL = f"redis://:{os.environ.get('REDIS_PASSWORD')}@{os.environ.get('REDIS_HOST')}:{os.environ.get('REDIS_PORT')}/{os.environ.get('REDIS_DB')}"
-CELERY_RESULT_BACKEND = 'django-db'
+# django-db with per-task result policies, see core/results.py
+CELERY_RESULT_BACKEND = 'core.results:PolicyDatabaseBackend'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_TIMEZONE = 'Europe/Warsaw'
 CELERY_RESULT_EXTENDED = True
+# Old results are rolled up by core.tasks.compact_task_results instead of celery.backend_cleanup
+CELERY_RESULT_EXPIRES = None
+# Worker pool size (--concurrency), Celery uses the CPU count when it is not set
+CELERY_WORKER_CONCURRENCY = int(os.environ["CELERY_WORKER_CONCURRENCY"]) if os.environ.get(
+    "CELERY_WORKER_CONCURRENCY") else None
 CELERY_BEAT_SCHEDULE = {
     'get-plugins-every-hour': {
         'task': 'plugins.tasks.get_plugins',
         'schedule': 3600.0,
     },
+    'refresh-due-plugins-every-5-minutes': {
+        'task': 'plugins.tasks.refresh_due_plugins',
+        'schedule': 300.0,
+    },
+    'collect-unused-blobs-every-day': {
+        'task': 'core.tasks.collect_blobs',
+        'schedule': 86400.0,
+    },
+    'compact-task-results-every-day': {
+        'task': 'core.tasks.compact_task_results',
+        'schedule': 86400.0,
+    },
 }
+# What each task stores in the result backend: "full" (default), "lite" (no args/kwargs) or "none"
+TASK_RESULT_POLICIES = {
+    'plugins.tasks.get_plugin': 'lite',
+    'plugins.tasks.download_plugin_files': 'lite',
+    'plugins.tasks.download_plugin_file': 'none',
+    'plugins.tasks.download_tag_files': 'none',
+    'plugins.tasks.extract_downloads_files': 'lite',
+    'plugins.tasks.archive_plugin_files': 'lite',
+}
+# Days of TaskResult rows kept before they are rolled up into TaskResultAggregate
+TASK_RESULT_RETENTION_DAYS = int(os.environ.get("TASK_RESULT_RETENTION_DAYS", "3"))
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 2000
 
+# Shared HTTP client used by every downloader (see tf2modportal/http.py)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+# Retries of connection errors, 429 and 5xx answers; each attempt goes through the rate limiter and breaker
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5"))
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+# Kept-alive sockets per host, one per worker thread so a threads-pool worker does not discard connections
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", str(CELERY_WORKER_CONCURRENCY or 10)))
+HTTP_RESUME_ATTEMPTS = int(os.environ.get("HTTP_RESUME_ATTEMPTS", "5"))
+HTTP_SESSION_MAX_AGE = int(os.environ.get("HTTP_SESSION_MAX_AGE", "3600"))
+HTTP_USER_AGENT = os.environ.get("HTTP_USER_AGENT", "tf2modportal/0.1 (+https://github.com/Qwizi/TF2ModPortal)")
+# Record every response into / serve every response from a fixture directory (see tf2modportal/replay.py)
+HTTP_RECORD_DIR = os.environ.get("HTTP_RECORD_DIR")
+HTTP_REPLAY_DIR = os.environ.get("HTTP_REPLAY_DIR")
+# Per-host token buckets shared by all workers through Redis, "host=requests_per_second/burst,..."
+HTTP_RATE_LIMITS = {
+    host: tuple(float(value) for value in limit.split("/"))
+    for host, limit in (
+        item.split("=") for item in os.environ.get(
+            "HTTP_RATE_LIMITS", "forums.alliedmods.net=4/8,www.sourcemod.net=2/4,www.sourcemm.net=2/4"
+        ).split(",") if item
+    )
+}
+HTTP_RATE_LIMIT_MAX_WAIT = float(os.environ.get("HTTP_RATE_LIMIT_MAX_WAIT", "120"))
+# Per-host circuit breaker shared through Redis: opens when at least HTTP_CIRCUIT_ERROR_RATE of
+# HTTP_CIRCUIT_MIN_REQUESTS+ requests within HTTP_CIRCUIT_WINDOW seconds failed (0 disables it),
+# stays open for HTTP_CIRCUIT_COOLDOWN seconds, then lets a single probe decide
+HTTP_CIRCUIT_ERROR_RATE = float(os.environ.get("HTTP_CIRCUIT_ERROR_RATE", "0.5"))
+HTTP_CIRCUIT_MIN_REQUESTS = int(os.environ.get("HTTP_CIRCUIT_MIN_REQUESTS", "10"))
+HTTP_CIRCUIT_WINDOW = float(os.environ.get("HTTP_CIRCUIT_WINDOW", "60"))
+HTTP_CIRCUIT_COOLDOWN = float(os.environ.get("HTTP_CIRCUIT_COOLDOWN", "120"))
+HTTP_CIRCUIT_PROBE_TIMEOUT = float(os.environ.get("HTTP_CIRCUIT_PROBE_TIMEOUT", "60"))
+
+# sourcemod.net plugins.php "mod" ids to crawl (5 = Team Fortress 2)
+PLUGINS_LISTING_MODS = [int(mod) for mod in os.environ.get("PLUGINS_LISTING_MODS", "5").split(",")]
+# Number of unchanged listing rows re-scraped per incremental crawl, unchanged threads are normally
+# re-checked by the adaptive refresh below
+PLUGINS_CRAWL_REVERIFY_BATCH = int(os.environ.get("PLUGINS_CRAWL_REVERIFY_BATCH", "0"))
+# Adaptive per-thread refresh: seconds between checks grow by PLUGINS_REFRESH_BACKOFF while a thread
+# stays unchanged and reset to the minimum on a change
+PLUGINS_REFRESH_MIN_INTERVAL = int(os.environ.get("PLUGINS_REFRESH_MIN_INTERVAL", str(30 * 60)))
+PLUGINS_REFRESH_MAX_INTERVAL = int(os.environ.get("PLUGINS_REFRESH_MAX_INTERVAL", str(30 * 24 * 60 * 60)))
+PLUGINS_REFRESH_BACKOFF = float(os.environ.get("PLUGINS_REFRESH_BACKOFF", "2"))
+# Maximum number of due threads enqueued per refresh run
+PLUGINS_REFRESH_BATCH = int(os.environ.get("PLUGINS_REFRESH_BATCH", "200"))
+# Download the small files of a tag (.sp, .smx, ...) in one task with a thread pool instead of one
+# task per file. ZIP attachments always keep their own task.
+PLUGINS_DOWNLOAD_BATCH = os.environ.get("PLUGINS_DOWNLOAD_BATCH", "True") == "True"
+PLUGINS_DOWNLOAD_WORKERS = int(os.environ.get("PLUGINS_DOWNLOAD_WORKERS", "4"))
+PLUGINS_DOWNLOAD_ATTEMPTS = int(os.environ.get("PLUGINS_DOWNLOAD_ATTEMPTS", "3"))
+# Serve plugin downloads as ZIPs streamed from the tag's file tree instead of pre-built archives,
+# the archive stage then only marks tags as done. Tags downloaded PLUGINS_ARCHIVE_CACHE_THRESHOLD
+# times a day get their generated archive cached on disk (0 disables the cache), least recently
+# served archives are evicted beyond PLUGINS_ARCHIVE_CACHE_SIZE bytes.
+PLUGINS_STREAM_ARCHIVES = os.environ.get("PLUGINS_STREAM_ARCHIVES", "False") == "True"
+PLUGINS_ARCHIVE_CACHE_THRESHOLD = int(os.environ.get("PLUGINS_ARCHIVE_CACHE_THRESHOLD", "20"))
+PLUGINS_ARCHIVE_CACHE_SIZE = int(os.environ.get("PLUGINS_ARCHIVE_CACHE_SIZE", str(2 * 1024 * 1024 * 1024)))
+# TTLs of the in-flight locks that drop duplicate scrapes (per thread url) and downloads (per tag)
+PLUGINS_SCRAPE_LOCK_TIMEOUT = int(os.environ.get("PLUGINS_SCRAPE_LOCK_TIMEOUT", "3600"))
+PLUGINS_PIPELINE_LOCK_TIMEOUT = int(os.environ.get("PLUGINS_PIPELINE_LOCK_TIMEOUT", "7200"))
+# Disk budget in bytes of the build archives shared between identical builds, least recently used
+# archives are evicted beyond it
+BUILDS_ARTIFACT_CACHE_SIZE = int(os.environ.get("BUILDS_ARTIFACT_CACHE_SIZE", str(10 * 1024 * 1024 * 1024)))
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
@@ -0,0 +1,235 @@
+import hashlib
+import importlib.util
+import shutil
+import tempfile
+import time
+import unittest
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3 import HTTPResponse
+
+from tf2modportal.circuitbreaker import AFTER_SCRIPT, BEFORE_SCRIPT, CircuitBreaker, CircuitOpenError
+from tf2modportal.http import DownloadVerificationError, HttpClient
+from tf2modportal.ratelimit import TOKEN_BUCKET_SCRIPT, RateLimiter, RateLimitExceeded
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+# fakeredis runs the Lua scripts with lupa (the fakeredis[lua] extra)
+LUA_AVAILABLE = fakeredis is not None and importlib.util.find_spec("lupa") is not None
+
+
+class ScriptedAdapter(BaseAdapter):
+    # Answers requests from a list of (status, headers, body) tuples or exceptions, in order
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, request, stream=False, **kwargs):
+        self.requests.append(request)
+        answer = self.responses.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        status, headers, body = answer
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.raw = HTTPResponse(body=BytesIO(body), headers=headers, status=status, preload_content=False)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def get_scripted_client(responses):
+    client = HttpClient()
+    client.rate_limiter = mock.Mock()
+    client.circuit_breaker = mock.Mock()
+    client.adapter = ScriptedAdapter(responses)
+    client.session.mount("https://", client.adapter)
+    return client
+
+
+@override_settings(HTTP_RETRIES=2, HTTP_BACKOFF_FACTOR=0.5)
+class HttpClientRetryTests(SimpleTestCase):
+    @mock.patch("tf2modportal.http.time.sleep")
+    def test_retries_pass_the_rate_limiter_and_breaker(self, sleep):
+        client = get_scripted_client([(429, {"Retry-After": "3"}, b""), (503, {}, b""), (200, {}, b"ok")])
+        response = client.get("https://example.com/page")
+        self.assertEqual(response.content, b"ok")
+        self.assertEqual(client.rate_limiter.acquire.call_count, 3)
+        self.assertEqual(client.circuit_breaker.before_request.call_count, 3)
+        self.assertEqual([call.kwargs["success"] for call in client.circuit_breaker.record.call_args_list],
+                         [False, False, True])
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [3, 1])
+
+    @mock.patch("tf2modportal.http.time.sleep")
+    def test_last_answer_is_returned_after_the_retries(self, sleep):
+        client = get_scripted_client([(500, {}, b"")] * 3)
+        self.assertEqual(client.get("https://example.com/page").status_code, 500)
+        self.assertEqual(len(client.adapter.requests), 3)
+
+    @mock.patch("tf2modportal.http.time.sleep")
+    def test_connection_errors_are_retried(self, sleep):
+        client = get_scripted_client([requests.ConnectionError(), (200, {}, b"ok")])
+        self.assertEqual(client.get("https://example.com/page").content, b"ok")
+        client = get_scripted_client([requests.ConnectionError()] * 3)
+        with self.assertRaises(requests.ConnectionError):
+            client.get("https://example.com/page")
+
+    def test_client_errors_are_not_retried(self):
+        client = get_scripted_client([(404, {}, b"")])
+        self.assertEqual(client.get("https://example.com/page").status_code, 404)
+        client.circuit_breaker.record.assert_called_once_with("example.com", success=True)
+
+
+@override_settings(HTTP_RETRIES=0)
+class HttpClientDownloadTests(SimpleTestCase):
+    url = "https://example.com/plugin.zip"
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.file_path = self.directory / "plugin.zip"
+
+    def test_download_hashes_while_streaming(self):
+        client = get_scripted_client([(200, {}, b"abcdef")])
+        result = client.download(self.url, self.file_path, chunk_size=2)
+        self.assertEqual((result.size, result.sha256), (6, hashlib.sha256(b"abcdef").hexdigest()))
+        self.assertEqual(self.file_path.read_bytes(), b"abcdef")
+        self.assertEqual(list(self.directory.iterdir()), [self.file_path])
+
+    def test_failed_download_leaves_no_files(self):
+        client = get_scripted_client([(404, {}, b"")])
+        with self.assertRaises(requests.HTTPError):
+            client.download(self.url, self.file_path)
+
+        def dropped(response, chunk_size):
+            yield b"abc"
+            raise requests.ConnectionError()
+
+        client = get_scripted_client([(200, {}, b"abcdef")])
+        with mock.patch.object(client, "iter_content", side_effect=dropped), self.assertRaises(requests.ConnectionError):
+            client.download(self.url, self.file_path)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def write_part(self, content):
+        part_path = self.directory / "plugin.zip.part"
+        part_path.write_bytes(content)
+        return part_path
+
+    def test_partial_file_is_resumed_with_a_range(self):
+        self.write_part(b"abc")
+        client = get_scripted_client([(206, {"Content-Range": "bytes 3-5/6"}, b"def")])
+        result = client.download_resumable(self.url, self.file_path)
+        self.assertEqual(client.adapter.requests[0].headers["Range"], "bytes=3-")
+        self.assertEqual((result.size, result.sha256), (6, hashlib.sha256(b"abcdef").hexdigest()))
+        self.assertEqual(list(self.directory.iterdir()), [self.file_path])
+
+    def test_unsatisfiable_range_starts_over(self):
+        self.write_part(b"stale partial")
+        client = get_scripted_client([(416, {}, b""), (200, {"Content-Length": "6"}, b"abcdef")])
+        client.download_resumable(self.url, self.file_path)
+        self.assertNotIn("Range", client.adapter.requests[1].headers)
+        self.assertEqual(self.file_path.read_bytes(), b"abcdef")
+
+    def test_full_response_overwrites_the_partial_file(self):
+        self.write_part(b"xyz")
+        client = get_scripted_client([(200, {"Content-Length": "6"}, b"abcdef")])
+        result = client.download_resumable(self.url, self.file_path)
+        self.assertEqual(result.size, 6)
+        self.assertEqual(self.file_path.read_bytes(), b"abcdef")
+
+    @override_settings(HTTP_RESUME_ATTEMPTS=2)
+    def test_dropped_connection_is_resumed(self):
+        def dropped(response, chunk_size):
+            yield b"abc"
+            raise requests.exceptions.ChunkedEncodingError()
+
+        client = get_scripted_client([(200, {"Content-Length": "6"}, b"abcdef"),
+                                      (206, {"Content-Range": "bytes 3-5/6"}, b"def")])
+        chunks = [dropped, client.iter_content]
+        with mock.patch.object(client, "iter_content",
+                               side_effect=lambda response, chunk_size: chunks.pop(0)(response, chunk_size)):
+            client.download_resumable(self.url, self.file_path)
+        self.assertEqual(client.adapter.requests[1].headers["Range"], "bytes=3-")
+        self.assertEqual(self.file_path.read_bytes(), b"abcdef")
+
+    def test_verification_failure_discards_the_download(self):
+        client = get_scripted_client([(200, {}, b"abcdef")])
+        with self.assertRaises(DownloadVerificationError):
+            client.download_resumable(self.url, self.file_path, expected_sha256=hashlib.sha256(b"other").hexdigest())
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+
+@unittest.skipUnless(LUA_AVAILABLE, "fakeredis[lua] is not installed")
+@override_settings(HTTP_RATE_LIMITS={"example.com": (1, 2)}, HTTP_RATE_LIMIT_MAX_WAIT=0)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.limiter.script = fakeredis.FakeStrictRedis().register_script(TOKEN_BUCKET_SCRIPT)
+
+    def test_burst_then_limited(self):
+        self.assertEqual(self.limiter.acquire("example.com"), 0)
+        self.assertEqual(self.limiter.acquire("example.com"), 0)
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.acquire("example.com")
+
+    def test_unlimited_host(self):
+        for _ in range(5):
+            self.assertEqual(self.limiter.acquire("other.example.com"), 0)
+
+
+@unittest.skipUnless(LUA_AVAILABLE, "fakeredis[lua] is not installed")
+@override_settings(HTTP_CIRCUIT_ERROR_RATE=0.5, HTTP_CIRCUIT_MIN_REQUESTS=2, HTTP_CIRCUIT_WINDOW=60,
+                   HTTP_CIRCUIT_COOLDOWN=0.05, HTTP_CIRCUIT_PROBE_TIMEOUT=60)
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker()
+        connection = fakeredis.FakeStrictRedis()
+        self.breaker.scripts = connection.register_script(BEFORE_SCRIPT), connection.register_script(AFTER_SCRIPT)
+
+    def test_opens_on_error_rate(self):
+        self.assertEqual(self.breaker.record("example.com", True), "closed")
+        self.assertEqual(self.breaker.record("example.com", False), "open")
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request("example.com")
+
+    def test_stays_closed_below_min_requests(self):
+        self.assertEqual(self.breaker.record("example.com", False), "closed")
+        self.breaker.before_request("example.com")
+
+    def test_half_open_lets_one_probe_through(self):
+        self.breaker.record("example.com", False)
+        self.breaker.record("example.com", False)
+        time.sleep(0.1)
+        self.breaker.before_request("example.com")
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request("example.com")
+        self.assertEqual(self.breaker.record("example.com", True), "closed")
+        self.breaker.before_request("example.com")
+
+    def test_failed_probe_reopens(self):
+        self.breaker.record("example.com", False)
+        self.breaker.record("example.com", False)
+        time.sleep(0.1)
+        self.breaker.before_request("example.com")
+        self.assertEqual(self.breaker.record("example.com", False), "open")
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_request("example.com")
+
+    @override_settings(HTTP_CIRCUIT_ERROR_RATE=0)
+    def test_disabled(self):
+        breaker = CircuitBreaker()
+        self.assertIsNone(breaker.record("example.com", False))
+        breaker.before_request("example.com")